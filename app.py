@@ -1,165 +1,341 @@
-from flask import Flask, render_template, request, jsonify, send_file, session
-from werkzeug.security import generate_password_hash, check_password_hash
-import json
 import os
-import sys
+import time
+
+# Boot time is measured from here, or from the fork for a process forked after import (see STARTUP_BUDGET_SECONDS)
+BOOT_STARTED = time.perf_counter()
+
+def _reset_boot_clock():
+    global BOOT_STARTED
+    BOOT_STARTED = time.perf_counter()
+
+os.register_at_fork(after_in_child=_reset_boot_clock)
+
+from flask import Blueprint, Flask, Response, g, make_response, render_template, request, jsonify, send_file, session, stream_with_context
+import base64
+import hmac
+import json
+import threading
 import logging
 from datetime import datetime
-import google.generativeai as genai
 from pathlib import Path
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-me-in-production')
+# Read .env before the other modules read their settings from the environment
+ENV_PATH = Path(__file__).parent / '.env'
+load_dotenv(ENV_PATH)
 
-# Set up logging to see all output in systemd journal
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
-logger = logging.getLogger(__name__)
+from artifacts import ARTIFACT_FIELDS, ArtifactStore, has_document, load_documents, move_inline_documents, ref_field, store_documents
+from auth import TokenBuckets, hash_password, login_limits, needs_rehash, verify_password
+from cache import file_cache
+from batch import AI_BATCH_MAX_STUDENTS, AI_BATCH_STREAM_MAX_STUDENTS, run_batch
+from generation_cache import AI_CACHE_ENABLED, GenerationCache
+from generation import ARTIFACTS, FakeBackend, GeminiBackend, GenerationError, generate_artifact, stream_artifact
+from http_cache import finish_response, not_modified, set_body_etag
+from history import AI_PROMPT_NOTE_LIMIT, notes_to_summarize, prompt_metrics, update_summary
+from ids import IdGenerator
+from model_client import AI_MODEL, AI_TRANSPORT, ModelClient, ModelUnavailable
+from parsing import parse_stats
+from sessions import FileSessionStore, ServerSessionInterface, SessionEpoch
+from importer import ImportFormatError, read_roster
+from jobs import JobQueue, QueueFull
+from locking import atomic_write_json, file_lock, lock_path_for
+from logging_setup import configure_logging, logging_stats
+from metrics import metrics
+from notes import NOTE_MAX_LENGTH, NOTES_PAGE_SIZE, NoteLog, move_legacy_history
+from sqlite_store import SqliteArtifactStore, SqliteDatabase, SqliteNoteLog, SqliteSessionStore, SqliteStudentStore, SqliteUserStore
+from store import StudentStore, VersionConflict
 
-# Load environment variables from .env file
-env_path = Path(__file__).parent / '.env'
-logger.info(f"Looking for .env file at: {env_path}")
-logger.info(f".env file exists: {env_path.exists()}")
+logger = logging.getLogger(__name__)
 
-if env_path.exists():
-    load_dotenv(env_path)
-    logger.info("✓ .env file loaded successfully")
-else:
-    logger.warning("⚠ .env file not found!")
+# All routes; create_app() registers them on the Flask app
+bp = Blueprint('main', __name__)
 
 # Configuration
-DATA_DIR = Path(__file__).parent / 'data'
+# All data files live here (DATA_DIR overrides, e.g. a temporary directory in tests)
+DATA_DIR = Path(os.getenv('DATA_DIR', str(Path(__file__).parent / 'data')))
 STUDENTS_FILE = DATA_DIR / 'students.json'
 USERS_FILE = DATA_DIR / 'users.json'
+USERS_LOCK = lock_path_for(USERS_FILE)
+JOBS_DIR = DATA_DIR / 'jobs'
+NOTES_DIR = DATA_DIR / 'notes'
+ARTIFACTS_DIR = DATA_DIR / 'artifacts'
+ID_SLOTS_DIR = DATA_DIR / '.id-slots'
+METRICS_DIR = DATA_DIR / 'metrics'
+LOGIN_THROTTLE_FILE = DATA_DIR / 'login_throttle.bin'
+SESSIONS_DIR = DATA_DIR / 'sessions'
+SESSION_EPOCH_FILE = DATA_DIR / 'session_epoch.bin'
+GENERATION_CACHE_FILE = DATA_DIR / 'generation_cache.sqlite'
+# 'json' (default: students.json + journal, users.json) or 'sqlite'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+SQLITE_PATH = Path(os.getenv('SQLITE_PATH', str(DATA_DIR / 'studmgmt.sqlite')))
+# Where server-side sessions are kept: 'json' (one file each under data/sessions) or 'sqlite'; follows STORAGE_BACKEND
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', STORAGE_BACKEND).lower()
 API_KEY = os.getenv('GEMINI_API_KEY', '')
+# 'gemini' (default) or 'fake' for canned responses without calling the API
+AI_BACKEND = os.getenv('AI_BACKEND', 'gemini').lower()
+# Bearer token for Prometheus to scrape /metrics; without it /metrics needs a login
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-me-in-production')
+# Reverse proxies (nginx) in front of the app whose X-Forwarded-For is trusted; 0 when clients connect directly
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '1'))
+# A worker taking longer than this from import to ready logs a warning
+STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', '1'))
+# Set once run_startup_tasks() has run in this process. Workers forked from the gunicorn master
+# inherit it and skip the tasks; a new master (started or upgraded with USR2) runs them again.
+_startup_done = False
 
-logger.info(f"API_KEY loaded: {bool(API_KEY)}")
-if API_KEY:
-    logger.info(f"API_KEY preview: {API_KEY[:15]}...")
+# The objects below only record their settings; files, connections and
+# threads are opened on first use, so importing this module stays cheap.
+if STORAGE_BACKEND == 'sqlite':
+    # Students and users in one SQLite database (see migrate_to_sqlite.py)
+    database = SqliteDatabase(SQLITE_PATH)
+    student_store = SqliteStudentStore(database)
+    user_store = SqliteUserStore(database)
+    note_log = SqliteNoteLog(database)
+    artifact_store = SqliteArtifactStore(database)
 else:
-    logger.error("❌ API_KEY is empty - AI features will not work!")
+    # Lesson notes: one append-only file per student
+    note_log = NoteLog(NOTES_DIR)
+    # Generated documents: compressed files per student, document and version
+    artifact_store = ArtifactStore(ARTIFACTS_DIR)
+    # Student records: in-memory index backed by students.json plus an append-only journal
+    student_store = StudentStore(STUDENTS_FILE, note_log=note_log, artifact_store=artifact_store)
+    user_store = None
 
-# Initialize Generative AI
-if API_KEY:
-    try:
-        genai.configure(api_key=API_KEY)
-        logger.info("✓ Generative AI configured successfully")
-    except Exception as e:
-        logger.error(f"❌ Failed to configure Generative AI: {e}")
+# Logged-in users' id, name and role, kept server-side and cached in each worker
+if SESSION_BACKEND == 'sqlite':
+    session_store = SqliteSessionStore(database if STORAGE_BACKEND == 'sqlite' else SqliteDatabase(SQLITE_PATH))
 else:
-    logger.warning("⚠ Generative AI not configured - no API key")
+    session_store = FileSessionStore(SESSIONS_DIR)
+session_interface = ServerSessionInterface(session_store, SessionEpoch(SESSION_EPOCH_FILE))
+
+# Unique IDs across threads and gunicorn workers
+id_generator = IdGenerator(ID_SLOTS_DIR)
+
+# Background jobs for AI generation (?async=true on the AI endpoints)
+job_queue = JobQueue(JOBS_DIR)
 
-# Ensure data directory exists
-DATA_DIR.mkdir(exist_ok=True)
-logger.info(f"Data directory ready: {DATA_DIR}")
+# Failed-login limits per username and per client address, shared by all workers
+login_throttle = TokenBuckets(LOGIN_THROTTLE_FILE)
+
+# Reuses AI output when a student's prompt inputs have not changed (?force=true bypasses)
+generation_cache = GenerationCache(GENERATION_CACHE_FILE) if AI_CACHE_ENABLED else None
 
 # --- UTILITY FUNCTIONS ---
 def load_students():
-    """Load students from JSON file."""
-    if STUDENTS_FILE.exists():
-        with open(STUDENTS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    """Load all students as a dict keyed by id."""
+    return student_store.all()
 
 def save_students(students):
-    """Save students to JSON file."""
-    with open(STUDENTS_FILE, 'w') as f:
-        json.dump(students, f, indent=2)
+    """Save students, journaling only the records that changed."""
+    student_store.replace_all(students)
 
 def load_users():
-    """Load users from JSON file."""
-    if USERS_FILE.exists():
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    """Load users from JSON file (served from the per-worker cache while unchanged)."""
+    if user_store is not None:
+        return user_store.load()
+    return file_cache.load(USERS_FILE)
 
 def save_users(users):
-    """Save users to JSON file."""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    """Save users to JSON file atomically. Hold USERS_LOCK around load-modify-save."""
+    if user_store is not None:
+        user_store.save(users)
+        return
+    atomic_write_json(USERS_FILE, users)
+
+def parse_version(value):
+    """A record version sent by a client, as an int. Raises ValueError unless it is a whole number."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdecimal():
+        raise ValueError(f'Invalid version: {value!r}')
+    return int(value)
+
+def requested_version(data):
+    """Return (version, from_if_match): the record version a client based its edit on, if it sent one.
+
+    The body's 'version' wins over an If-Match header ("3", W/"3" or 3;
+    * matches any version). Raises ValueError for a malformed version.
+    """
+    version = (data or {}).get('version')
+    if version is not None:
+        return parse_version(version), False
+    header = request.headers.get('If-Match', '').strip()
+    if not header or header == '*':
+        return None, False
+    return parse_version(header.removeprefix('W/').strip('"')), True
 
 def is_logged_in():
     """Check if user is logged in."""
     return 'user_id' in session
 
+def is_teacher_manager():
+    """Check the role cached in the session at login (kept current by session_interface)."""
+    return session.get('role') == 'Teacher Manager'
+
+# --- REQUEST METRICS ---
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    """Count the request and time it once the whole body has been sent (streams included)."""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    labels = {'method': request.method, 'route': request.url_rule.rule if request.url_rule else 'unmatched'}
+    status = str(response.status_code)
+
+    def record():
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started, labels)
+        metrics.inc('http_requests_total', dict(labels, status=status))
+        metrics.maybe_flush()
+
+    response.call_on_close(record)
+    return response
+
+# Registered after record_request_metrics so it runs first and the 304 is what gets counted
+bp.after_app_request(finish_response)
+
 def init_default_admin():
     """Create default admin user if users database is empty. Ensure first teacher is Teacher Manager."""
-    users = load_users()
-    if not users:
-        users['admin'] = {
-            'username': 'admin',
-            'password': generate_password_hash('admin'),
-            'role': 'admin',
-            'created_at': datetime.now().isoformat()
-        }
-        save_users(users)
-        logger.info("✓ Default admin user created (username: admin, password: admin)")
-    else:
-        # Migrate old role names and ensure proper role assignment
-        changed = False
-        
-        # Count non-admin users
-        non_admin_users = [u for u in users.values() if u.get('role') != 'admin']
-        
-        logger.info(f"Found {len(non_admin_users)} non-admin users")
-        
-        for username, user in users.items():
-            if username == 'admin':
-                continue
+    with file_lock(USERS_LOCK):
+        users = load_users()
+        if not users:
+            users['admin'] = {
+                'username': 'admin',
+                'password': hash_password('admin'),
+                'role': 'admin',
+                'created_at': datetime.now().isoformat()
+            }
+            save_users(users)
+            logger.info("✓ Default admin user created (username: admin, password: admin)")
+        else:
+            # Migrate old role names and ensure proper role assignment
+            changed = False
+            
+            # Count non-admin users
+            non_admin_users = [u for u in users.values() if u.get('role') != 'admin']
+            
+            logger.debug("Found %s non-admin users", len(non_admin_users))
             
-            old_role = user.get('role')
-            logger.info(f"User {username} has role: {old_role}")
+            for username, user in users.items():
+                if username == 'admin':
+                    continue
+                
+                old_role = user.get('role')
+                role_changed = True
+                logger.debug("User %s has role: %s", username, old_role)
+                
+                # Convert old role names
+                if old_role == 'teacher_manager':
+                    user['role'] = 'Teacher Manager'
+                    changed = True
+                    logger.info("Migrated %s from 'teacher_manager' to 'Teacher Manager'", username)
+                elif old_role == 'teacher':
+                    user['role'] = 'Teacher'
+                    changed = True
+                    logger.info("Migrated %s from 'teacher' to 'Teacher'", username)
+                elif old_role is None:
+                    # Missing role - assign based on order
+                    user['role'] = 'Teacher'
+                    changed = True
+                    logger.info("Assigned default role 'Teacher' to %s", username)
+                else:
+                    role_changed = False
+                if role_changed:
+                    session_interface.update_user_sessions(username, role=user['role'])
             
-            # Convert old role names
-            if old_role == 'teacher_manager':
-                user['role'] = 'Teacher Manager'
-                changed = True
-                logger.info(f"Migrated {username} from 'teacher_manager' to 'Teacher Manager'")
-            elif old_role == 'teacher':
-                user['role'] = 'Teacher'
-                changed = True
-                logger.info(f"Migrated {username} from 'teacher' to 'Teacher'")
-            elif old_role is None:
-                # Missing role - assign based on order
-                user['role'] = 'Teacher'
-                changed = True
-                logger.info(f"Assigned default role 'Teacher' to {username}")
-        
-        # Make sure the oldest non-admin user is Teacher Manager
-        if len(non_admin_users) > 0:
-            # Find oldest user
-            oldest_user = min(non_admin_users, key=lambda u: u.get('created_at', ''))
-            oldest_username = oldest_user.get('username')
+            # Make sure the oldest non-admin user is Teacher Manager
+            if len(non_admin_users) > 0:
+                # Find oldest user
+                oldest_user = min(non_admin_users, key=lambda u: u.get('created_at', ''))
+                oldest_username = oldest_user.get('username')
+                
+                if oldest_user.get('role') != 'Teacher Manager':
+                    logger.info("Making %s a Teacher Manager (oldest user)", oldest_username)
+                    users[oldest_username]['role'] = 'Teacher Manager'
+                    changed = True
+                    session_interface.update_user_sessions(oldest_username, role='Teacher Manager')
             
-            if oldest_user.get('role') != 'Teacher Manager':
-                logger.info(f"Making {oldest_username} a Teacher Manager (oldest user)")
-                users[oldest_username]['role'] = 'Teacher Manager'
-                changed = True
+            if changed:
+                save_users(users)
+                logger.info("✓ User roles updated/migrated to new format")
         
-        if changed:
-            save_users(users)
-            logger.info("✓ User roles updated/migrated to new format")
-    
-    return users
-
-init_default_admin()
+        return users
 
 def generate_id():
-    """Generate a simple ID based on timestamp."""
-    return str(int(datetime.now().timestamp() * 1000))
+    """Generate a unique, time-ordered ID (see ids.py)."""
+    return id_generator.new_id()
+
+# --- STUDENT LIST HELPERS ---
+
+# Fields returned for fields=summary: everything except the generated documents and the
+# free-text lesson history (the roster shows lastNote; the full student has the rest)
+SUMMARY_FIELDS = (
+    'id', 'name', 'age', 'instrument', 'skillLevel', 'currentAssignments',
+    'currentGoals', 'noteCount', 'lastNote', 'timestamp', 'ownerId', 'version'
+)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+DEFAULT_SEARCH_LIMIT = 20
+
+def encode_cursor(key):
+    """Turn a (timestamp, id) index key into an opaque cursor string."""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a (timestamp, id) key. Raises ValueError if malformed."""
+    try:
+        timestamp, student_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    return (str(timestamp), str(student_id))
 
-@app.route('/')
+def parse_fields(fields_param):
+    """Parse a fields= projection. Returns None for 'all fields'."""
+    if not fields_param:
+        return None
+    fields = []
+    for field in fields_param.split(','):
+        field = field.strip()
+        if field == 'summary':
+            fields.extend(SUMMARY_FIELDS)
+        elif field:
+            fields.append(field)
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+def project_student(student, fields):
+    """Keep only the requested fields, flagging which generated documents exist.
+
+    Generated documents are read from the artifact store only when asked for.
+    """
+    if fields is None:
+        return load_documents(artifact_store, student)
+    requested = [field for field in fields if field in ARTIFACT_FIELDS]
+    if requested:
+        student = load_documents(artifact_store, student, requested)
+    row = {field: student[field] for field in fields if field in student}
+    row['hasRecommendations'] = has_document(student, 'recommendations')
+    row['hasLessonPlan'] = has_document(student, 'lessonPlan')
+    row['hasJourneyReport'] = has_document(student, 'journeyReport')
+    return row
+
+def student_filters(args):
+    """Collect the instrument/skillLevel/ownerId/name (prefix) list filters from the query string."""
+    filters = {key: args.get(key, '').strip() for key in ('instrument', 'skillLevel', 'ownerId', 'name')}
+    return {key: value for key, value in filters.items() if value} or None
+
+@bp.route('/')
 def index():
     """Serve the main page."""
-    return render_template('index.html')
+    return set_body_etag(make_response(render_template('index.html')))
 
 # --- AUTHENTICATION ENDPOINTS ---
 
-@app.route('/api/check-first-setup', methods=['GET'])
+@bp.route('/api/check-first-setup', methods=['GET'])
 def check_first_setup():
     """Check if this is the first setup (only admin exists)."""
     try:
@@ -167,23 +343,21 @@ def check_first_setup():
         teacher_count = sum(1 for u in users.values() if u.get('role') != 'admin')
         return jsonify({'needs_setup': teacher_count == 0}), 200
     except Exception as e:
-        logger.error(f"First setup check error: {e}")
+        logger.error("First setup check error: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/teachers', methods=['GET'])
+@bp.route('/api/teachers', methods=['GET'])
 def get_teachers():
     """Get list of all teachers. Only Teacher Manager can view."""
     if not is_logged_in():
         return jsonify({'error': 'Not logged in'}), 401
     
+    # Only Teacher Manager can view/manage teachers
+    if not is_teacher_manager():
+        return jsonify({'error': 'Unauthorized - only Teacher Managers can manage users'}), 403
+    
     try:
         users = load_users()
-        current_user = session.get('user_id')
-        
-        # Only Teacher Manager can view/manage teachers
-        if current_user not in users or users[current_user].get('role') != 'Teacher Manager':
-            return jsonify({'error': 'Unauthorized - only Teacher Managers can manage users'}), 403
-        
         teachers = [
             {'username': u['username'], 'role': u.get('role', 'Teacher'), 'created_at': u.get('created_at')}
             for u in users.values()
@@ -192,44 +366,46 @@ def get_teachers():
         
         return jsonify(teachers), 200
     except Exception as e:
-        logger.error(f"Get teachers error: {e}")
+        logger.error("Get teachers error: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/teachers/<username>', methods=['DELETE'])
+@bp.route('/api/teachers/<username>', methods=['DELETE'])
 def delete_teacher(username):
     """Delete a teacher account. Only Teacher Manager can delete."""
     if not is_logged_in():
         return jsonify({'error': 'Not logged in'}), 401
     
+    # Only Teacher Manager can delete teachers
+    if not is_teacher_manager():
+        return jsonify({'error': 'Unauthorized - only Teacher Managers can manage users'}), 403
+    
+    # Cannot delete yourself
+    if username == session.get('user_id'):
+        return jsonify({'error': 'Cannot delete your own account'}), 400
+    
+    # Cannot delete the admin account
+    if username == 'admin':
+        return jsonify({'error': 'Cannot delete admin account'}), 400
+    
     try:
-        users = load_users()
-        current_user = session.get('user_id')
-        
-        # Only Teacher Manager can delete teachers
-        if current_user not in users or users[current_user].get('role') != 'Teacher Manager':
-            return jsonify({'error': 'Unauthorized - only Teacher Managers can manage users'}), 403
-        
-        # Cannot delete yourself
-        if username == current_user:
-            return jsonify({'error': 'Cannot delete your own account'}), 400
-        
-        # Cannot delete the admin account
-        if username == 'admin':
-            return jsonify({'error': 'Cannot delete admin account'}), 400
-        
-        if username not in users:
-            return jsonify({'error': 'Teacher not found'}), 404
-        
-        del users[username]
-        save_users(users)
-        
-        logger.info(f"Teacher deleted: {username}")
-        return jsonify({'success': True, 'message': f'Teacher {username} deleted successfully'}), 200
+        with file_lock(USERS_LOCK):
+            users = load_users()
+            
+            if username not in users:
+                return jsonify({'error': 'Teacher not found'}), 404
+            
+            del users[username]
+            save_users(users)
+            # Log the deleted teacher out in every worker
+            ended = session_interface.end_user_sessions(username)
+            
+            logger.info("Teacher deleted: %s (%s sessions ended)", username, ended)
+            return jsonify({'success': True, 'message': f'Teacher {username} deleted successfully'}), 200
     except Exception as e:
-        logger.error(f"Delete teacher error: {e}")
+        logger.error("Delete teacher error: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/register', methods=['POST'])
+@bp.route('/api/register', methods=['POST'])
 def register():
     """Register a new teacher account. First teacher gets admin privileges."""
     try:
@@ -243,46 +419,58 @@ def register():
         if len(password) < 6:
             return jsonify({'error': 'Password must be at least 6 characters'}), 400
         
-        users = load_users()
-        teacher_count = sum(1 for u in users.values() if u.get('role') in ('Teacher', 'Teacher Manager'))
+        # Hash outside the lock so other account changes are not held up
+        password_hash = hash_password(password)
         
-        # After first teacher exists, only Teacher Manager can create new accounts
-        if teacher_count > 0:
-            if not is_logged_in():
-                return jsonify({'error': 'You must be logged in to create accounts'}), 401
+        with file_lock(USERS_LOCK):
+            users = load_users()
+            teacher_count = sum(1 for u in users.values() if u.get('role') in ('Teacher', 'Teacher Manager'))
             
-            # Check if logged-in user is Teacher Manager
-            current_user = session.get('user_id')
-            if current_user not in users or users[current_user].get('role') != 'Teacher Manager':
-                return jsonify({'error': 'Only Teacher Managers can create new accounts'}), 403
-        
-        if username in users:
-            return jsonify({'error': 'Username already exists'}), 409
-        
-        # First teacher gets "Teacher Manager" role
-        # Subsequent teachers get "Teacher" role by default (unless specified)
-        requested_role = data.get('role', 'Teacher')
-        role = 'Teacher Manager' if teacher_count == 0 else requested_role
-        
-        users[username] = {
-            'username': username,
-            'password': generate_password_hash(password),
-            'role': role,
-            'created_at': datetime.now().isoformat()
-        }
-        
-        save_users(users)
-        logger.info(f"New teacher account created: {username}")
+            # After first teacher exists, only Teacher Manager can create new accounts
+            if teacher_count > 0:
+                if not is_logged_in():
+                    return jsonify({'error': 'You must be logged in to create accounts'}), 401
+                
+                # Check if logged-in user is Teacher Manager
+                if not is_teacher_manager():
+                    return jsonify({'error': 'Only Teacher Managers can create new accounts'}), 403
+            
+            if username in users:
+                return jsonify({'error': 'Username already exists'}), 409
+            
+            # First teacher gets "Teacher Manager" role
+            # Subsequent teachers get "Teacher" role by default (unless specified)
+            requested_role = data.get('role', 'Teacher')
+            role = 'Teacher Manager' if teacher_count == 0 else requested_role
+            
+            users[username] = {
+                'username': username,
+                'password': password_hash,
+                'role': role,
+                'created_at': datetime.now().isoformat()
+            }
+            
+            save_users(users)
+        logger.info("New teacher account created: %s", username)
         
         return jsonify({
             'success': True,
             'username': username
         }), 201
     except Exception as e:
-        logger.error(f"Registration error: {e}")
+        logger.error("Registration error: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/login', methods=['POST'])
+def rehash_password(username, password):
+    """Re-hash a user's password with the current PASSWORD_HASH_METHOD (called after a successful login)."""
+    with file_lock(USERS_LOCK):
+        users = load_users()
+        if username in users and needs_rehash(users[username]['password']):
+            users[username]['password'] = hash_password(password)
+            save_users(users)
+            logger.info("Re-hashed password for %s with current parameters", username)
+
+@bp.route('/api/login', methods=['POST'])
 def login():
     """Login a teacher."""
     try:
@@ -293,20 +481,41 @@ def login():
         if not username or not password:
             return jsonify({'error': 'Username and password required'}), 400
         
+        # Checked before the (deliberately slow) password hash
+        limits = login_limits(username, request.remote_addr)
+        retry_after = login_throttle.take(limits)
+        if retry_after:
+            metrics.inc('login_attempts_total', {'outcome': 'throttled'})
+            logger.info("Login throttled for %s from %s", username, request.remote_addr)
+            seconds = max(1, round(retry_after))
+            response = jsonify({'error': f'Too many login attempts. Please try again in {seconds} seconds.'})
+            return response, 429, {'Retry-After': str(seconds)}
+        
         users = load_users()
         
         if username not in users:
+            metrics.inc('login_attempts_total', {'outcome': 'failed'})
             return jsonify({'error': 'Invalid username or password'}), 401
         
         user = users[username]
         
-        if not check_password_hash(user['password'], password):
+        if not verify_password(user['password'], password):
+            metrics.inc('login_attempts_total', {'outcome': 'failed'})
             return jsonify({'error': 'Invalid username or password'}), 401
         
+        # Only failed attempts count against the limits
+        login_throttle.give_back(limits)
+        metrics.inc('login_attempts_total', {'outcome': 'succeeded'})
+        if needs_rehash(user['password']):
+            rehash_password(username, password)
+        
+        # A new session id, so one issued before login cannot be reused after it
+        session.regenerate()
         session['user_id'] = username
         session['username'] = username
+        session['role'] = user.get('role', 'Teacher')
         
-        logger.info(f"User logged in: {username}")
+        logger.info("User logged in: %s", username)
         
         return jsonify({
             'success': True,
@@ -314,59 +523,164 @@ def login():
             'username': username
         }), 200
     except Exception as e:
-        logger.error(f"Login error: {e}")
+        logger.error("Login error: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 def logout():
     """Logout current user."""
     try:
         username = session.get('username', 'unknown')
         session.clear()
-        logger.info(f"User logged out: {username}")
+        logger.info("User logged out: %s", username)
         return jsonify({'success': True}), 200
     except Exception as e:
-        logger.error(f"Logout error: {e}")
+        logger.error("Logout error: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/current-user', methods=['GET'])
+@bp.route('/api/current-user', methods=['GET'])
 def current_user():
     """Get current logged-in user."""
     if 'user_id' in session:
-        try:
-            users = load_users()
-            user_id = session['user_id']
-            user_data = users.get(user_id, {})
-            return jsonify({
-                'user_id': user_id,
-                'username': session['username'],
-                'role': user_data.get('role', 'Teacher')
-            }), 200
-        except Exception as e:
-            logger.error(f"Error getting user info: {e}")
-            return jsonify({
-                'user_id': session['user_id'],
-                'username': session['username'],
-                'role': 'Teacher'
-            }), 200
-    return jsonify({'user_id': None}), 200
-
-@app.route('/api/students', methods=['GET'])
+        response = jsonify({
+            'user_id': session['user_id'],
+            'username': session['username'],
+            'role': session.get('role', 'Teacher')
+        })
+    else:
+        response = jsonify({'user_id': None})
+    return set_body_etag(response), 200
+
+@bp.route('/api/students', methods=['GET'])
 def get_students():
-    """Get all students."""
+    """Get students, newest first.
+
+    Optional query parameters:
+      instrument, skillLevel, ownerId, name (prefix) - filters
+      fields  - comma-separated projection; 'summary' leaves out generated documents and the lesson history
+      limit, cursor - page through results; the response becomes
+                      {'students': [...], 'nextCursor': ...}
+    
+    The X-Change-Seq header gives the change number to pass to
+    /api/students/changes next.
+    """
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    try:
+        # Unchanged since the client's copy: skip the scan and serialization entirely
+        etag = f"students-{student_store.state_token}"
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
+        filters = student_filters(request.args)
+        fields = parse_fields(request.args.get('fields'))
+        # Read before the scan: a write in between is then sent again as a change, never missed
+        headers = {'X-Change-Seq': str(student_store.change_seq)}
+        
+        if 'limit' not in request.args and 'cursor' not in request.args:
+            students, _ = student_store.scan(filters=filters)
+            response = jsonify([project_student(s, fields) for s in students])
+            response.set_etag(etag)
+            return response, 200, headers
+        
+        try:
+            limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+            after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        except ValueError:
+            return jsonify({'error': 'Invalid limit or cursor'}), 400
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        
+        students, next_key = student_store.scan(after=after, filters=filters, limit=limit)
+        response = jsonify({
+            'students': [project_student(s, fields) for s in students],
+            'nextCursor': encode_cursor(next_key) if next_key else None
+        })
+        response.set_etag(etag)
+        return response, 200, headers
+    except Exception as e:
+        logger.error("Error getting students: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/students/changes', methods=['GET'])
+def get_student_changes():
+    """Students added, updated or deleted since a change number.
+
+    Query parameters: since (the previous response's seq, or X-Change-Seq
+    from /api/students) and fields, as for /api/students.
+    Returns {'seq', 'full', 'students', 'deleted'}, oldest change first.
+    When the changes since then are no longer known, 'full' is true and
+    'students' holds every student, newest first, to replace the client's copy.
+    """
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    try:
+        try:
+            since = int(request.args.get('since', 0))
+        except ValueError:
+            return jsonify({'error': 'Invalid since'}), 400
+        fields = parse_fields(request.args.get('fields'))
+        
+        changes = student_store.changes(since)
+        if changes is None:
+            seq = student_store.change_seq
+            students, _ = student_store.scan()
+            deleted = []
+        else:
+            seq, students, deleted = changes
+        return jsonify({
+            'seq': seq,
+            'full': changes is None,
+            'students': [project_student(s, fields) for s in students],
+            'deleted': deleted
+        }), 200
+    except Exception as e:
+        logger.error("Error getting student changes: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/search', methods=['GET'])
+def search_students():
+    """Full-text search over names, assignments, goals, lesson notes and lesson plans.
+
+    Query parameters: q (required), limit (default 20), fields, and the same
+    filters as GET /api/students. Results are ranked best match first.
+    """
     if not is_logged_in():
         return jsonify({'error': 'Not logged in'}), 401
     try:
-        students_dict = load_students()
-        students = list(students_dict.values())
-        # Sort by timestamp descending
-        students.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        return jsonify(students), 200
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Query parameter q is required'}), 400
+        try:
+            limit = max(1, min(int(request.args.get('limit', DEFAULT_SEARCH_LIMIT)), MAX_PAGE_SIZE))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit'}), 400
+        fields = parse_fields(request.args.get('fields'))
+        
+        matches = student_store.search(query, limit=limit, filters=student_filters(request.args))
+        return jsonify({
+            'query': query,
+            'results': [dict(project_student(s, fields), score=score) for s, score in matches]
+        }), 200
+    except Exception as e:
+        logger.error("Search error: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/students/<student_id>', methods=['GET'])
+def get_student(student_id):
+    """Get a single student with every field (or a fields= projection)."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    try:
+        student = student_store.get(student_id)
+        if student is None:
+            return jsonify({'error': 'Student not found'}), 404
+        return jsonify(project_student(student, parse_fields(request.args.get('fields')))), 200
     except Exception as e:
-        logger.error(f"Error getting students: {e}")
+        logger.error("Error getting student: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/students', methods=['POST'])
+@bp.route('/api/students', methods=['POST'])
 def add_student():
     """Add a new student."""
     if not is_logged_in():
@@ -379,9 +693,8 @@ def add_student():
             return jsonify({'error': 'Missing required fields'}), 400
         
         student_id = generate_id()
-        students_dict = load_students()
         
-        students_dict[student_id] = {
+        student = {
             'id': student_id,
             'name': data.get('name'),
             'age': data.get('age') or None,
@@ -390,272 +703,602 @@ def add_student():
             'currentAssignments': data.get('currentAssignments'),
             'currentGoals': data.get('currentGoals', ''),
             'lessonNoteHistory': '',
-            'recommendations': json.dumps([]),
-            'lessonPlan': '',
-            'journeyReport': '',
             'timestamp': datetime.now().isoformat(),
             'ownerId': 'local-user'
         }
         
-        save_students(students_dict)
-        logger.info(f"Added student: {data.get('name')}")
-        return jsonify(students_dict[student_id]), 201
+        student_store.put(student)
+        logger.info("Added student: %s", data.get('name'))
+        return jsonify(project_student(student, None)), 201
     except Exception as e:
-        logger.error(f"Error adding student: {e}")
+        logger.error("Error adding student: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/students/<student_id>', methods=['PUT'])
+@bp.route('/api/students/<student_id>', methods=['PUT'])
 def update_student(student_id):
     """Update a student."""
     if not is_logged_in():
         return jsonify({'error': 'Not logged in'}), 401
+    from_if_match = False
     try:
         data = request.json
-        students_dict = load_students()
+        try:
+            expected_version, from_if_match = requested_version(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        student = student_store.get(student_id)
         
-        if student_id not in students_dict:
+        if student is None:
             return jsonify({'error': 'Student not found'}), 404
         
-        # Update fields
-        student = students_dict[student_id]
-        student['name'] = data.get('name', student['name'])
-        student['age'] = data.get('age') or None
-        student['instrument'] = data.get('instrument', student['instrument'])
-        student['skillLevel'] = data.get('skillLevel', student['skillLevel'])
-        student['currentAssignments'] = data.get('currentAssignments', student['currentAssignments'])
-        student['currentGoals'] = data.get('currentGoals', student['currentGoals'])
-        student['lessonNoteHistory'] = data.get('lessonNoteHistory', student['lessonNoteHistory'])
-        
-        save_students(students_dict)
-        logger.info(f"Updated student: {student['name']}")
-        return jsonify(student), 200
+        # Update fields (lesson notes are added through POST /api/students/<id>/notes, not here)
+        changes = {
+            'name': data.get('name', student['name']),
+            'age': data.get('age') or None,
+            'instrument': data.get('instrument', student['instrument']),
+            'skillLevel': data.get('skillLevel', student['skillLevel']),
+            'currentAssignments': data.get('currentAssignments', student['currentAssignments']),
+            'currentGoals': data.get('currentGoals', student['currentGoals'])
+        }
+        
+        # Compare-and-swap when the client says which version it edited
+        student = student_store.update(student_id, changes, expected_version=expected_version)
+        if student is None:
+            return jsonify({'error': 'Student not found'}), 404
+        
+        logger.info("Updated student: %s", student['name'])
+        return jsonify(project_student(student, None)), 200
+    except VersionConflict as e:
+        logger.warning("Update conflict for student %s: %s", student_id, e)
+        # A failed If-Match is a failed precondition; a stale body version a conflict
+        status = 412 if from_if_match else 409
+        return jsonify({'error': 'Student was changed by someone else. Reload and try again.', 'version': e.actual}), status
     except Exception as e:
-        logger.error(f"Error updating student: {e}")
+        logger.error("Error updating student: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/students/<student_id>', methods=['DELETE'])
+@bp.route('/api/students/<student_id>', methods=['DELETE'])
 def delete_student(student_id):
     """Delete a student."""
     if not is_logged_in():
         return jsonify({'error': 'Not logged in'}), 401
     try:
-        students_dict = load_students()
+        # Delete the student
+        student = student_store.delete(student_id)
         
-        if student_id not in students_dict:
+        if student is None:
             return jsonify({'error': 'Student not found'}), 404
         
-        # Get student name before deletion (for response)
-        student_name = students_dict[student_id]['name']
-        
-        # Delete the student
-        del students_dict[student_id]
-        save_students(students_dict)
+        student_name = student['name']
+        note_log.delete(student_id)
+        artifact_store.delete(student_id)
         
-        logger.info(f"Deleted student: {student_name}")
+        logger.info("Deleted student: %s", student_name)
         return jsonify({'success': True, 'message': f'Student {student_name} deleted successfully'}), 200
     except Exception as e:
-        logger.error(f"Error deleting student: {e}")
+        logger.error("Error deleting student: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/students/<student_id>/recommendations', methods=['POST'])
-def generate_recommendations(student_id):
-    """Generate song recommendations for a student."""
-    if not is_logged_in():
-        return jsonify({'error': 'Not logged in'}), 401
+def sync_note_summary(student_id):
+    """Copy the note count and latest note onto the record, for the roster.
     
-    logger.info(f"Generating recommendations for student: {student_id}")
-    logger.info(f"API_KEY present: {bool(API_KEY)}")
+    Reads the log after the record and saves with a version check, so
+    concurrent appends cannot leave an older note as the latest.
+    """
+    while True:
+        student = student_store.get(student_id)
+        if student is None:
+            return None
+        notes, _ = note_log.page(student_id, limit=1)
+        changes = {'noteCount': notes[0]['seq'], 'lastNote': notes[0]} if notes else {}
+        try:
+            return student_store.update(student_id, changes, expected_version=student.get('version'))
+        except VersionConflict:
+            continue
+
+@bp.route('/api/students/<student_id>/notes', methods=['GET'])
+def get_notes(student_id):
+    """Get a student's lesson notes, newest first.
     
+    Query parameters: limit (default 20), before - only notes with a lower
+    seq, for the next page (pass the previous response's nextBefore).
+    """
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
     try:
-        if not API_KEY:
-            logger.error("❌ API_KEY is not configured")
-            return jsonify({'error': 'Gemini API key not configured'}), 500
+        if student_id not in student_store:
+            return jsonify({'error': 'Student not found'}), 404
+        try:
+            limit = max(1, min(int(request.args.get('limit', NOTES_PAGE_SIZE)), MAX_PAGE_SIZE))
+            before = int(request.args['before']) if request.args.get('before') else None
+        except ValueError:
+            return jsonify({'error': 'Invalid limit or before'}), 400
         
-        students_dict = load_students()
-        if student_id not in students_dict:
+        notes, next_before = note_log.page(student_id, before=before, limit=limit)
+        return jsonify({'notes': notes, 'nextBefore': next_before}), 200
+    except Exception as e:
+        logger.error("Error getting notes: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/students/<student_id>/notes', methods=['POST'])
+def add_note(student_id):
+    """Append a lesson note. Body: {"text": "..."}. Older notes are never rewritten."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    try:
+        text = ((request.json or {}).get('text') or '').strip()
+        if not text:
+            return jsonify({'error': 'Note text is required'}), 400
+        if len(text) > NOTE_MAX_LENGTH:
+            return jsonify({'error': f'Notes are limited to {NOTE_MAX_LENGTH} characters'}), 400
+        if student_id not in student_store:
             return jsonify({'error': 'Student not found'}), 404
         
-        student = students_dict[student_id]
-        logger.info(f"Found student: {student['name']}")
+        note = note_log.append(student_id, text, author=session.get('user_id'))
+        student = sync_note_summary(student_id)
+        if student is None:
+            note_log.delete(student_id)
+            return jsonify({'error': 'Student not found'}), 404
         
-        # Create the prompt
-        system_prompt = """You are a music teacher assistant. Generate a list of 5 pieces appropriate for the specified instrument, skill level, and student goals.
+        logger.info("Added note %s for student: %s", note['seq'], student['name'])
+        return jsonify({'note': note, 'version': student['version']}), 201
+    except Exception as e:
+        logger.error("Error adding note: %s", e)
+        return jsonify({'error': str(e)}), 500
 
-Your entire response MUST be a single, valid JSON array string (e.g., [ { "title": "...", ... } ]).
-Do not include any text, markdown, or apologies before or after the JSON array.
+# One model client per worker: reuses the model object and shares the circuit breaker
+model_client = ModelClient(FakeBackend() if AI_BACKEND == 'fake' else GeminiBackend(AI_MODEL, api_key=API_KEY, transport=AI_TRANSPORT or None))
 
-Each object in the array must have these keys: "title", "composer", "focus"."""
-        
-        user_query = f"""{system_prompt}
+def ai_backend():
+    """Return the model client used for AI generation (AI_BACKEND=fake for offline use)."""
+    return model_client
 
-Generate song recommendations for a {student['instrument']} student at the {student['skillLevel']} level.
-Student Goals: {student.get('currentGoals') or 'Not specified'}
-Student Lesson History: {student.get('lessonNoteHistory') or 'Not specified'}"""
-        
-        logger.info("Calling Gemini API...")
-        # Call Gemini API
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content(user_query)
-        
-        logger.info("Gemini API response received")
-        
-        # Parse the response
-        response_text = response.text.strip()
-        
-        # Remove markdown code fence if present
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]  # Remove ```json
-        elif response_text.startswith('```'):
-            response_text = response_text[3:]  # Remove ```
-        
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]  # Remove trailing ```
-        
-        response_text = response_text.strip()
-        logger.info(f"Cleaned response: {response_text[:100]}")
-        
-        recommendations = json.loads(response_text)
+def ai_unavailable():
+    """Return an error response if AI generation cannot run, else None."""
+    if AI_BACKEND != 'fake' and not API_KEY:
+        logger.error("❌ API_KEY is not configured")
+        return jsonify({'error': 'Gemini API key not configured'}), 500
+    return None
+
+def request_flag(name):
+    """Read a true/false option from the query string or the JSON body."""
+    value = request.args.get(name) or (request.get_json(silent=True) or {}).get(name)
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def wants_async():
+    """True when the client asked for a background job instead of waiting."""
+    return request_flag('async')
+
+def generation_input(student):
+    """The student as the prompt builders see it: the record plus its rolling note summary and newest notes.
+    
+    Notes not yet covered by the summary are attached (up to AI_PROMPT_NOTE_LIMIT);
+    when too many have piled up, a background job folds the older ones into the summary.
+    """
+    note_count = student.get('noteCount') or 0
+    if not note_count:
+        return student
+    summary = note_log.summary(student['id'])
+    unsummarized = note_count - (summary or {}).get('throughSeq', 0)
+    recent = note_log.recent(student['id'], min(unsummarized, AI_PROMPT_NOTE_LIMIT)) if unsummarized > 0 else []
+    if notes_to_summarize(note_count, summary):
+        schedule_note_summary(student['id'])
+    return dict(student, noteSummary=summary, recentNotes=recent)
+
+# Students with a summary job queued or running in this worker
+summaries_pending = set()
+summaries_pending_lock = threading.Lock()
+
+def schedule_note_summary(student_id):
+    """Queue a background update of a student's rolling note summary (at most one per student)."""
+    with summaries_pending_lock:
+        if student_id in summaries_pending:
+            return
+        summaries_pending.add(student_id)
+    try:
+        job_queue.submit('historySummary', lambda progress: refresh_note_summary(student_id), studentId=student_id)
+    except QueueFull:
+        # Not urgent: the next generation will try again
+        with summaries_pending_lock:
+            summaries_pending.discard(student_id)
+
+def refresh_note_summary(student_id):
+    """Fold the notes that have left the recent window into the student's summary."""
+    try:
+        student = student_store.get(student_id)
+        if student is None:
+            return None
+        summary = note_log.summary(student_id)
+        span = notes_to_summarize(student.get('noteCount') or 0, summary)
+        if span is None:
+            return None
+        after, through = span
+        notes, _ = note_log.page(student_id, before=through + 1, limit=through - after)
+        summary = update_summary(student, summary, list(reversed(notes)), ai_backend(), cache=generation_cache)
+        note_log.save_summary(student_id, summary)
+        return {'throughSeq': summary['throughSeq']}
+    finally:
+        with summaries_pending_lock:
+            summaries_pending.discard(student_id)
+
+def run_generation(kind, student_id, progress=None, force=False):
+    """Generate one artifact for a student and save it. Returns the parsed result."""
+    student = student_store.get(student_id)
+    if student is None:
+        raise KeyError(student_id)
+    student = generation_input(student)
+    logger.debug("Found student: %s", student['name'])
+    
+    if progress:
+        progress('Calling the AI model')
+    value, changes = generate_artifact(kind, student, ai_backend(), cache=generation_cache, force=force)
+    
+    if progress:
+        progress('Saving')
+    # The document goes to the artifact store, a reference to it on the student record
+    student_store.update(student_id, store_documents(artifact_store, student_id, changes))
+    return value
+
+def handle_generation(kind, student_id):
+    """Shared handler for the AI endpoints: run inline, or queue a job when async is requested."""
+    label = ARTIFACTS[kind]['label']
+    logger.info("Generating %s for student: %s", label, student_id)
+    
+    try:
+        error_response = ai_unavailable()
+        if error_response:
+            return error_response
         
-        # Save to student record
-        student['recommendations'] = json.dumps(recommendations)
-        save_students(students_dict)
+        if student_id not in student_store:
+            return jsonify({'error': 'Student not found'}), 404
         
-        logger.info(f"✓ Generated {len(recommendations)} recommendations")
-        return jsonify({'recommendations': recommendations}), 200
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {e}")
-        return jsonify({'error': 'Failed to parse AI response as JSON'}), 500
+        force = request_flag('force')
+        if wants_async():
+            job = job_queue.submit(
+                kind,
+                lambda progress: {kind: run_generation(kind, student_id, progress, force=force)},
+                studentId=student_id,
+                submittedBy=session.get('user_id')
+            )
+            logger.info("Queued %s job %s", label, job['id'])
+            return jsonify(job), 202
+        
+        value = run_generation(kind, student_id, force=force)
+        logger.info("✓ Generated %s", label)
+        return jsonify({kind: value}), 200
+    except KeyError:
+        return jsonify({'error': 'Student not found'}), 404
+    except QueueFull as e:
+        logger.warning("AI job queue full: %s", e)
+        return jsonify({'error': 'Too many AI requests in progress. Please try again shortly.'}), 503
+    except ModelUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    except GenerationError as e:
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
-        logger.error(f"❌ Error generating recommendations: {e}", exc_info=True)
+        logger.error("❌ Error generating %s: %s", label, e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/students/<student_id>/lesson-plan', methods=['POST'])
+@bp.route('/api/students/<student_id>/recommendations', methods=['POST'])
+def generate_recommendations(student_id):
+    """Generate song recommendations for a student. Add ?async=true to get a job id instead."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    return handle_generation('recommendations', student_id)
+
+@bp.route('/api/students/<student_id>/lesson-plan', methods=['POST'])
 def generate_lesson_plan(student_id):
-    """Generate an 8-week lesson plan for a student."""
+    """Generate an 8-week lesson plan for a student. Add ?async=true to get a job id instead."""
     if not is_logged_in():
         return jsonify({'error': 'Not logged in'}), 401
-    
-    logger.info(f"Generating lesson plan for student: {student_id}")
-    
+    return handle_generation('lessonPlan', student_id)
+
+@bp.route('/api/students/<student_id>/journey-report', methods=['POST'])
+def generate_journey_report(student_id):
+    """Generate a musician's journey report for a student. Add ?async=true to get a job id instead."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    return handle_generation('journeyReport', student_id)
+
+@bp.route('/api/students/<student_id>/documents/<field>', methods=['GET'])
+def get_document_versions(student_id, field):
+    """Stored versions of a generated document (recommendations, lessonPlan, journeyReport), newest first."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    if field not in ARTIFACT_FIELDS:
+        return jsonify({'error': f"Document must be one of: {', '.join(ARTIFACT_FIELDS)}"}), 400
     try:
-        if not API_KEY:
-            logger.error("❌ API_KEY is not configured")
-            return jsonify({'error': 'Gemini API key not configured'}), 500
-        
-        students_dict = load_students()
-        if student_id not in students_dict:
+        student = student_store.get(student_id)
+        if student is None:
             return jsonify({'error': 'Student not found'}), 404
-        
-        student = students_dict[student_id]
-        logger.info(f"Found student: {student['name']}")
-        
-        # Create the prompt
-        system_prompt = """You are an expert music educator. Create a structured 8-week lesson plan tailored to the student's instrument, materials, goals, and history. The plan should balance technical exercises, sight-reading, and repertoire.
-Format the response in clean Markdown. Use headings (e.g., '### Week 1-2: Focus on Technique') and bullet points for clarity. 
-Ensure new information starts on a new line. Do not use horizontal rules (---) or asterisks for bullets; use dashes (-) instead."""
-        
-        user_query = f"""{system_prompt}
+        return jsonify({
+            'current': student.get(ref_field(field)),
+            'versions': artifact_store.versions(student_id, field)
+        }), 200
+    except Exception as e:
+        logger.error("Error listing document versions: %s", e)
+        return jsonify({'error': str(e)}), 500
 
-Create an 8-week plan for this {student['instrument']} student.
-Current Materials: {student['currentAssignments']}
-Student Goals: {student.get('currentGoals') or 'Not specified'}
-Lesson Note History: {student.get('lessonNoteHistory') or 'Not specified'}"""
-        
-        logger.info("Calling Gemini API for lesson plan...")
-        # Call Gemini API
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content(user_query)
-        
-        plan_text = response.text
-        
-        # Save to student record
-        student['lessonPlan'] = plan_text
-        save_students(students_dict)
-        
-        logger.info("✓ Lesson plan generated successfully")
-        return jsonify({'lessonPlan': plan_text}), 200
+@bp.route('/api/students/<student_id>/documents/<field>/<int:version>', methods=['GET'])
+def get_document_version(student_id, field, version):
+    """One stored version of a generated document."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    if field not in ARTIFACT_FIELDS:
+        return jsonify({'error': f"Document must be one of: {', '.join(ARTIFACT_FIELDS)}"}), 400
+    try:
+        if student_id not in student_store:
+            return jsonify({'error': 'Student not found'}), 404
+        content = artifact_store.get(student_id, field, version)
+        if content is None:
+            return jsonify({'error': 'Version not found'}), 404
+        return jsonify({'version': version, field: content}), 200
     except Exception as e:
-        logger.error(f"❌ Error generating lesson plan: {e}", exc_info=True)
+        logger.error("Error getting document version: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/students/<student_id>/journey-report', methods=['POST'])
-def generate_journey_report(student_id):
-    """Generate a musician's journey report for a student."""
+def batch_events(kind, students, missing, backend, force):
+    """Run a batch generation, yielding one result per student as it finishes, then a summary.
+    
+    All results are saved with a single store write at the end, or, if the
+    consumer stops part way through, whatever had finished by then.
+    """
+    changes_by_id = {}
+    failed = len(missing)
+    saved = False
+    try:
+        for student_id in missing:
+            yield {'studentId': student_id, 'ok': False, 'error': 'Student not found'}
+        for result in run_batch(kind, students, backend, cache=generation_cache, force=force):
+            if result['ok']:
+                changes = result.pop('changes')
+                changes_by_id[result['studentId']] = store_documents(artifact_store, result['studentId'], changes)
+            else:
+                failed += 1
+            yield result
+        student_store.update_many(changes_by_id)
+        saved = True
+        logger.info("✓ Batch %s: %s saved, %s failed", ARTIFACTS[kind]['label'], len(changes_by_id), failed)
+        yield {'done': True, 'succeeded': len(changes_by_id), 'failed': failed}
+    finally:
+        if not saved and changes_by_id:
+            student_store.update_many(changes_by_id)
+
+def run_batch_job(kind, students, missing, backend, force, progress):
+    """Background job body for a batch: reports progress per student, returns the summary and the failures."""
+    total = len(students) + len(missing)
+    finished = 0
+    errors = []
+    for event in batch_events(kind, students, missing, backend, force):
+        if event.get('done'):
+            return {'succeeded': event['succeeded'], 'failed': event['failed'], 'errors': errors}
+        finished += 1
+        if not event['ok']:
+            errors.append({'studentId': event['studentId'], 'error': event['error']})
+        progress(f'Generated {finished} of {total}')
+
+@bp.route('/api/ai-batch', methods=['POST'])
+def generate_batch():
+    """Generate one AI document type for many students.
+    
+    Body: {"kind": "recommendations" | "lessonPlan" | "journeyReport", "studentIds": [...], "force": false}
+    Streams newline-delimited JSON: one line per student as it finishes, then a summary line.
+    With async=true the batch runs as a background job instead (required above
+    AI_BATCH_STREAM_MAX_STUDENTS, so a long batch does not outlast the worker timeout).
+    All results are saved with a single store write.
+    """
     if not is_logged_in():
         return jsonify({'error': 'Not logged in'}), 401
+    try:
+        error_response = ai_unavailable()
+        if error_response:
+            return error_response
+        
+        data = request.json or {}
+        kind = data.get('kind')
+        student_ids = data.get('studentIds') or []
+        if kind not in ARTIFACTS:
+            return jsonify({'error': f"kind must be one of: {', '.join(ARTIFACTS)}"}), 400
+        if not isinstance(student_ids, list) or not student_ids:
+            return jsonify({'error': 'studentIds must be a non-empty list'}), 400
+        if len(student_ids) > AI_BATCH_MAX_STUDENTS:
+            return jsonify({'error': f'At most {AI_BATCH_MAX_STUDENTS} students per batch'}), 400
+        background = wants_async()
+        if not background and len(student_ids) > AI_BATCH_STREAM_MAX_STUDENTS:
+            return jsonify({'error': f'Batches of more than {AI_BATCH_STREAM_MAX_STUDENTS} students must run as a job (async=true)'}), 400
+        
+        student_ids = list(dict.fromkeys(str(i) for i in student_ids))
+        students = [generation_input(s) for s in (student_store.get(i) for i in student_ids) if s is not None]
+        missing = [i for i in student_ids if i not in {s['id'] for s in students}]
+        force = request_flag('force')
+        backend = ai_backend()
+        logger.info("Batch %s requested for %s students", ARTIFACTS[kind]['label'], len(student_ids))
+        
+        if background:
+            job = job_queue.submit(
+                'batch',
+                lambda progress: run_batch_job(kind, students, missing, backend, force, progress),
+                document=kind,
+                studentCount=len(student_ids),
+                submittedBy=session.get('user_id')
+            )
+            logger.info("Queued batch job %s", job['id'])
+            return jsonify(job), 202
+    except QueueFull as e:
+        logger.warning("AI job queue full: %s", e)
+        return jsonify({'error': 'Too many AI requests in progress. Please try again shortly.'}), 503
+    except Exception as e:
+        logger.error("Error starting batch: %s", e)
+        return jsonify({'error': str(e)}), 500
     
-    logger.info(f"Generating journey report for student: {student_id}")
+    def stream():
+        events = batch_events(kind, students, missing, backend, force)
+        try:
+            for event in events:
+                yield json.dumps(event) + '\n'
+        finally:
+            # A client gone part way through still gets what finished saved
+            events.close()
     
+    return Response(
+        stream_with_context(stream()),
+        mimetype='application/x-ndjson',
+        # Sent to the client as each student finishes, not held back by nginx
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/ai-cache/stats', methods=['GET'])
+def get_ai_cache_stats():
+    """Hit/miss counters for the AI generation cache."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
     try:
-        if not API_KEY:
-            logger.error("❌ API_KEY is not configured")
-            return jsonify({'error': 'Gemini API key not configured'}), 500
-        
-        students_dict = load_students()
-        if student_id not in students_dict:
-            return jsonify({'error': 'Student not found'}), 404
-        
-        student = students_dict[student_id]
-        logger.info(f"Found student: {student['name']}")
-        
-        # Determine if adult
+        if generation_cache is None:
+            return jsonify({'enabled': False}), 200
+        return jsonify(generation_cache.stats()), 200
+    except Exception as e:
+        logger.error("Error getting AI cache stats: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/ai-prompt/stats', methods=['GET'])
+def get_ai_prompt_stats():
+    """Prompt size metrics per AI document type (this worker process)."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    return jsonify(prompt_metrics.snapshot()), 200
+
+@bp.route('/api/ai-parse/stats', methods=['GET'])
+def get_ai_parse_stats():
+    """How AI recommendation responses were parsed: directly, after which repair, by re-prompting, or not at all."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    return jsonify(parse_stats.snapshot()), 200
+
+def process_metrics():
+    """Values this worker already keeps, sampled into its metrics file."""
+    samples = [
+        ('jobs_in_flight', None, job_queue.in_flight),
+        ('ai_calls_in_flight', None, model_client.in_flight),
+        ('ai_circuit_open', None, int(model_client.breaker.state != 'closed')),
+        ('file_cache_hits_total', None, file_cache.hits),
+        ('file_cache_misses_total', None, file_cache.misses),
+    ]
+    log_counts = logging_stats()
+    samples.append(('log_records_dropped_total', None, log_counts['dropped']))
+    samples.append(('log_records_sampled_total', None, log_counts['sampled']))
+    samples += [('ai_parse_total', {'path': path}, count) for path, count in parse_stats.snapshot().items()]
+    for kind, entry in prompt_metrics.snapshot().items():
+        samples.append(('ai_prompts_total', {'kind': kind}, entry['calls']))
+        samples.append(('ai_prompt_tokens_total', {'kind': kind}, entry['promptTokensTotal']))
+    return samples
+
+def generation_cache_metrics():
+    """Generation cache counters, already shared by all workers in its database."""
+    if generation_cache is None:
+        return []
+    stats = generation_cache.stats()
+    samples = [('ai_cache_entries', None, stats['entries'])]
+    for kind, counts in stats['byKind'].items():
+        samples.append(('ai_cache_hits_total', {'kind': kind}, counts['hits']))
+        samples.append(('ai_cache_misses_total', {'kind': kind}, counts['misses']))
+    return samples
+
+metrics.register(process_metrics)
+metrics.register_shared(generation_cache_metrics)
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for the whole server, summed over all worker processes."""
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+            return jsonify({'error': 'Invalid metrics token'}), 401
+    elif not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    try:
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        logger.error("Error rendering metrics: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def handle_streaming_generation(kind, student_id):
+    """Shared handler for the streaming AI endpoints.
+    
+    Sends 'chunk' events with model output as it arrives, then a 'done' event
+    with the full document once it has been saved (or an 'error' event).
+    """
+    label = ARTIFACTS[kind]['label']
+    logger.info("Streaming %s for student: %s", label, student_id)
+    
+    error_response = ai_unavailable()
+    if error_response:
+        return error_response
+    student = student_store.get(student_id)
+    if student is None:
+        return jsonify({'error': 'Student not found'}), 404
+    student = generation_input(student)
+    force = request_flag('force')
+    backend = ai_backend()
+    
+    def stream():
         try:
-            age = int(student.get('age') or 0)
-            is_adult = age > 18
-        except:
-            is_adult = False
-        
-        logger.info(f"Student age check: is_adult={is_adult}")
-        
-        # Create appropriate prompt
-        if is_adult:
-            system_prompt = """You are an expert music educator drafting an encouraging "Musician's Journey Report" for an adult student.
-The tone should be positive, professional, and collaborative.
-The report must cover:
-1.  **Student's Progress:** Summarize their progress based on lesson history.
-2.  **Achievements:** Highlight key pieces mastered or skills developed.
-3.  **Goal Achievement:** How they have successfully (or are in the process of) achieving their stated goals.
-4.  **Looking Forward:** A brief look at what skills and concepts you plan to cover next.
-Format this as a clean document. Use headings (###) and bullet points (-) for clarity."""
-        else:
-            system_prompt = """You are an expert music educator drafting an encouraging "Musician's Journey Report" for the parent of a student.
-**CRITICAL: Assume the parent has ZERO musical knowledge.**
-The tone must be positive, professional, and simple.
-The report must cover:
-1.  **Student's Progress:** Summarize their progress. (e.g., "improved rhythm" becomes "got much better at playing steady beats").
-2.  **Achievements:** Highlight key pieces mastered.
-3.  **Goal Achievement:** How they are achieving their goals.
-4.  **Looking Forward:** A brief, simple look at what's next (e.g., "We'll start learning how to play with both hands together more often.").
-Format this as a clean document. Use headings (###) and bullet points (-) for clarity."""
-        
-        user_query = f"""{system_prompt}
-
-Draft the Musician's Journey Report for {student['name']} ({student['instrument']}).
-Student's Age: {student.get('age') or 'Not specified'}
-Current Materials: {student['currentAssignments']}
-Stated Goals: {student.get('currentGoals') or 'Not specified'}
-Lesson Note History: {student.get('lessonNoteHistory') or 'Not specified'}"""
-        
-        logger.info("Calling Gemini API for journey report...")
-        # Call Gemini API
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content(user_query)
-        
-        report_text = response.text
-        
-        # Save to student record
-        student['journeyReport'] = report_text
-        save_students(students_dict)
-        
-        logger.info("✓ Journey report generated successfully")
-        return jsonify({'journeyReport': report_text}), 200
+            for event in stream_artifact(kind, student, backend, cache=generation_cache, force=force):
+                if event[0] == 'chunk':
+                    yield sse_event('chunk', {'text': event[1]})
+                else:
+                    _, value, changes = event
+                    student_store.update(student_id, store_documents(artifact_store, student_id, changes))
+                    logger.info("✓ Streamed %s saved", label)
+                    yield sse_event('done', {kind: value})
+        except Exception as e:
+            logger.error("❌ Error streaming %s: %s", label, e, exc_info=True)
+            yield sse_event('error', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/students/<student_id>/lesson-plan/stream', methods=['POST'])
+def stream_lesson_plan(student_id):
+    """Generate an 8-week lesson plan, streaming it as Server-Sent Events."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    return handle_streaming_generation('lessonPlan', student_id)
+
+@bp.route('/api/students/<student_id>/journey-report/stream', methods=['POST'])
+def stream_journey_report(student_id):
+    """Generate a journey report, streaming it as Server-Sent Events."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    return handle_streaming_generation('journeyReport', student_id)
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status, progress and result of a background job."""
+    if not is_logged_in():
+        return jsonify({'error': 'Not logged in'}), 401
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job), 200
     except Exception as e:
-        logger.error(f"❌ Error generating journey report: {e}", exc_info=True)
+        logger.error("Error getting job: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/import-xlsx', methods=['POST'])
+@bp.route('/api/import-xlsx', methods=['POST'])
+@bp.route('/api/import', methods=['POST'])
 def import_xlsx():
-    """Import students from XLSX file."""
+    """Import students from an XLSX or CSV roster.
+    
+    Rows are streamed and validated one by one; invalid rows are reported in
+    'errors' and the valid ones are committed with a single bulk insert.
+    """
     if not is_logged_in():
         return jsonify({'error': 'Not logged in'}), 401
     try:
@@ -663,73 +1306,28 @@ def import_xlsx():
             return jsonify({'error': 'No file provided'}), 400
         
         file = request.files['file']
-        logger.info(f"Importing file: {file.filename}")
-        
-        # Import openpyxl here to avoid hard dependency if not using this feature
-        import openpyxl
-        
-        workbook = openpyxl.load_workbook(file.stream)
-        worksheet = workbook.active
-        
-        students_dict = load_students()
-        imported_count = 0
-        
-        # Get headers from first row
-        headers = []
-        for cell in worksheet[1]:
-            headers.append(cell.value)
+        logger.info("Importing file: %s", file.filename)
         
-        logger.info(f"Headers found: {headers}")
+        result = read_roster(file.stream, file.filename, generate_id)
+        students = result['students']
         
-        # Process data rows
-        for row_idx, row in enumerate(worksheet.iter_rows(min_row=2, values_only=True), start=2):
-            if not any(row):  # Skip empty rows
-                continue
-            
-            row_dict = dict(zip(headers, row))
-            
-            # Map fields
-            first_name = row_dict.get('First Name', '')
-            last_name = row_dict.get('Last Name', '')
-            name = f"{first_name} {last_name}".strip() or "Unnamed Student"
-            
-            assignments = f"{row_dict.get('Book') or 'N/A'} (p. {row_dict.get('Current book page') or 'N/A'})\nPieces: {row_dict.get('Current Pieces') or 'N/A'}".strip()
-            
-            # Map skill level
-            skill_level_input = row_dict.get('Skill Level')
-            skill_level_map = {
-                '1': 'Beginner',
-                '2': 'Early Intermediate',
-                '3': 'Intermediate',
-                '4': 'Advanced'
-            }
-            skill_level = skill_level_map.get(str(skill_level_input).lower()[:1], 'Intermediate')
-            
-            student_id = generate_id()
-            students_dict[student_id] = {
-                'id': student_id,
-                'name': name,
-                'age': row_dict.get('Age'),
-                'instrument': row_dict.get('Instrument', 'Unknown'),
-                'skillLevel': skill_level,
-                'currentAssignments': assignments,
-                'currentGoals': row_dict.get('Goals', ''),
-                'lessonNoteHistory': '',
-                'recommendations': json.dumps([]),
-                'lessonPlan': '',
-                'timestamp': datetime.now().isoformat(),
-                'ownerId': 'local-user'
-            }
-            imported_count += 1
-        
-        save_students(students_dict)
-        logger.info(f"✓ Imported {imported_count} students")
-        return jsonify({'success': True, 'count': imported_count}), 200
+        student_store.put_many(students)
+        logger.info("✓ Imported %s students (%s rows rejected)", len(students), result['errorCount'])
+        return jsonify({
+            'success': True,
+            'count': len(students),
+            'ids': [s['id'] for s in students],
+            'errors': result['errors'],
+            'errorCount': result['errorCount']
+        }), 200
+    except ImportFormatError as e:
+        logger.warning("Import rejected: %s", e)
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"❌ Error importing XLSX: {e}", exc_info=True)
+        logger.error("❌ Error importing roster: %s", e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/download-sample', methods=['GET'])
+@bp.route('/download-sample', methods=['GET'])
 def download_sample():
     """Download sample import CSV file."""
     try:
@@ -745,9 +1343,61 @@ def download_sample():
             download_name='sample_import.csv'
         )
     except Exception as e:
-        logger.error(f"Error downloading sample: {e}")
+        logger.error("Error downloading sample: %s", e)
         return jsonify({'error': str(e)}), 500
 
+# --- APPLICATION FACTORY ---
+def run_startup_tasks():
+    """One-time setup before serving: data directory, default admin, user role, document and note migrations."""
+    global _startup_done
+    if _startup_done:
+        return
+    configure_logging()
+    if not ENV_PATH.exists():
+        logger.warning("⚠ .env file not found!")
+    if AI_BACKEND != 'fake' and not API_KEY:
+        logger.error("❌ API_KEY is empty - AI features will not work!")
+    DATA_DIR.mkdir(exist_ok=True)
+    init_default_admin()
+    moved = move_inline_documents(artifact_store, student_store)
+    if moved:
+        logger.info("✓ Moved generated documents of %s students to the artifact store", moved)
+    moved = move_legacy_history(note_log, student_store)
+    if moved:
+        logger.info("✓ Moved the lesson note history of %s students to the note log", moved)
+    _startup_done = True
+
+def create_app(config=None):
+    """Build the Flask app. Runs the startup tasks unless this process, or the gunicorn master it forked from, already did."""
+    configure_logging()
+    flask_app = Flask(__name__)
+    flask_app.secret_key = SECRET_KEY
+    flask_app.session_interface = session_interface
+    flask_app.config.update(config or {})
+    flask_app.register_blueprint(bp)
+    if TRUSTED_PROXIES:
+        # request.remote_addr becomes the client's address, not nginx's, for the login limits
+        flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+    run_startup_tasks()
+    # Each worker writes its metrics under data/metrics; /metrics adds them up
+    metrics.start(METRICS_DIR)
+
+    elapsed = time.perf_counter() - BOOT_STARTED
+    if elapsed > STARTUP_BUDGET_SECONDS:
+        logger.warning("⚠ Startup took %.0f ms (budget %.0f ms)", elapsed * 1000, STARTUP_BUDGET_SECONDS * 1000)
+    else:
+        logger.info("✓ App ready in %.0f ms (storage: %s)", elapsed * 1000, STORAGE_BACKEND)
+    return flask_app
+
+def __getattr__(name):
+    # `gunicorn app:app` and `from app import app` build the app on first access
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
+    app = create_app()
     logger.info("Starting Flask app...")
     app.run(debug=True, host='127.0.0.1', port=5000)
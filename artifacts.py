@@ -0,0 +1,196 @@
+"""Generated documents kept apart from the student record.
+
+Recommendations, lesson plans and journey reports are large and change only
+when they are regenerated. Each generated version is written once,
+gzip-compressed, to data/artifacts/<student id>/<field>/<version>.gz (or the
+artifacts table with STORAGE_BACKEND=sqlite). The student record keeps a
+small reference per document (``lessonPlanRef``: version, size, time), so
+listing, searching and journaling students never carry the documents
+themselves. The newest ARTIFACT_HISTORY_LIMIT versions of each are kept.
+
+Records written before this keep their documents inline until
+move_inline_documents() runs at startup. Until then, load_documents serves
+the inline text.
+"""
+import gzip
+import logging
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+from locking import temp_file_beside
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_HISTORY_LIMIT = int(os.getenv('ARTIFACT_HISTORY_LIMIT', '10'))
+
+# Generated fields -> value for a student with none yet
+ARTIFACT_FIELDS = {'recommendations': '[]', 'lessonPlan': '', 'journeyReport': ''}
+
+_SAFE_ID = re.compile(r'[A-Za-z0-9_-]+')
+
+
+def ref_field(field):
+    """Record field holding the reference to a generated document."""
+    return f"{field}Ref"
+
+
+def make_ref(field, version, content):
+    return {
+        'version': version,
+        'bytes': len(content.encode('utf-8')),
+        'empty': content == ARTIFACT_FIELDS[field],
+        'createdAt': datetime.now().isoformat(),
+    }
+
+
+class ArtifactStore:
+    """Versioned, compressed documents, one file per version."""
+
+    def __init__(self, artifacts_dir, history_limit=ARTIFACT_HISTORY_LIMIT):
+        self.artifacts_dir = Path(artifacts_dir)
+        self.history_limit = history_limit
+
+    def _dir(self, student_id, field=None):
+        if not _SAFE_ID.fullmatch(str(student_id)):
+            raise ValueError(f'Invalid student id: {student_id!r}')
+        if field is None:
+            return self.artifacts_dir / student_id
+        if field not in ARTIFACT_FIELDS:
+            raise ValueError(f'Unknown document: {field!r}')
+        return self.artifacts_dir / student_id / field
+
+    def _stored_versions(self, directory):
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-3]) for name in names if name.endswith('.gz') and name[:-3].isdigit())
+
+    def put(self, student_id, field, content):
+        """Store a new version of a document. Returns its reference for the student record."""
+        directory = self._dir(student_id, field)
+        fd, tmp_path = temp_file_beside(directory / 'new.gz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(content.encode('utf-8'), mtime=0))
+                f.flush()
+                os.fsync(f.fileno())
+            versions = self._stored_versions(directory)
+            version = versions[-1] + 1 if versions else 1
+            while True:
+                # link() fails rather than replace a version another writer claimed first
+                try:
+                    os.link(tmp_path, directory / f"{version}.gz")
+                    break
+                except FileExistsError:
+                    version += 1
+        finally:
+            os.unlink(tmp_path)
+        self._prune(directory)
+        return make_ref(field, version, content)
+
+    def get(self, student_id, field, version):
+        """Return one version of a document, or None if it is not stored."""
+        try:
+            with open(self._dir(student_id, field) / f"{int(version)}.gz", 'rb') as f:
+                return gzip.decompress(f.read()).decode('utf-8')
+        except FileNotFoundError:
+            return None
+
+    def versions(self, student_id, field):
+        """Stored versions of a document, newest first: [{'version', 'createdAt'}]."""
+        directory = self._dir(student_id, field)
+        versions = []
+        for version in reversed(self._stored_versions(directory)):
+            try:
+                mtime = os.stat(directory / f"{version}.gz").st_mtime
+            except FileNotFoundError:
+                continue
+            versions.append({'version': version, 'createdAt': datetime.fromtimestamp(mtime).isoformat()})
+        return versions
+
+    def delete(self, student_id):
+        """Remove every document of a student."""
+        directory = self._dir(student_id)
+        for field in ARTIFACT_FIELDS:
+            for version in self._stored_versions(directory / field):
+                try:
+                    os.unlink(directory / field / f"{version}.gz")
+                except FileNotFoundError:
+                    pass
+            try:
+                os.rmdir(directory / field)
+            except OSError:
+                pass
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+    def _prune(self, directory):
+        if self.history_limit <= 0:
+            return
+        for version in self._stored_versions(directory)[:-self.history_limit]:
+            try:
+                os.unlink(directory / f"{version}.gz")
+            except FileNotFoundError:
+                pass
+
+
+def store_documents(store, student_id, changes):
+    """Write the generated documents in ``changes`` to ``store``.
+
+    Returns the changes to save on the student record instead: references
+    in place of the documents, other fields as given.
+    """
+    record_changes = {}
+    for field, value in changes.items():
+        if field in ARTIFACT_FIELDS:
+            record_changes[ref_field(field)] = store.put(student_id, field, value)
+        else:
+            record_changes[field] = value
+    return record_changes
+
+
+def has_document(student, field):
+    """True if the student has a non-empty generated document of this kind."""
+    ref = student.get(ref_field(field))
+    if ref is not None:
+        return not ref['empty']
+    return student.get(field) not in (None, ARTIFACT_FIELDS[field])
+
+
+def load_documents(store, student, fields=ARTIFACT_FIELDS):
+    """Return a copy of the record with its generated documents (those in ``fields``) filled in."""
+    student = dict(student)
+    for field in fields:
+        ref = student.get(ref_field(field))
+        if ref is None:
+            # Inline (not yet moved) or never generated
+            student.setdefault(field, ARTIFACT_FIELDS[field])
+            continue
+        content = store.get(student['id'], field, ref['version'])
+        if content is None:
+            logger.warning("⚠ %s version %s of student %s is missing", field, ref['version'], student['id'])
+            content = ARTIFACT_FIELDS[field]
+        student[field] = content
+    return student
+
+
+def move_inline_documents(store, student_store):
+    """Move documents still stored on student records into the artifact store. Returns how many records changed."""
+    records = []
+    for student in student_store.values():
+        if not any(field in student for field in ARTIFACT_FIELDS):
+            continue
+        record = {key: value for key, value in student.items() if key not in ARTIFACT_FIELDS}
+        for field, empty in ARTIFACT_FIELDS.items():
+            value = student.get(field)
+            if value not in (None, empty) and ref_field(field) not in student:
+                record[ref_field(field)] = store.put(student['id'], field, value)
+        records.append(record)
+    if records:
+        student_store.put_many(records)
+    return len(records)
@@ -0,0 +1,164 @@
+"""Password hashing and login throttling.
+
+Hashes use a configurable werkzeug method (PASSWORD_HASH_METHOD). A hash
+made with other parameters still verifies, and is replaced with a current
+one the next time its owner logs in.
+
+Login attempts are limited with token buckets, one per username and one per
+client address. The buckets live in a small memory-mapped file shared by
+every gunicorn worker and guarded by a file lock. A throttled attempt is
+turned away before the password hash, which is deliberately slow, is
+computed. Each attempt takes a token, and a successful login gives it back,
+so only failures count against the limits.
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from locking import file_lock, lock_path_for
+
+# Any werkzeug method, e.g. 'scrypt:32768:8:1' (the default) or 'pbkdf2:sha256:600000'
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', '16'))
+
+# Failed attempts allowed at once, and how many more are allowed per minute after that
+LOGIN_USER_BURST = int(os.getenv('LOGIN_USER_BURST', '5'))
+LOGIN_USER_PER_MINUTE = float(os.getenv('LOGIN_USER_PER_MINUTE', '2'))
+LOGIN_IP_BURST = int(os.getenv('LOGIN_IP_BURST', '20'))
+LOGIN_IP_PER_MINUTE = float(os.getenv('LOGIN_IP_PER_MINUTE', '10'))
+LOGIN_THROTTLE_SLOTS = int(os.getenv('LOGIN_THROTTLE_SLOTS', '4096'))
+
+# --- PASSWORDS ---
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH)
+
+
+@lru_cache(maxsize=1)
+def _current_method():
+    # werkzeug fills in defaults (e.g. 'pbkdf2:sha256' -> 'pbkdf2:sha256:600000'); compare against what it stores
+    return hash_password('').split('$', 1)[0]
+
+
+def needs_rehash(password_hash):
+    """True if a stored hash was made with other parameters than PASSWORD_HASH_METHOD."""
+    return password_hash.split('$', 1)[0] != _current_method()
+
+
+def verify_password(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+# --- THROTTLING ---
+
+# One slot: key hash, tokens, last update (Unix time)
+_SLOT = struct.Struct('<Qdd')
+# Slots tried for a key before the least recently used one is reused
+_PROBES = 8
+# A bucket untouched this long has refilled completely and its slot can be reused
+_IDLE_SECONDS = 3600
+
+
+def _key_hash(key):
+    value = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value or 1
+
+
+class TokenBuckets:
+    """Token buckets in a fixed-size memory-mapped table shared by all processes."""
+
+    def __init__(self, path, slots=LOGIN_THROTTLE_SLOTS):
+        self.path = Path(path)
+        self.slots = slots
+        self.lock_path = lock_path_for(self.path)
+        self._map = None
+
+    def _table(self):
+        # Opened on first use; a mapping made before fork stays shared with the parent
+        if self._map is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            size = self.slots * _SLOT.size
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        return self._map
+
+    def _find(self, table, key_hash, now):
+        """Slot index for a key: its own slot, else a free or idle one, else the least recently used."""
+        start = key_hash % self.slots
+        candidate, candidate_updated = None, math.inf
+        for probe in range(_PROBES):
+            index = (start + probe) % self.slots
+            slot_key, _, updated = _SLOT.unpack_from(table, index * _SLOT.size)
+            if slot_key == key_hash:
+                return index
+            if slot_key == 0 or now - updated > _IDLE_SECONDS:
+                updated = -math.inf
+            if updated < candidate_updated:
+                candidate, candidate_updated = index, updated
+        return candidate
+
+    def _read(self, table, index, key_hash, capacity, per_second, now):
+        slot_key, tokens, updated = _SLOT.unpack_from(table, index * _SLOT.size)
+        if slot_key != key_hash:
+            return capacity
+        return min(capacity, tokens + (now - updated) * per_second)
+
+    def take(self, limits):
+        """Take a token from every bucket in ``limits`` ([(key, capacity, per_minute)]).
+
+        Returns 0 if they all had one, else the seconds until they will, in
+        which case nothing is taken.
+        """
+        now = time.time()
+        with file_lock(self.lock_path):
+            table = self._table()
+            current = []
+            for key, capacity, per_minute in limits:
+                key_hash = _key_hash(key)
+                index = self._find(table, key_hash, now)
+                tokens = self._read(table, index, key_hash, capacity, per_minute / 60, now)
+                current.append((index, key_hash, tokens, per_minute / 60))
+            wait = max(_wait(tokens, per_second) for _, _, tokens, per_second in current)
+            if wait > 0:
+                return wait
+            for index, key_hash, tokens, _ in current:
+                _SLOT.pack_into(table, index * _SLOT.size, key_hash, tokens - 1, now)
+        return 0
+
+    def give_back(self, limits):
+        """Return the token taken by the last ``take`` for these buckets."""
+        now = time.time()
+        with file_lock(self.lock_path):
+            table = self._table()
+            for key, capacity, per_minute in limits:
+                key_hash = _key_hash(key)
+                index = self._find(table, key_hash, now)
+                tokens = self._read(table, index, key_hash, capacity, per_minute / 60, now)
+                _SLOT.pack_into(table, index * _SLOT.size, key_hash, min(capacity, tokens + 1), now)
+
+
+def _wait(tokens, per_second):
+    if tokens >= 1:
+        return 0
+    return (1 - tokens) / per_second if per_second > 0 else _IDLE_SECONDS
+
+
+def login_limits(username, address):
+    """Buckets that a login attempt for ``username`` from ``address`` draws on."""
+    return [
+        (f'user:{username.lower()}', LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE),
+        (f'ip:{address}', LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE),
+    ]
@@ -0,0 +1,108 @@
+"""Batch AI generation across many students.
+
+Students whose prompts come out identical share one generation. The rest
+run on a bounded thread pool, with model calls spaced by a rate limiter
+that is shared by every batch in the worker. Results are yielded as each
+generation finishes, so the caller can stream progress.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from generation import ARTIFACTS, GenerationError, build_prompt, generate_artifact
+from generation_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+AI_BATCH_CONCURRENCY = int(os.getenv('AI_BATCH_CONCURRENCY', '4'))
+AI_RATE_LIMIT_PER_MINUTE = int(os.getenv('AI_RATE_LIMIT_PER_MINUTE', '60'))
+AI_BATCH_MAX_STUDENTS = int(os.getenv('AI_BATCH_MAX_STUDENTS', '500'))
+# Larger batches run as background jobs: at the rate limit they outlast a request's timeouts
+AI_BATCH_STREAM_MAX_STUDENTS = int(os.getenv('AI_BATCH_STREAM_MAX_STUDENTS', '50'))
+
+
+class RateLimiter:
+    """Spaces calls evenly so no more than ``per_minute`` start in any minute."""
+
+    def __init__(self, per_minute=AI_RATE_LIMIT_PER_MINUTE):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        """Block until the caller may start its call."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RateLimitedBackend:
+    """Wraps a model backend so each real model call waits for the rate limiter."""
+
+    def __init__(self, backend, limiter):
+        self.backend = backend
+        self.limiter = limiter
+        self.model_name = backend.model_name
+
+    def generate(self, prompt):
+        self.limiter.acquire()
+        return self.backend.generate(prompt)
+
+
+# Shared by all batches in this worker process
+rate_limiter = RateLimiter()
+
+
+def group_by_prompt(kind, students):
+    """Group students whose prompts are identical. Returns a list of student lists."""
+    groups = {}
+    for student in students:
+        prompt, _ = build_prompt(kind, student)
+        prompt = normalize_prompt(prompt)
+        groups.setdefault(prompt, []).append(student)
+    return list(groups.values())
+
+
+def run_batch(kind, students, backend, cache=None, force=False,
+              max_concurrency=AI_BATCH_CONCURRENCY, limiter=None):
+    """Generate one artifact kind for many students.
+
+    Yields one dict per student as results arrive:
+    {'studentId', 'ok': True, 'value', 'changes'} or {'studentId', 'ok': False, 'error'}.
+    """
+    backend = RateLimitedBackend(backend, limiter or rate_limiter)
+    groups = group_by_prompt(kind, students)
+    logger.info("Batch %s: %s students, %s distinct prompts", ARTIFACTS[kind]['label'], len(students), len(groups))
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='batch') as pool:
+        futures = {
+            pool.submit(generate_artifact, kind, group[0], backend, cache, force): group
+            for group in groups
+        }
+        try:
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    value, changes = future.result()
+                except GenerationError as e:
+                    error = str(e)
+                except Exception as e:
+                    logger.error("❌ Batch generation failed: %s", e, exc_info=True)
+                    error = str(e)
+                else:
+                    for student in group:
+                        yield {'studentId': student['id'], 'ok': True, 'value': value, 'changes': changes}
+                    continue
+                for student in group:
+                    yield {'studentId': student['id'], 'ok': False, 'error': error}
+        finally:
+            # If the consumer stopped early, don't start generations nobody will see
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,62 @@
+"""Per-worker read-through cache for the JSON data files.
+
+Parsed documents are kept in memory and revalidated with a single stat()
+call: the cached copy is reused while the file's inode, size and mtime are
+unchanged. Writes go through atomic rename (see locking.py), so any change
+made by another worker shows up as a new inode.
+"""
+import copy
+import json
+import os
+import threading
+import time
+
+from metrics import metrics
+
+
+class FileCache:
+    """Cache of parsed JSON files keyed by path and validated by stat."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path, default=dict):
+        """Return a private copy of the parsed file, or ``default()`` if it is missing."""
+        path = str(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return default()
+
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+        with open(path, 'r') as f:
+            started = time.perf_counter()
+            data = json.load(f)
+        metrics.observe('json_parse_seconds', time.perf_counter() - started, {'source': 'file'})
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = (key, data)
+        return copy.deepcopy(data)
+
+    def invalidate(self, path=None):
+        """Forget one cached file, or all of them."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(path), None)
+
+
+# Shared by every request in this worker process
+file_cache = FileCache()
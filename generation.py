@@ -0,0 +1,351 @@
+"""AI-generated student documents: prompts, model backends and result parsing.
+
+Each artifact kind (recommendations, lesson plan, journey report) knows how
+to build its prompt from a student record, and how to turn the model's text
+into the field changes saved on the student. The model itself is a backend
+object with a ``generate(prompt)`` method, so the request handlers and the
+job queue can run against Gemini or against a fake in tests.
+"""
+import json
+import logging
+import time
+from collections import deque
+
+from history import AI_PROMPT_MAX_TOKENS, assemble_history, estimate_tokens, prompt_metrics
+from parsing import extract_json_array, parse_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'gemini-2.0-flash'
+
+
+class GenerationError(Exception):
+    """Raised when the model's response cannot be turned into a result."""
+
+
+# --- BACKENDS ---
+
+class GeminiBackend:
+    """Calls Google's Generative AI API, reusing one model object for every call.
+
+    ``transport`` is 'grpc' or 'rest' (None: the library's default). Calls over
+    'rest' use Python sockets, so under gevent workers they wait without
+    holding up the rest of the worker.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, api_key=None, transport=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self.transport = transport
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            # Imported on first use: the package takes over half a second to load
+            import google.generativeai as genai
+
+            options = {'api_key': self.api_key, 'transport': self.transport}
+            options = {key: value for key, value in options.items() if value}
+            if options:
+                genai.configure(**options)
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt, timeout=None):
+        options = {'timeout': timeout} if timeout else None
+        response = self._get_model().generate_content(prompt, request_options=options)
+        return response.text
+
+    def generate_stream(self, prompt, timeout=None):
+        """Yield the response text in chunks as the model produces it."""
+        options = {'timeout': timeout} if timeout else None
+        for chunk in self._get_model().generate_content(prompt, stream=True, request_options=options):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. only safety metadata)
+                continue
+            if text:
+                yield text
+
+
+class FakeBackend:
+    """Returns canned responses instead of calling a model. Used by tests and offline setups.
+
+    ``responses`` maps an artifact kind to the text to return; the most recent
+    prompts are kept in ``prompts`` for inspection. ``failures`` is a list of
+    exceptions raised by the next calls, one per call, and ``delay`` adds
+    latency, to exercise timeouts, retries and the circuit breaker.
+    """
+
+    model_name = 'fake'
+
+    def __init__(self, responses=None, failures=None, delay=0):
+        self.responses = dict(DEFAULT_FAKE_RESPONSES)
+        self.responses.update(responses or {})
+        self.failures = list(failures or [])
+        self.delay = delay
+        self.prompts = deque(maxlen=100)
+        self.calls = 0
+
+    def generate(self, prompt, timeout=None):
+        self.calls += 1
+        self.prompts.append(prompt)
+        if self.delay:
+            if timeout and self.delay > timeout:
+                time.sleep(timeout)
+                raise TimeoutError(f'Fake model did not answer within {timeout}s')
+            time.sleep(self.delay)
+        if self.failures:
+            raise self.failures.pop(0)
+        for kind, marker in PROMPT_MARKERS.items():
+            if marker in prompt:
+                return self.responses[kind]
+        return ''
+
+    def generate_stream(self, prompt, timeout=None):
+        text = self.generate(prompt, timeout)
+        for start in range(0, len(text), 16):
+            yield text[start:start + 16]
+
+
+# --- PROMPTS ---
+
+RECOMMENDATIONS_SYSTEM_PROMPT = """You are a music teacher assistant. Generate a list of 5 pieces appropriate for the specified instrument, skill level, and student goals.
+
+Your entire response MUST be a single, valid JSON array string (e.g., [ { "title": "...", ... } ]).
+Do not include any text, markdown, or apologies before or after the JSON array.
+
+Each object in the array must have these keys: "title", "composer", "focus"."""
+
+LESSON_PLAN_SYSTEM_PROMPT = """You are an expert music educator. Create a structured 8-week lesson plan tailored to the student's instrument, materials, goals, and history. The plan should balance technical exercises, sight-reading, and repertoire.
+Format the response in clean Markdown. Use headings (e.g., '### Week 1-2: Focus on Technique') and bullet points for clarity.
+Ensure new information starts on a new line. Do not use horizontal rules (---) or asterisks for bullets; use dashes (-) instead."""
+
+JOURNEY_REPORT_ADULT_SYSTEM_PROMPT = """You are an expert music educator drafting an encouraging "Musician's Journey Report" for an adult student.
+The tone should be positive, professional, and collaborative.
+The report must cover:
+1.  **Student's Progress:** Summarize their progress based on lesson history.
+2.  **Achievements:** Highlight key pieces mastered or skills developed.
+3.  **Goal Achievement:** How they have successfully (or are in the process of) achieving their stated goals.
+4.  **Looking Forward:** A brief look at what skills and concepts you plan to cover next.
+Format this as a clean document. Use headings (###) and bullet points (-) for clarity."""
+
+JOURNEY_REPORT_PARENT_SYSTEM_PROMPT = """You are an expert music educator drafting an encouraging "Musician's Journey Report" for the parent of a student.
+**CRITICAL: Assume the parent has ZERO musical knowledge.**
+The tone must be positive, professional, and simple.
+The report must cover:
+1.  **Student's Progress:** Summarize their progress. (e.g., "improved rhythm" becomes "got much better at playing steady beats").
+2.  **Achievements:** Highlight key pieces mastered.
+3.  **Goal Achievement:** How they are achieving their goals.
+4.  **Looking Forward:** A brief, simple look at what's next (e.g., "We'll start learning how to play with both hands together more often.").
+Format this as a clean document. Use headings (###) and bullet points (-) for clarity."""
+
+
+def recommendations_prompt(student, history):
+    """Build the song recommendations prompt."""
+    return f"""{RECOMMENDATIONS_SYSTEM_PROMPT}
+
+Generate song recommendations for a {student['instrument']} student at the {student['skillLevel']} level.
+Student Goals: {student.get('currentGoals') or 'Not specified'}
+Student Lesson History: {history or 'Not specified'}"""
+
+
+def lesson_plan_prompt(student, history):
+    """Build the 8-week lesson plan prompt."""
+    return f"""{LESSON_PLAN_SYSTEM_PROMPT}
+
+Create an 8-week plan for this {student['instrument']} student.
+Current Materials: {student['currentAssignments']}
+Student Goals: {student.get('currentGoals') or 'Not specified'}
+Lesson Note History: {history or 'Not specified'}"""
+
+
+def is_adult(student):
+    """Journey reports for adults address the student; otherwise the parent."""
+    try:
+        return int(student.get('age') or 0) > 18
+    except (TypeError, ValueError):
+        return False
+
+
+def journey_report_prompt(student, history):
+    """Build the Musician's Journey Report prompt."""
+    adult = is_adult(student)
+    system_prompt = JOURNEY_REPORT_ADULT_SYSTEM_PROMPT if adult else JOURNEY_REPORT_PARENT_SYSTEM_PROMPT
+    return f"""{system_prompt}
+
+Draft the Musician's Journey Report for {student['name']} ({student['instrument']}).
+Student's Age: {student.get('age') or 'Not specified'}
+Current Materials: {student['currentAssignments']}
+Stated Goals: {student.get('currentGoals') or 'Not specified'}
+Lesson Note History: {history or 'Not specified'}"""
+
+
+# --- PARSING ---
+
+RECOMMENDATION_FIELDS = ('title', 'composer', 'focus')
+
+
+def parse_recommendations(response_text):
+    """Parse the model's JSON array of recommendations, repairing common defects (see parsing.py)."""
+    try:
+        return extract_json_array(response_text, RECOMMENDATION_FIELDS)
+    except ValueError as e:
+        parse_stats.record('failed')
+        logger.error("JSON parsing error: %s. Response starts: %r", e, (response_text or '')[:100])
+        raise GenerationError('Failed to parse AI response as JSON')
+
+
+def recommendations_repair_prompt(response_text):
+    """Ask the model to restate an unusable answer as the JSON array we need."""
+    return f"""Convert the following text into a single, valid JSON array of objects with the keys "title", "composer" and "focus".
+Reply with the JSON array only, with no other text or markdown.
+
+{response_text}"""
+
+
+# --- ARTIFACTS ---
+
+# kind -> how to prompt, where the result is stored and how it is returned
+ARTIFACTS = {
+    'recommendations': {
+        'label': 'recommendations',
+        'prompt': recommendations_prompt,
+        'parse': parse_recommendations,
+        # Last resort when the output cannot be parsed or repaired
+        'repair_prompt': recommendations_repair_prompt,
+        'field': 'recommendations',
+        'serialize': json.dumps,
+    },
+    'lessonPlan': {
+        'label': 'lesson plan',
+        'prompt': lesson_plan_prompt,
+        'parse': lambda text: text,
+        'field': 'lessonPlan',
+        'serialize': lambda value: value,
+    },
+    'journeyReport': {
+        'label': 'journey report',
+        'prompt': journey_report_prompt,
+        'parse': lambda text: text,
+        'field': 'journeyReport',
+        'serialize': lambda value: value,
+    },
+}
+
+# Text that identifies each kind of prompt (used by FakeBackend)
+PROMPT_MARKERS = {
+    'recommendations': 'Generate song recommendations',
+    'lessonPlan': 'Create an 8-week plan',
+    'journeyReport': "Draft the Musician's Journey Report",
+    'historySummary': 'Update the running summary',
+}
+
+DEFAULT_FAKE_RESPONSES = {
+    'recommendations': json.dumps([
+        {'title': 'Minuet in G', 'composer': 'J. S. Bach', 'focus': 'Even articulation'},
+    ]),
+    'lessonPlan': '### Week 1-2: Focus on Technique\n- Scales and arpeggios',
+    'journeyReport': "### Student's Progress\n- Steady improvement every week",
+    'historySummary': 'Working through Bach minuets; scales are steady, sight-reading still slow.',
+}
+
+
+def build_prompt(kind, student, max_tokens=AI_PROMPT_MAX_TOKENS):
+    """Build a prompt within the token budget. Returns (prompt, stats).
+
+    The instructions and student details are always included; the lesson
+    history fills the tokens that remain (see history.assemble_history).
+    """
+    prompt_for = ARTIFACTS[kind]['prompt']
+    fixed_tokens = estimate_tokens(prompt_for(student, None))
+    history, stats = assemble_history(student, max_tokens - fixed_tokens)
+    prompt = prompt_for(student, history)
+    stats.update(promptTokens=estimate_tokens(prompt), fixedTokens=fixed_tokens, budgetTokens=max_tokens)
+    return prompt, stats
+
+
+def _parse(artifact, text, backend):
+    """Parse model output, re-prompting once if the artifact supports it. Returns (value, text)."""
+    try:
+        return artifact['parse'](text), text
+    except GenerationError:
+        if 'repair_prompt' not in artifact:
+            raise
+    logger.warning("⚠ Asking %s to reformat unparseable %s", backend.model_name, artifact['label'])
+    parse_stats.record('reprompted')
+    text = backend.generate(artifact['repair_prompt'](text))
+    return artifact['parse'](text), text
+
+
+def _prepare_prompt(kind, student):
+    prompt, stats = build_prompt(kind, student)
+    prompt_metrics.record(kind, stats)
+    logger.info(
+        "Prompt for %s: %s/%s tokens (history %s, %s notes, %s left out)",
+        ARTIFACTS[kind]['label'], stats['promptTokens'], stats['budgetTokens'],
+        stats['historyTokens'], stats['notesIncluded'], stats['notesOmitted']
+    )
+    return prompt
+
+
+def generate_artifact(kind, student, backend, cache=None, force=False):
+    """Run one generation for a student.
+
+    With a GenerationCache, unchanged inputs reuse the stored model output
+    unless ``force`` is set. Returns (value, changes): the parsed result for
+    the API response and the field changes to save on the student record.
+    """
+    artifact = ARTIFACTS[kind]
+    prompt = _prepare_prompt(kind, student)
+
+    text = None
+    if cache is not None and not force:
+        text = cache.get(kind, backend.model_name, prompt)
+        if text is not None:
+            logger.info("✓ Reusing cached %s", artifact['label'])
+
+    from_model = text is None
+    if from_model:
+        logger.info("Calling %s for %s...", backend.model_name, artifact['label'])
+        text = backend.generate(prompt)
+        logger.info("Model response received for %s", artifact['label'])
+
+    value, text = _parse(artifact, text, backend)
+    # Only cache output that parsed, so a bad response is not served again
+    if cache is not None and from_model:
+        cache.put(kind, backend.model_name, prompt, text)
+    return value, {artifact['field']: artifact['serialize'](value)}
+
+
+def stream_artifact(kind, student, backend, cache=None, force=False):
+    """Like generate_artifact, but yields the model output as it arrives.
+
+    Yields ('chunk', text) for each piece of output, then a final
+    ('done', value, changes). A cached result is sent as a single chunk.
+    """
+    artifact = ARTIFACTS[kind]
+    prompt = _prepare_prompt(kind, student)
+
+    text = None
+    if cache is not None and not force:
+        text = cache.get(kind, backend.model_name, prompt)
+
+    from_model = text is None
+    if from_model:
+        logger.info("Streaming %s from %s...", artifact['label'], backend.model_name)
+        parts = []
+        for piece in backend.generate_stream(prompt):
+            parts.append(piece)
+            yield ('chunk', piece)
+        text = ''.join(parts)
+        logger.info("Model stream finished for %s", artifact['label'])
+    else:
+        logger.info("✓ Reusing cached %s", artifact['label'])
+        yield ('chunk', text)
+
+    value, text = _parse(artifact, text, backend)
+    if cache is not None and from_model:
+        cache.put(kind, backend.model_name, prompt, text)
+    yield ('done', value, {artifact['field']: artifact['serialize'](value)})
@@ -0,0 +1,137 @@
+"""Persistent cache of AI generations keyed on their inputs.
+
+A generation is identified by a hash of (artifact kind, model name,
+normalized prompt). Re-generating with unchanged student data returns the
+stored model output instead of paying for another API call. Entries expire
+after a TTL and the least recently used ones are evicted beyond a size cap.
+
+The cache lives in a small SQLite database (stdlib sqlite3) so every
+gunicorn worker shares entries and hit/miss counters.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+AI_CACHE_TTL_SECONDS = int(os.getenv('AI_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', '5000'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    kind TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def normalize_prompt(prompt):
+    """Ignore differences in trailing whitespace and blank lines."""
+    lines = [line.rstrip() for line in prompt.strip().splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+def cache_key(kind, model_name, prompt):
+    """Content address of a generation."""
+    digest = hashlib.sha256()
+    for part in (kind, model_name, normalize_prompt(prompt)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """SQLite-backed TTL + LRU cache of raw model output."""
+
+    def __init__(self, db_path, ttl_seconds=AI_CACHE_TTL_SECONDS, max_entries=AI_CACHE_MAX_ENTRIES):
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind, model_name, prompt):
+        """Return cached model text for these inputs, or None. Counts a hit or a miss."""
+        conn = self._connect()
+        key = cache_key(kind, model_name, prompt)
+        now = time.time()
+        row = conn.execute(
+            'SELECT text FROM generations WHERE key = ? AND created_at > ?',
+            (key, now - self.ttl_seconds)
+        ).fetchone()
+        if row is None:
+            self._count(conn, kind, 'misses')
+            return None
+        conn.execute('UPDATE generations SET last_used = ? WHERE key = ?', (now, key))
+        self._count(conn, kind, 'hits')
+        return row[0]
+
+    def put(self, kind, model_name, prompt, text):
+        """Store model text for these inputs, evicting old entries if needed."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO generations (key, kind, model, text, created_at, last_used) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (cache_key(kind, model_name, prompt), kind, model_name, text, now, now)
+        )
+        self._evict(conn, now)
+
+    def _count(self, conn, kind, column):
+        conn.execute(
+            f'INSERT INTO counters (kind, {column}) VALUES (?, 1) '
+            f'ON CONFLICT(kind) DO UPDATE SET {column} = {column} + 1',
+            (kind,)
+        )
+
+    def _evict(self, conn, now):
+        conn.execute('DELETE FROM generations WHERE created_at <= ?', (now - self.ttl_seconds,))
+        conn.execute(
+            'DELETE FROM generations WHERE key IN ('
+            'SELECT key FROM generations ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def stats(self):
+        """Hit/miss counters per artifact kind plus totals, shared by all workers."""
+        conn = self._connect()
+        by_kind = {
+            kind: {'hits': hits, 'misses': misses}
+            for kind, hits, misses in conn.execute('SELECT kind, hits, misses FROM counters')
+        }
+        hits = sum(c['hits'] for c in by_kind.values())
+        misses = sum(c['misses'] for c in by_kind.values())
+        entries = conn.execute('SELECT COUNT(*) FROM generations').fetchone()[0]
+        return {
+            'enabled': AI_CACHE_ENABLED,
+            'entries': entries,
+            'hits': hits,
+            'misses': misses,
+            'hitRate': round(hits / (hits + misses), 3) if hits + misses else None,
+            'byKind': by_kind,
+        }
@@ -0,0 +1,41 @@
+"""Gunicorn settings, read automatically when gunicorn starts in this directory.
+
+Options given on the command line (--workers, --bind) override these.
+"""
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# As app.py does, so GUNICORN_* and AI_* settings in .env apply here too
+load_dotenv(Path(__file__).parent / '.env')
+
+# Workers fork from a master that already imported the app, so they start in milliseconds
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# 'sync' (one request at a time per worker) or 'gevent' (many, for AI-heavy traffic)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+# Requests a gevent worker serves at once
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+if worker_class == 'gevent':
+    # Patch before the app (and its locks, threads and sockets) is imported in the master
+    from gevent import monkey
+
+    monkey.patch_all()
+    # gRPC does not cooperate with gevent; REST calls go through the patched sockets
+    os.environ.setdefault('AI_TRANSPORT', 'rest')
+
+from model_client import AI_MAX_RETRIES, AI_RETRY_MAX_SECONDS, AI_TIMEOUT_SECONDS
+
+# A sync worker busy for longer is killed. The slowest AI request has every attempt time
+# out, with a pause between retries, twice over when recommendations must be re-prompted.
+_slowest_ai_call = (AI_MAX_RETRIES + 1) * AI_TIMEOUT_SECONDS + AI_MAX_RETRIES * AI_RETRY_MAX_SECONDS
+timeout = int(os.getenv('GUNICORN_TIMEOUT', str(int(2 * _slowest_ai_call) + 30)))
+
+
+def on_starting(server):
+    """Run the app's one-time startup tasks once, in the master, before any worker starts."""
+    import app
+
+    app.run_startup_tasks()
@@ -0,0 +1,180 @@
+"""Token-budgeted lesson history for AI prompts, with a rolling summary.
+
+A prompt gets its fixed part (instructions and the student's details) plus
+as much lesson history as the token budget leaves room for: the rolling
+summary of older logged notes, then the newest notes, then the tail of the
+free-text history. Notes that fall out of the recent window are folded into
+the summary a batch at a time, so the summary is only ever updated with
+notes it has not seen, never rebuilt from the whole history.
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Whole prompt, in estimated tokens; lesson history gets what the rest leaves
+AI_PROMPT_MAX_TOKENS = int(os.getenv('AI_PROMPT_MAX_TOKENS', '4000'))
+# Newest logged notes considered for a prompt; older ones reach it through the summary
+AI_PROMPT_NOTE_LIMIT = int(os.getenv('AI_PROMPT_NOTE_LIMIT', '20'))
+AI_SUMMARY_MAX_WORDS = int(os.getenv('AI_SUMMARY_MAX_WORDS', '250'))
+# Notes sent per summarization call when catching up on a long history
+AI_SUMMARY_CHUNK_TOKENS = int(os.getenv('AI_SUMMARY_CHUNK_TOKENS', '3000'))
+
+SUMMARY_SYSTEM_PROMPT = f"""You are a music teacher's assistant keeping a running summary of a student's lesson notes.
+Merge the new lesson notes into the current summary. Keep repertoire, techniques worked on, recurring difficulties and progress toward goals; drop day-to-day detail.
+Reply with the updated summary only, in plain text of at most {AI_SUMMARY_MAX_WORDS} words."""
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def format_note(note):
+    """One note as a prompt line."""
+    return f"{note['timestamp'][:10]}: {note['text']}"
+
+
+def select_notes(notes, max_notes=None, max_tokens=None):
+    """Keep the most recent notes: at most ``max_notes``, with at most ``max_tokens`` of text."""
+    if max_notes is not None:
+        notes = notes[-max_notes:] if max_notes > 0 else []
+    if max_tokens is None:
+        return list(notes)
+    selected = []
+    used = 0
+    for note in reversed(notes):
+        used += estimate_tokens(format_note(note)) + 1
+        if used > max_tokens:
+            break
+        selected.append(note)
+    return list(reversed(selected))
+
+
+def assemble_history(student, max_tokens):
+    """Lesson history text for a prompt within ``max_tokens``. Returns (text or None, stats).
+
+    Reads the free-text ``lessonNoteHistory`` and the ``noteSummary`` and
+    ``recentNotes`` the caller attached (see app.generation_input). Priority
+    under the budget: summary, newest notes, then the end of the free text.
+    Output is in chronological order.
+    """
+    budget = max(max_tokens, 0)
+    summary = ((student.get('noteSummary') or {}).get('text') or '').strip()
+    summary_line = f"Summary of earlier lessons: {summary}" if summary else ''
+    if summary_line and estimate_tokens(summary_line) + 1 > budget:
+        summary_line = ''
+    budget -= estimate_tokens(summary_line) + 1 if summary_line else 0
+
+    recent = student.get('recentNotes') or []
+    notes = select_notes(recent, max_tokens=budget)
+    note_lines = [format_note(note) for note in notes]
+    budget -= sum(estimate_tokens(line) + 1 for line in note_lines)
+
+    earlier = (student.get('lessonNoteHistory') or '').strip()
+    earlier_truncated = False
+    if earlier and estimate_tokens(earlier) > budget:
+        earlier = earlier[-budget * 4:].lstrip() if budget > 0 else ''
+        earlier_truncated = True
+
+    lines = [line for line in [earlier, summary_line] + note_lines if line]
+    text = '\n'.join(lines) or None
+    stats = {
+        'historyTokens': estimate_tokens(text) if text else 0,
+        'summaryTokens': estimate_tokens(summary_line) if summary_line else 0,
+        'notesIncluded': len(notes),
+        'notesOmitted': len(recent) - len(notes),
+        'earlierHistoryTruncated': earlier_truncated,
+    }
+    return text, stats
+
+
+# --- ROLLING SUMMARY ---
+
+def notes_to_summarize(note_count, summary):
+    """Return (after_seq, through_seq) of the notes due to be folded into the summary, or None.
+
+    Once more than AI_PROMPT_NOTE_LIMIT notes are unsummarized, all but the
+    newest half-window are folded in, so summarization runs about once every
+    AI_PROMPT_NOTE_LIMIT / 2 notes.
+    """
+    through = (summary or {}).get('throughSeq', 0)
+    if note_count - through <= AI_PROMPT_NOTE_LIMIT:
+        return None
+    return through, note_count - AI_PROMPT_NOTE_LIMIT // 2
+
+
+def summary_prompt(student, summary_text, notes):
+    """Build the prompt that folds ``notes`` into the running summary."""
+    note_lines = '\n'.join(format_note(note) for note in notes)
+    return f"""{SUMMARY_SYSTEM_PROMPT}
+
+Update the running summary for {student.get('name')} ({student.get('instrument')}).
+Current summary: {summary_text or 'None yet'}
+New lesson notes:
+{note_lines}"""
+
+
+def _chunks(notes, max_tokens):
+    chunk = []
+    used = 0
+    for note in notes:
+        size = estimate_tokens(format_note(note)) + 1
+        if chunk and used + size > max_tokens:
+            yield chunk
+            chunk, used = [], 0
+        chunk.append(note)
+        used += size
+    if chunk:
+        yield chunk
+
+
+def update_summary(student, summary, notes, backend, cache=None):
+    """Fold ``notes`` (oldest first) into ``summary`` and return the new summary record."""
+    text = (summary or {}).get('text') or ''
+    for chunk in _chunks(notes, AI_SUMMARY_CHUNK_TOKENS):
+        prompt = summary_prompt(student, text, chunk)
+        response = cache.get('historySummary', backend.model_name, prompt) if cache is not None else None
+        if response is None:
+            response = backend.generate(prompt)
+            if cache is not None:
+                cache.put('historySummary', backend.model_name, prompt, response)
+        text = response.strip()
+    logger.info("✓ Lesson summary updated through note %s (%s new notes)", notes[-1]['seq'], len(notes))
+    return {'text': text, 'throughSeq': notes[-1]['seq'], 'updatedAt': datetime.now().isoformat()}
+
+
+# --- METRICS ---
+
+class PromptMetrics:
+    """Per-kind prompt size counters for this worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_kind = {}
+
+    def record(self, kind, stats):
+        with self._lock:
+            entry = self._by_kind.setdefault(kind, {
+                'calls': 0, 'promptTokensTotal': 0, 'promptTokensMax': 0,
+                'historyTokensTotal': 0, 'notesOmittedTotal': 0, 'overBudget': 0,
+            })
+            entry['calls'] += 1
+            entry['promptTokensTotal'] += stats['promptTokens']
+            entry['promptTokensMax'] = max(entry['promptTokensMax'], stats['promptTokens'])
+            entry['historyTokensTotal'] += stats['historyTokens']
+            entry['notesOmittedTotal'] += stats['notesOmitted']
+            entry['overBudget'] += stats['promptTokens'] > stats['budgetTokens']
+
+    def snapshot(self):
+        """Counters per kind, with average prompt size."""
+        with self._lock:
+            result = {}
+            for kind, entry in self._by_kind.items():
+                result[kind] = dict(entry, promptTokensAvg=round(entry['promptTokensTotal'] / entry['calls']))
+            return result
+
+
+prompt_metrics = PromptMetrics()
@@ -0,0 +1,136 @@
+"""Conditional GET (ETag / If-None-Match) and response compression.
+
+Views give a response an ETag, either from something cheap that changes
+with the data (the student store's state token) or from a hash of the body.
+finish_response, which runs after every request, answers a matching
+If-None-Match with 304 Not Modified. It also compresses large text responses
+with brotli, if the brotli package is installed, or with gzip.
+
+A compressed response gets its own ETag: the plain one plus '-br' or
+'-gzip', since strong ETags must differ between encodings of the same
+content. Any of these forms matches when it comes back in If-None-Match.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+from metrics import metrics
+
+HTTP_COMPRESSION = os.getenv('HTTP_COMPRESSION', 'true').lower() in ('1', 'true', 'yes')
+# Smaller bodies are sent as they are; compressing them saves less than it costs
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'text/csv', 'application/javascript'}
+_ENCODING_SUFFIXES = ('-br', '-gzip')
+# Compressed bodies kept per worker, keyed by a hash of the plain body: the
+# same roster is sent to every client until it next changes
+_CACHE_ENTRIES = 32
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _plain_tag(tag):
+    for suffix in _ENCODING_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def matching_tag(tag):
+    """The tag from If-None-Match that names ``tag`` in some encoding, or None."""
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return None
+    if if_none_match.star_tag:
+        return tag
+    for candidate in if_none_match.as_set(include_weak=True):
+        if _plain_tag(candidate) == tag:
+            return candidate
+    return None
+
+
+def not_modified(tag):
+    """A 304 response for ``tag`` (as the client named it), or None if the client's copy is out of date."""
+    candidate = matching_tag(tag)
+    if candidate is None:
+        return None
+    response = Response(status=304)
+    response.set_etag(candidate)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def set_body_etag(response):
+    """Give a response a strong ETag computed from its body, for content with no cheaper version to go by."""
+    response.set_etag(hashlib.blake2b(response.get_data(), digest_size=16).hexdigest())
+    return response
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(data, encoding):
+    key = (hashlib.blake2b(data, digest_size=16).digest(), encoding)
+    with _cache_lock:
+        body = _cache.get(key)
+        if body is not None:
+            _cache.move_to_end(key)
+            return body
+    if encoding == 'br':
+        body = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    with _cache_lock:
+        _cache[key] = body
+        while len(_cache) > _CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return body
+
+
+def finish_response(response):
+    """after_request hook: 304 for a matching If-None-Match, else compress large text bodies."""
+    tag, _ = response.get_etag()
+    if tag and request.method in ('GET', 'HEAD') and response.status_code == 200:
+        cached = not_modified(_plain_tag(tag))
+        if cached is not None:
+            return cached
+        if 'Cache-Control' not in response.headers:
+            # Browsers keep it but ask (If-None-Match) before every reuse
+            response.cache_control.no_cache = True
+            response.cache_control.private = True
+    if (not HTTP_COMPRESSION or response.mimetype not in COMPRESSIBLE_TYPES
+            or response.direct_passthrough or response.is_streamed):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    data = response.get_data()
+    encoding = _choose_encoding() if len(data) >= COMPRESS_MIN_BYTES else None
+    if encoding is None:
+        return response
+    body = _compress(data, encoding)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if tag:
+        response.set_etag(f"{tag}-{encoding}")
+    metrics.inc('http_compressed_bytes_total', {'encoding': encoding, 'stage': 'before'}, len(data))
+    metrics.inc('http_compressed_bytes_total', {'encoding': encoding, 'stage': 'after'}, len(body))
+    return response
@@ -0,0 +1,90 @@
+"""Collision-free, time-ordered student ids.
+
+An id is 20 decimal digits: the 13-digit millisecond timestamp, a 3-digit
+worker slot and a 4-digit per-millisecond sequence. The first 13 digits are
+the same millisecond timestamp the old ids consisted of, so old and new ids
+sort together in creation order, as strings or as numbers.
+
+Each process claims its own worker slot by holding an exclusive lock on a
+slot file for as long as it runs, so two gunicorn workers can never hand out
+the same id. Within a process the sequence counter makes ids unique up to
+10,000 per millisecond; past that the generator waits for the next one.
+"""
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: slots are picked at random instead of locked
+    fcntl = None
+
+WORKER_SLOTS = 1000
+SEQUENCE_LIMIT = 10000
+
+
+class IdGenerator:
+    """Hands out unique, increasing ids for this process."""
+
+    def __init__(self, slots_dir):
+        self.slots_dir = Path(slots_dir)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._slot = None
+        self._slot_file = None
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _claim_slot(self):
+        # A forked child inherits its parent's lock, so it must claim its own slot
+        if self._slot_file is not None:
+            self._slot_file.close()
+            self._slot_file = None
+        self._pid = os.getpid()
+        self._last_ms = 0
+        self._sequence = 0
+
+        if fcntl is None:
+            self._slot = random.randrange(WORKER_SLOTS)
+            return
+        self.slots_dir.mkdir(parents=True, exist_ok=True)
+        start = self._pid % WORKER_SLOTS
+        for offset in range(WORKER_SLOTS):
+            slot = (start + offset) % WORKER_SLOTS
+            f = open(self.slots_dir / f"{slot:03d}.lock", 'a')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            self._slot = slot
+            self._slot_file = f
+            return
+        raise RuntimeError(f'All {WORKER_SLOTS} id worker slots are in use')
+
+    def new_id(self):
+        """Return a new unique id string."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._claim_slot()
+            now_ms = int(time.time() * 1000)
+            # Never go backwards, even if the clock does
+            if now_ms <= self._last_ms:
+                now_ms = self._last_ms
+                self._sequence += 1
+                if self._sequence >= SEQUENCE_LIMIT:
+                    while now_ms <= self._last_ms:
+                        time.sleep(0.0005)
+                        now_ms = int(time.time() * 1000)
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return f"{now_ms:013d}{self._slot:03d}{self._sequence:04d}"
+
+
+def id_timestamp_ms(student_id):
+    """Creation time in milliseconds encoded in an id (old or new format)."""
+    return int(str(student_id)[:13])
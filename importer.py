@@ -0,0 +1,154 @@
+"""Streaming student roster import from XLSX or CSV.
+
+Rows are read one at a time (openpyxl in read-only mode for XLSX, the csv
+module for CSV), validated and mapped to student records in batches, and
+problems are reported per row instead of failing the whole file. Nothing
+is written here: the caller commits the mapped students in one bulk insert.
+"""
+import codecs
+import csv
+import logging
+import os
+from datetime import datetime
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+# Per-row errors returned to the client; the total count is always reported
+MAX_REPORTED_ERRORS = 100
+
+SKILL_LEVEL_MAP = {
+    '1': 'Beginner',
+    '2': 'Early Intermediate',
+    '3': 'Intermediate',
+    '4': 'Advanced'
+}
+SKILL_LEVEL_NAMES = {
+    level.lower(): level
+    for level in ('Beginner', 'Early Intermediate', 'Intermediate', 'Advanced Intermediate', 'Advanced')
+}
+
+
+class ImportFormatError(Exception):
+    """Raised when the uploaded file cannot be read as a roster at all."""
+
+
+def iter_xlsx_rows(stream):
+    """Yield (row_number, row_dict) from the active sheet without loading the workbook."""
+    # Import openpyxl here to avoid hard dependency if not using this feature
+    import openpyxl
+
+    try:
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFormatError(f'Could not read XLSX file: {e}')
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if not headers:
+            raise ImportFormatError('The sheet has no header row')
+        headers = [str(h).strip() if h is not None else None for h in headers]
+        logger.debug("Headers found: %s", headers)
+        for row_number, row in enumerate(rows, start=2):
+            yield row_number, dict(zip(headers, row))
+    finally:
+        workbook.close()
+
+
+def iter_csv_rows(stream):
+    """Yield (row_number, row_dict) from a CSV upload."""
+    reader = csv.DictReader(codecs.getreader('utf-8-sig')(stream))
+    try:
+        if not reader.fieldnames:
+            raise ImportFormatError('The CSV file has no header row')
+        reader.fieldnames = [h.strip() for h in reader.fieldnames]
+        logger.debug("Headers found: %s", reader.fieldnames)
+        for row_number, row in enumerate(reader, start=2):
+            yield row_number, row
+    except UnicodeDecodeError:
+        # Raised wherever the bad bytes are: with the header, or part way through the rows
+        raise ImportFormatError('The CSV file must be UTF-8 encoded (in Excel, save it as "CSV UTF-8")')
+
+
+def iter_rows(stream, filename):
+    """Pick the reader by file extension."""
+    if (filename or '').lower().endswith('.csv'):
+        return iter_csv_rows(stream)
+    return iter_xlsx_rows(stream)
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def map_skill_level(value):
+    """Accept 1-4 or a level name; anything else becomes Intermediate."""
+    text = _text(value).lower()
+    if text in SKILL_LEVEL_NAMES:
+        return SKILL_LEVEL_NAMES[text]
+    return SKILL_LEVEL_MAP.get(text[:1], 'Intermediate')
+
+
+def map_row(row, student_id, owner_id, timestamp):
+    """Turn one roster row into a student record. Raises ValueError if the row is invalid."""
+    name = f"{_text(row.get('First Name'))} {_text(row.get('Last Name'))}".strip()
+    if not name:
+        raise ValueError('Missing First Name and Last Name')
+
+    age = _text(row.get('Age')) or None
+    if age is not None:
+        if not age.isdigit() or not 0 < int(age) < 130:
+            raise ValueError(f'Age must be a whole number, got {age!r}')
+        age = int(age)
+
+    assignments = f"{_text(row.get('Book')) or 'N/A'} (p. {_text(row.get('Current book page')) or 'N/A'})\nPieces: {_text(row.get('Current Pieces')) or 'N/A'}".strip()
+
+    return {
+        'id': student_id,
+        'name': name,
+        'age': age,
+        'instrument': _text(row.get('Instrument')) or 'Unknown',
+        'skillLevel': map_skill_level(row.get('Skill Level')),
+        'currentAssignments': assignments,
+        'currentGoals': _text(row.get('Goals')),
+        'lessonNoteHistory': '',
+        'timestamp': timestamp,
+        'ownerId': owner_id
+    }
+
+
+def read_roster(stream, filename, new_id, owner_id='local-user', batch_size=IMPORT_BATCH_SIZE):
+    """Read and validate a roster upload.
+
+    ``new_id()`` supplies each student's id. Returns a dict with the mapped
+    ``students``, up to MAX_REPORTED_ERRORS row ``errors``, ``errorCount``
+    and the number of non-empty ``rows`` seen.
+    """
+    rows = iter_rows(stream, filename)
+    students = []
+    errors = []
+    error_count = 0
+    row_count = 0
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        timestamp = datetime.now().isoformat()
+        for row_number, row in batch:
+            if not any(_text(value) for value in row.values()):  # Skip empty rows
+                continue
+            row_count += 1
+            try:
+                students.append(map_row(row, new_id(), owner_id, timestamp))
+            except ValueError as e:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'row': row_number, 'error': str(e)})
+
+    return {'students': students, 'errors': errors, 'errorCount': error_count, 'rows': row_count}
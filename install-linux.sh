@@ -154,6 +154,9 @@ FLASK_DEBUG=False
 GUNICORN_WORKERS=4
 GUNICORN_HOST=127.0.0.1
 GUNICORN_PORT=8000
+
+# Proxies (nginx) in front of the app, for the client address in X-Forwarded-For
+TRUSTED_PROXIES=1
 EOF
 
 chown "$APP_USER:$APP_GROUP" "$INSTALL_DIR/.env.template"
@@ -187,9 +190,7 @@ Environment="GUNICORN_WORKERS=4"
 EnvironmentFile=$INSTALL_DIR/.env
 ExecStart=$VENV_DIR/bin/gunicorn \
     --workers 4 \
-    --worker-class sync \
     --bind 127.0.0.1:8000 \
-    --timeout 60 \
     --access-logfile /var/log/studmgmt/access.log \
     --error-logfile /var/log/studmgmt/error.log \
     --log-level info \
@@ -219,6 +220,11 @@ echo -e "${GREEN}✓ Log directory created at /var/log/studmgmt${NC}"
 # Step 11: Configure Nginx
 echo -e "${YELLOW}🌐 Step 11: Configuring Nginx...${NC}"
 
+# nginx waits as long for an AI response as gunicorn lets the worker run (gunicorn.conf.py
+# derives that from the AI_* limits in .env; 430 seconds with the defaults)
+AI_PROXY_TIMEOUT=$(cd "$INSTALL_DIR" && sudo -u "$APP_USER" "$VENV_DIR/bin/python" -c \
+    "import runpy; print(runpy.run_path('gunicorn.conf.py')['timeout'])" 2>/dev/null || echo 430)
+
 # Create nginx config
 cat > /etc/nginx/sites-available/studmgmt << 'EOF'
 upstream studmgmt_app {
@@ -252,6 +258,22 @@ server {
         proxy_set_header Connection "upgrade";
     }
 
+    # AI generation, streams and batches: allow for the slowest AI request and pass
+    # streamed progress on as it is generated instead of buffering the response
+    location ~ ^/api/(students/[^/]+/(recommendations|lesson-plan|journey-report)(/stream)?|ai-batch)$ {
+        proxy_pass http://studmgmt_app;
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_redirect off;
+        proxy_http_version 1.1;
+
+        proxy_read_timeout __AI_PROXY_TIMEOUT__s;
+        proxy_send_timeout __AI_PROXY_TIMEOUT__s;
+        proxy_buffering off;
+    }
+
     # Static files (if you add them later)
     location /static/ {
         alias /opt/studmgmt/static/;
@@ -259,6 +281,8 @@ server {
     }
 }
 EOF
+sed -i "s/__AI_PROXY_TIMEOUT__/$AI_PROXY_TIMEOUT/g" /etc/nginx/sites-available/studmgmt
+echo -e "${GREEN}✓ AI routes: ${AI_PROXY_TIMEOUT}s proxy timeout, no response buffering${NC}"
 
 # Enable the studmgmt site
 if [ ! -L /etc/nginx/sites-enabled/studmgmt ]; then
@@ -0,0 +1,132 @@
+"""Background job queue for slow work such as AI generation.
+
+Submitting a job returns immediately with its id; a bounded thread pool in
+the worker process runs it. Job state is written to one small JSON file per
+job under the jobs directory, so any gunicorn worker can answer a status
+request, not just the one running the job.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from cache import FileCache
+from locking import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+AI_JOB_WORKERS = int(os.getenv('AI_JOB_WORKERS', '4'))
+AI_JOB_QUEUE_LIMIT = int(os.getenv('AI_JOB_QUEUE_LIMIT', '100'))
+# Finished jobs are removed after this many seconds
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', str(24 * 3600)))
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are already waiting in this worker."""
+
+
+class JobQueue:
+    """Runs submitted callables on a bounded pool and records their progress."""
+
+    def __init__(self, jobs_dir, max_workers=AI_JOB_WORKERS, max_pending=AI_JOB_QUEUE_LIMIT):
+        self.jobs_dir = Path(jobs_dir)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._last_cleanup = 0
+        self._cache = FileCache()
+
+    def _pool(self):
+        # Created on first use so each forked gunicorn worker gets its own threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        return self._executor
+
+    @property
+    def in_flight(self):
+        """Jobs queued or running in this worker."""
+        return self._pending
+
+    def submit(self, kind, run, **details):
+        """Queue ``run(progress)`` and return the new job record.
+
+        ``progress(message)`` lets the job report what it is doing; the value
+        it returns becomes the job's result. ``details`` are stored on the job.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} jobs already pending")
+            self._remove_expired()
+            now = datetime.now().isoformat()
+            job = {
+                'id': uuid.uuid4().hex,
+                'kind': kind,
+                'status': 'queued',
+                'progress': 'Waiting for a free worker',
+                'result': None,
+                'error': None,
+                'createdAt': now,
+                'updatedAt': now,
+            }
+            job.update(details)
+            self._save(job)
+            submitted = dict(job)
+            self._pool().submit(self._execute, job, run)
+            # Only a job that was saved and queued holds a slot (_execute releases it, after this lock)
+            self._pending += 1
+        return submitted
+
+    def get(self, job_id):
+        """Return a job record, or None if it does not exist."""
+        if not job_id.isalnum():
+            return None
+        return self._cache.load(self._path(job_id), default=lambda: None)
+
+    def _execute(self, job, run):
+        def progress(message):
+            self._update(job, progress=message)
+
+        try:
+            self._update(job, status='running', progress='Started')
+            result = run(progress)
+            self._update(job, status='succeeded', progress='Done', result=result)
+        except Exception as e:
+            logger.error("❌ Job %s (%s) failed: %s", job['id'], job['kind'], e, exc_info=True)
+            self._update(job, status='failed', progress='Failed', error=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _update(self, job, **changes):
+        job.update(changes)
+        job['updatedAt'] = datetime.now().isoformat()
+        self._save(job)
+
+    def _path(self, job_id):
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _save(self, job):
+        atomic_write_json(self._path(job['id']), job, indent=None)
+
+    def _remove_expired(self):
+        # At most once a minute per worker
+        if time.time() - self._last_cleanup < 60:
+            return
+        self._last_cleanup = time.time()
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        try:
+            entries = list(os.scandir(self.jobs_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,84 @@
+"""File locking and atomic writes shared by the data files.
+
+Gunicorn runs several worker processes against the same data directory, so
+every write that must not interleave takes an advisory lock on a sidecar
+``.lock`` file, and whole-file writes go to a temp file that is renamed into
+place so readers never see a half-written document.
+"""
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(str(path), threading.RLock())
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """Hold an advisory lock on ``path`` (created if missing) for the block.
+
+    The lock is exclusive unless ``shared`` is set. A per-path thread lock is
+    taken as well, since flock does not exclude threads of the same process.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _thread_lock(path):
+        if fcntl is None:
+            yield
+            return
+        with open(path, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def lock_path_for(path):
+    """Return the sidecar lock file used for a data file."""
+    path = Path(path)
+    return path.with_name(f".{path.name}.lock")
+
+
+# mkstemp creates files as 0600; renamed data files should get the usual mode
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def temp_file_beside(path):
+    """Create a temp file next to ``path`` for a later rename. Returns (fd, tmp_path)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=path.parent)
+    os.chmod(tmp_path, 0o666 & ~_UMASK)
+    return fd, tmp_path
+
+
+def atomic_write_json(path, data, indent=2):
+    """Write JSON to a temp file in the same directory and rename it over ``path``."""
+    fd, tmp_path = temp_file_beside(path)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,174 @@
+"""Logging configuration: level, format, sampling and a background writer.
+
+Request threads never write to stdout themselves. configure_logging puts a
+QueueHandler on the root logger, and a QueueListener thread formats and
+writes records to stdout (journald under systemd). If that thread falls
+behind, new records are dropped and counted instead of blocking requests.
+
+Messages use lazy %-style arguments (``logger.info('Saved %s', name)``), so
+a record that is filtered out is never formatted. DEBUG and INFO records are
+also sampled per message template: past LOG_SAMPLE_LIMIT records of one
+template in LOG_SAMPLE_WINDOW seconds, the rest of that window is dropped.
+The next one written notes how many were left out. Warnings and errors are
+never sampled.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 'text' (default) or 'json' (one JSON object per line)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_SAMPLE_LIMIT = int(os.getenv('LOG_SAMPLE_LIMIT', '100'))
+LOG_SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', '60'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed in ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any ``extra`` fields included."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets at most ``limit`` DEBUG/INFO records per message template through each ``window`` seconds."""
+
+    def __init__(self, limit=LOG_SAMPLE_LIMIT, window=LOG_SAMPLE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.suppressed_total = 0
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno > logging.INFO:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            if count >= self.limit:
+                self._windows[key] = (started, count, suppressed + 1)
+                self.suppressed_total += 1
+                return False
+            self._windows[key] = (started, count + 1, 0)
+            if len(self._windows) > 10000:
+                # Templates are meant to be fixed strings; don't grow without bound if they aren't
+                self._windows.clear()
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread without blocking; drops them when its queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped_total = 0
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread, not in the request
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_total += 1
+
+
+class _SuppressedNote(logging.Filter):
+    """Appends the sampled-out count to text output."""
+
+    def filter(self, record):
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed and LOG_FORMAT != 'json':
+            record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+        return True
+
+
+_state = {}
+
+
+def configure_logging():
+    """Route all logging through the sampling filter and background writer. Safe to call more than once."""
+    if _state:
+        return _state['handler']
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    output.addFilter(_SuppressedNote())
+
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+    _state.update(handler=handler, output=output)
+    _start_listener()
+    os.register_at_fork(after_in_child=_after_fork)
+    atexit.register(_stop_listener)
+    return handler
+
+
+def _start_listener():
+    listener = logging.handlers.QueueListener(_state['handler'].queue, _state['output'], respect_handler_level=True)
+    listener.start()
+    _state['listener'] = listener
+
+
+def _after_fork():
+    # The writer thread does not survive fork (gunicorn --preload), and the
+    # queue's lock may have been held by it at that moment: start both afresh
+    _state['handler'].queue = queue.Queue(LOG_QUEUE_SIZE)
+    _state['handler'].dropped_total = 0
+    _start_listener()
+
+
+def _stop_listener():
+    # Writes out whatever is still queued
+    listener = _state.get('listener')
+    if listener is not None and listener._thread is not None:
+        listener.stop()
+
+
+def logging_stats():
+    """Records dropped because the queue was full and left out by sampling, in this process."""
+    handler = _state.get('handler')
+    if handler is None:
+        return {'dropped': 0, 'sampled': 0}
+    sampled = sum(f.suppressed_total for f in handler.filters if isinstance(f, SamplingFilter))
+    return {'dropped': handler.dropped_total, 'sampled': sampled}
@@ -0,0 +1,337 @@
+"""Prometheus-style metrics aggregated across gunicorn worker processes.
+
+Each worker counts into an in-memory registry and every few seconds writes
+it to its own file, <pid>.json, in the metrics directory. GET /metrics
+reads every worker's file and sums them, so a scrape that lands on any one
+worker still sees the whole server. When a worker exits, its counters and
+histograms are folded into archive.json on the next scrape. That keeps the
+totals monotonic across restarts. Its gauges (such as jobs in flight) are
+dropped.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from locking import atomic_write_json, file_lock
+
+logger = logging.getLogger(__name__)
+
+# How often, at most, a worker writes its metrics file
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '2'))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name: (type, help) for every metric the app reports
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by route, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time to send the whole response, including streamed bodies.'),
+    'http_compressed_bytes_total': ('counter', 'Response bytes before and after compression, by encoding.'),
+    'store_load_seconds': ('histogram', 'Time to load the student data from disk.'),
+    'store_load_bytes_total': ('counter', 'Bytes of student data read from disk.'),
+    'store_save_seconds': ('histogram', 'Time to write student data (journal append, compaction, SQLite transaction).'),
+    'store_save_bytes_total': ('counter', 'Bytes of student data written to disk.'),
+    'json_parse_seconds': ('histogram', 'Time spent parsing JSON data files.'),
+    'file_cache_hits_total': ('counter', 'Data file reads answered from the in-memory cache.'),
+    'file_cache_misses_total': ('counter', 'Data file reads that had to parse the file.'),
+    'ai_call_duration_seconds': ('histogram', 'AI model call latency per attempt.'),
+    'ai_errors_total': ('counter', 'Failed AI model calls by error type.'),
+    'ai_retries_total': ('counter', 'AI model calls retried after a retryable error.'),
+    'ai_calls_in_flight': ('gauge', 'AI model calls waiting for a response.'),
+    'ai_circuit_open': ('gauge', 'Worker processes whose AI circuit breaker is open or half-open.'),
+    'ai_cache_hits_total': ('counter', 'AI generations served from the generation cache.'),
+    'ai_cache_misses_total': ('counter', 'AI generations not found in the generation cache.'),
+    'ai_cache_entries': ('gauge', 'Entries in the AI generation cache.'),
+    'ai_parse_total': ('counter', 'AI recommendation responses by how they were parsed.'),
+    'ai_prompts_total': ('counter', 'AI prompts built, by document type.'),
+    'ai_prompt_tokens_total': ('counter', 'Estimated tokens in AI prompts, by document type.'),
+    'jobs_in_flight': ('gauge', 'Background jobs queued or running.'),
+    'login_attempts_total': ('counter', 'Login attempts by outcome: succeeded, failed or throttled.'),
+    'log_records_dropped_total': ('counter', 'Log records dropped because the log writer fell behind.'),
+    'log_records_sampled_total': ('counter', 'Repeated DEBUG/INFO log records left out by sampling.'),
+}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms for this process, written to a per-process file for aggregation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._collectors = []
+        self.directory = None
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # Tells this process's file apart from an older one left by a process with the same pid
+        self._token = uuid.uuid4().hex
+        self._counters = {}
+        self._histograms = {}
+        self._last_flush = 0
+        self._claimed = False
+
+    def _check_fork(self):
+        # A forked worker starts counting from zero rather than repeat its parent's counts
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def start(self, directory):
+        """Aggregate with other processes through ``directory``. Without it, /metrics shows this process only."""
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        atexit.register(self.flush)
+
+    # --- RECORDING ---
+
+    def inc(self, name, labels=None, value=1):
+        key = _key(name, labels)
+        with self._lock:
+            self._check_fork()
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None, buckets=DEFAULT_BUCKETS):
+        key = _key(name, labels)
+        with self._lock:
+            self._check_fork()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'le': list(buckets), 'counts': [0] * len(buckets), 'sum': 0, 'count': 0}
+            position = bisect.bisect_left(histogram['le'], value)
+            if position < len(histogram['counts']):
+                histogram['counts'][position] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, labels=None):
+        """Observe how long the block takes."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels)
+
+    def register(self, callback):
+        """Add ``callback() -> [(name, labels, value)]`` of values this process already keeps elsewhere.
+
+        Sampled when the process writes its metrics; counters among them
+        must be cumulative for the life of the process.
+        """
+        self._callbacks.append(callback)
+
+    def register_shared(self, callback):
+        """Add ``callback() -> [(name, labels, value)]`` of values shared by all processes (e.g. kept in a database).
+
+        Sampled once per scrape rather than summed across processes.
+        """
+        self._collectors.append(callback)
+
+    # --- AGGREGATION ---
+
+    def _sample_callbacks(self):
+        counters, gauges = {}, {}
+        for callback in self._callbacks:
+            try:
+                samples = callback()
+            except Exception as e:
+                logger.warning("⚠ Metrics callback failed: %s", e)
+                continue
+            for name, labels, value in samples:
+                target = gauges if METRICS[name][0] == 'gauge' else counters
+                target[_key(name, labels)] = value
+        return counters, gauges
+
+    def snapshot(self):
+        """This process's metrics as a JSON-serializable document."""
+        counters, gauges = self._sample_callbacks()
+        with self._lock:
+            self._check_fork()
+            counters.update(self._counters)
+            histograms = {key: dict(h, counts=list(h['counts'])) for key, h in self._histograms.items()}
+        return {
+            'pid': self._pid,
+            'token': self._token,
+            'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            'gauges': [[name, dict(labels), value] for (name, labels), value in gauges.items()],
+            'histograms': [[name, dict(labels), h] for (name, labels), h in histograms.items()],
+        }
+
+    def _path(self, pid):
+        return self.directory / f"{pid}.json"
+
+    @property
+    def _archive_lock(self):
+        return self.directory / '.archive.lock'
+
+    def flush(self):
+        """Write this process's metrics file now."""
+        if self.directory is None:
+            return
+        self._check_fork()
+        path = self._path(self._pid)
+        try:
+            if not self._claimed:
+                # A file under our pid from an earlier process: keep its totals
+                with file_lock(self._archive_lock):
+                    previous = _read(path)
+                    if previous and previous.get('token') != self._token:
+                        self._archive(path)
+                self._claimed = True
+            atomic_write_json(path, self.snapshot(), indent=None)
+            self._last_flush = time.monotonic()
+        except OSError as e:
+            logger.warning("⚠ Could not write metrics file %s: %s", path, e)
+
+    def maybe_flush(self):
+        """Write the metrics file if the last write is more than METRICS_FLUSH_SECONDS old."""
+        if self.directory is not None and time.monotonic() - self._last_flush >= METRICS_FLUSH_SECONDS:
+            self.flush()
+
+    def _archive(self, path):
+        """Fold a finished process's counters and histograms into archive.json and remove its file.
+
+        The caller holds the archive lock.
+        """
+        document = _read(path)
+        if document is None:
+            return
+        archive_path = self.directory / 'archive.json'
+        merged = _merge([_read(archive_path) or {}, {'counters': document['counters'], 'histograms': document['histograms']}])
+        atomic_write_json(archive_path, {
+            'counters': [[name, dict(labels), value] for (name, labels), value in merged['counters'].items()],
+            'histograms': [[name, dict(labels), h] for (name, labels), h in merged['histograms'].items()],
+        }, indent=None)
+        os.unlink(path)
+
+    def collect(self):
+        """Merged metrics of every process: {'counters', 'gauges', 'histograms'} keyed by (name, labels)."""
+        if self.directory is None:
+            documents = [self.snapshot()]
+        else:
+            self.flush()
+            documents = []
+            # Under the archive lock, so no file moves into the archive while we read
+            with file_lock(self._archive_lock):
+                for entry in os.scandir(self.directory):
+                    name, extension = os.path.splitext(entry.name)
+                    if extension != '.json' or not name.isdigit():
+                        continue
+                    if _alive(int(name)):
+                        documents.append(_read(entry.path))
+                    else:
+                        self._archive(Path(entry.path))
+                documents.append(_read(self.directory / 'archive.json'))
+            documents = [document for document in documents if document]
+            if not any(d.get('pid') == self._pid for d in documents):
+                # Our own file could not be written
+                documents.append(self.snapshot())
+        merged = _merge(documents)
+        for callback in self._collectors:
+            try:
+                samples = callback()
+            except Exception as e:
+                logger.warning("⚠ Metrics collector failed: %s", e)
+                continue
+            for name, labels, value in samples:
+                target = merged['gauges'] if METRICS[name][0] == 'gauge' else merged['counters']
+                target[_key(name, labels)] = value
+        return merged
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        merged = self.collect()
+        series = {}
+        for kind in ('counters', 'gauges', 'histograms'):
+            for (name, labels), value in merged[kind].items():
+                series.setdefault(name, []).append((labels, value))
+        lines = []
+        for name in sorted(series):
+            metric_type, help_text = METRICS.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(series[name]):
+                if metric_type != 'histogram':
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for le, count in zip(value['le'], value['counts']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(le)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value['sum'])}")
+                lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logger.warning("⚠ Ignoring unreadable metrics file %s", path)
+        return None
+
+
+def _alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(documents):
+    """Sum counters, gauges and histograms over several metrics documents."""
+    merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for document in documents:
+        for kind in ('counters', 'gauges'):
+            for name, labels, value in document.get(kind, ()):
+                key = _key(name, labels)
+                merged[kind][key] = merged[kind].get(key, 0) + value
+        for name, labels, histogram in document.get('histograms', ()):
+            key = _key(name, labels)
+            total = merged['histograms'].get(key)
+            if total is None or total['le'] != histogram['le']:
+                merged['histograms'][key] = dict(histogram, counts=list(histogram['counts']))
+                continue
+            total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# Shared by every module in this worker process
+metrics = MetricsRegistry()
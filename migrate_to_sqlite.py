@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Copy students, lesson notes and users from the JSON data files into the SQLite database.
+
+Run once before switching to STORAGE_BACKEND=sqlite (stop the app first):
+
+    python migrate_to_sqlite.py --data-dir data --db data/studmgmt.sqlite
+
+Students are read through StudentStore, so edits still sitting in the
+journal (students.log) are included. Records are upserted by id, so running
+the migration again is safe. The JSON files are left untouched.
+
+Each student's lesson notes (data/notes/<id>.jsonl) are copied with their
+sequence numbers, along with the rolling note summary used in AI prompts.
+The current version of each generated document in data/artifacts is copied
+into the database; older versions are not.
+"""
+import argparse
+import json
+from pathlib import Path
+
+from artifacts import ARTIFACT_FIELDS, ArtifactStore, ref_field
+from notes import NoteLog
+from sqlite_store import SqliteArtifactStore, SqliteDatabase, SqliteNoteLog, SqliteStudentStore, SqliteUserStore
+from store import StudentStore
+
+
+def migrate(data_dir, db_path):
+    """Copy data_dir's students, notes and users into db_path. Returns (students, notes, users) counts."""
+    data_dir = Path(data_dir)
+    database = SqliteDatabase(db_path)
+
+    students = list(StudentStore(data_dir / 'students.json').all().values())
+    documents = ArtifactStore(data_dir / 'artifacts')
+    sqlite_documents = SqliteArtifactStore(database)
+    for student in students:
+        for field in ARTIFACT_FIELDS:
+            ref = student.get(ref_field(field))
+            content = documents.get(student['id'], field, ref['version']) if ref else None
+            if content is not None:
+                student[ref_field(field)] = sqlite_documents.put(student['id'], field, content)
+    SqliteStudentStore(database).put_many(students)
+
+    note_log = NoteLog(data_dir / 'notes')
+    sqlite_notes = SqliteNoteLog(database)
+    note_count = 0
+    for student in students:
+        count = note_log.count(student['id'])
+        summary = note_log.summary(student['id'])
+        if count or summary:
+            notes = note_log.recent(student['id'], count) if count else []
+            sqlite_notes.import_log(student['id'], notes, summary)
+            note_count += len(notes)
+
+    users_file = data_dir / 'users.json'
+    users = json.loads(users_file.read_text(encoding='utf-8')) if users_file.exists() else {}
+    if users:
+        user_store = SqliteUserStore(database)
+        merged = user_store.load()
+        merged.update(users)
+        user_store.save(merged)
+    return len(students), note_count, len(users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', default=str(Path(__file__).parent / 'data'),
+                        help='directory holding students.json, students.log, notes/ and users.json')
+    parser.add_argument('--db', default=None,
+                        help='SQLite database to write (default: <data-dir>/studmgmt.sqlite)')
+    args = parser.parse_args()
+
+    db_path = args.db or Path(args.data_dir) / 'studmgmt.sqlite'
+    students, notes, users = migrate(args.data_dir, db_path)
+    print(f"✓ Migrated {students} students (with their current documents), {notes} lesson notes and {users} users into {db_path}")
+
+
+if __name__ == '__main__':
+    main()
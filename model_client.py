@@ -0,0 +1,218 @@
+"""Shared, fault-tolerant client for the AI model.
+
+One ModelClient per worker process wraps the model backend (Gemini, or the
+fake one). Every call gets a deadline, retryable failures (rate limits,
+timeouts, 5xx) are retried with jittered exponential backoff, and a circuit
+breaker stops calling a provider that keeps failing: while it is open, calls
+fail at once with ModelUnavailable instead of tying up a worker until they
+time out.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from generation import DEFAULT_MODEL, GenerationError
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+AI_MODEL = os.getenv('AI_MODEL', DEFAULT_MODEL)
+# How Gemini is called: 'grpc' or 'rest'. Empty uses the library's default (gRPC);
+# gunicorn.conf.py picks 'rest' for gevent workers, whose patched sockets it then uses
+AI_TRANSPORT = os.getenv('AI_TRANSPORT', '')
+AI_TIMEOUT_SECONDS = float(os.getenv('AI_TIMEOUT_SECONDS', '60'))
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', '2'))
+AI_RETRY_BASE_SECONDS = float(os.getenv('AI_RETRY_BASE_SECONDS', '1'))
+AI_RETRY_MAX_SECONDS = float(os.getenv('AI_RETRY_MAX_SECONDS', '10'))
+# Consecutive failed calls that open the circuit, and how long it stays open
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', '5'))
+AI_BREAKER_RESET_SECONDS = float(os.getenv('AI_BREAKER_RESET_SECONDS', '30'))
+
+# HTTP statuses worth another attempt: timeouts, rate limits, server errors
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    'DeadlineExceeded', 'ServiceUnavailable', 'ResourceExhausted', 'TooManyRequests',
+    'InternalServerError', 'BadGateway', 'GatewayTimeout', 'RetryError',
+}
+
+
+class ModelUnavailable(GenerationError):
+    """Raised when the model provider is down or keeps failing; callers should answer 503."""
+
+
+def is_retryable(error):
+    """True for failures that another attempt may get past."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS
+
+
+def backoff_delay(attempt, base=AI_RETRY_BASE_SECONDS, cap=AI_RETRY_MAX_SECONDS):
+    """Full-jitter exponential backoff before retry number ``attempt`` (1-based)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures; lets one trial call through after ``reset_seconds``."""
+
+    def __init__(self, failure_threshold=AI_BREAKER_FAILURES, reset_seconds=AI_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        """'closed', 'open' or 'half-open'."""
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """True if a call may go ahead now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_running:
+                return False
+            # Half-open: a single trial call decides whether to close again
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("✓ AI provider recovered - circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            reopen = self._trial_running
+            self._trial_running = False
+            if reopen or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                logger.error("❌ AI provider failing (%s in a row) - circuit open for %gs", self._failures, self.reset_seconds)
+
+    def release(self):
+        """End a trial call that neither succeeded nor failed on the provider's side."""
+        with self._lock:
+            self._trial_running = False
+
+
+class ModelClient:
+    """Backend wrapper adding deadlines, retries and a circuit breaker. Share one per process."""
+
+    def __init__(self, backend, timeout=AI_TIMEOUT_SECONDS, max_retries=AI_MAX_RETRIES, breaker=None):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self):
+        """Model calls (attempts) running in this worker."""
+        return self._in_flight
+
+    @contextmanager
+    def _calling(self):
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise ModelUnavailable('The AI service is temporarily unavailable. Please try again shortly.')
+
+    def _observe(self, started, outcome):
+        metrics.observe('ai_call_duration_seconds', time.perf_counter() - started,
+                        {'model': self.model_name, 'outcome': outcome})
+
+    def _failed(self, error, attempt, started):
+        """Record a failed attempt. Returns True if it should be retried."""
+        self._observe(started, 'error')
+        metrics.inc('ai_errors_total', {'model': self.model_name, 'error': type(error).__name__})
+        if not is_retryable(error):
+            self.breaker.release()
+            return False
+        self.breaker.record_failure()
+        return attempt <= self.max_retries and self.breaker.state == 'closed'
+
+    def _unavailable(self, error, attempt):
+        logger.error("❌ %s call failed after %s attempt(s): %s", self.model_name, attempt, error)
+        return ModelUnavailable(f'The AI service did not respond ({type(error).__name__}). Please try again shortly.')
+
+    def generate(self, prompt):
+        attempt = 0
+        while True:
+            attempt += 1
+            self._check_breaker()
+            started = time.perf_counter()
+            try:
+                with self._calling():
+                    text = self.backend.generate(prompt, timeout=self.timeout)
+            except Exception as e:
+                if not self._failed(e, attempt, started):
+                    if is_retryable(e):
+                        raise self._unavailable(e, attempt) from e
+                    raise
+                delay = backoff_delay(attempt)
+                metrics.inc('ai_retries_total', {'model': self.model_name})
+                logger.warning("⚠ %s call failed (%s); retry %s/%s in %.1fs", self.model_name, e, attempt, self.max_retries, delay)
+                time.sleep(delay)
+                continue
+            self._observe(started, 'ok')
+            self.breaker.record_success()
+            return text
+
+    def generate_stream(self, prompt):
+        """Yield response chunks. Retries only until the first chunk has been sent."""
+        attempt = 0
+        while True:
+            attempt += 1
+            self._check_breaker()
+            started = time.perf_counter()
+            sent = False
+            try:
+                with self._calling():
+                    for chunk in self.backend.generate_stream(prompt, timeout=self.timeout):
+                        sent = True
+                        yield chunk
+            except GeneratorExit:
+                # The client went away mid-stream; the provider was answering fine
+                self._observe(started, 'cancelled')
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                if not self._failed(e, attempt, started) or sent:
+                    if is_retryable(e):
+                        raise self._unavailable(e, attempt) from e
+                    raise
+                delay = backoff_delay(attempt)
+                metrics.inc('ai_retries_total', {'model': self.model_name})
+                logger.warning("⚠ %s stream failed (%s); retry %s/%s in %.1fs", self.model_name, e, attempt, self.max_retries, delay)
+                time.sleep(delay)
+                continue
+            self._observe(started, 'ok')
+            self.breaker.record_success()
+            return
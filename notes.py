@@ -0,0 +1,199 @@
+"""Append-only lesson note log, one JSON-lines file per student.
+
+Adding a note appends one line to data/notes/<student id>.jsonl, so older
+notes are never rewritten. Each note carries a sequence number (its line
+number), a timestamp, the text and its author. Pages and the recent notes
+used in AI prompts are read backwards from the end of the file, so their
+cost does not grow with the length of the history. The rolling summary of
+older notes used by the AI prompts (see history.py) is kept beside the log
+in <student id>.summary.json.
+"""
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+from locking import atomic_write_json, file_lock
+
+NOTE_MAX_LENGTH = int(os.getenv('NOTE_MAX_LENGTH', '10000'))
+NOTES_PAGE_SIZE = 20
+
+_SAFE_ID = re.compile(r'[A-Za-z0-9_-]+')
+_BLOCK_SIZE = 8192
+
+
+def _reversed_lines(path):
+    """Yield complete lines of a file from last to first, reading it in blocks from the end."""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b''
+        # Text after the final newline is a line another process is still appending
+        partial_tail = True
+        while position > 0:
+            size = min(_BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            buffer = f.read(size) + remainder
+            if partial_tail:
+                cut = buffer.rfind(b'\n')
+                if cut < 0:
+                    remainder = b''
+                    continue
+                buffer = buffer[:cut]
+                partial_tail = False
+            lines = buffer.split(b'\n')
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+
+def _last_byte(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1)
+
+
+def make_note(seq, text, author=None):
+    """Build a note record."""
+    return {'seq': seq, 'timestamp': datetime.now().isoformat(), 'text': text, 'author': author}
+
+
+class NoteLog:
+    """Per-student lesson notes stored as append-only JSON-lines files."""
+
+    def __init__(self, notes_dir):
+        self.notes_dir = Path(notes_dir)
+
+    def _path(self, student_id):
+        if not _SAFE_ID.fullmatch(str(student_id)):
+            raise ValueError(f'Invalid student id: {student_id!r}')
+        return self.notes_dir / f"{student_id}.jsonl"
+
+    def _newest(self, student_id, before=None):
+        for line in _reversed_lines(self._path(student_id)):
+            try:
+                note = json.loads(line)
+            except ValueError:
+                # Left behind by a writer that died mid-append
+                continue
+            if before is None or note['seq'] < before:
+                yield note
+
+    def append(self, student_id, text, author=None):
+        """Add a note and return it."""
+        path = self._path(student_id)
+        # Lock the log itself: it is only ever appended to, never replaced
+        with file_lock(path):
+            seq = self.count(student_id) + 1
+            note = make_note(seq, text, author)
+            with open(path, 'ab') as f:
+                data = json.dumps(note).encode('utf-8') + b'\n'
+                if f.tell() and _last_byte(path) != b'\n':
+                    data = b'\n' + data
+                f.write(data)
+        return note
+
+    def count(self, student_id):
+        """Number of notes logged for a student."""
+        last = next(self._newest(student_id), None)
+        return last['seq'] if last else 0
+
+    def page(self, student_id, before=None, limit=NOTES_PAGE_SIZE):
+        """Return (notes newest first, next_before) for notes with seq below ``before``."""
+        notes = []
+        for note in self._newest(student_id, before):
+            notes.append(note)
+            if len(notes) >= limit:
+                break
+        next_before = notes[-1]['seq'] if len(notes) == limit and notes[-1]['seq'] > 1 else None
+        return notes, next_before
+
+    def recent(self, student_id, limit):
+        """The most recent ``limit`` notes, oldest first."""
+        notes, _ = self.page(student_id, limit=limit)
+        return list(reversed(notes))
+
+    def _summary_path(self, student_id):
+        return self._path(student_id).with_suffix('.summary.json')
+
+    def summary(self, student_id):
+        """The rolling summary of older notes ({'text', 'throughSeq', 'updatedAt'}), or None."""
+        try:
+            with open(self._summary_path(student_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_summary(self, student_id, summary):
+        """Store a summary unless one covering the same or later notes is already saved."""
+        path = self._summary_path(student_id)
+        with file_lock(self._path(student_id)):
+            current = self.summary(student_id)
+            if current and current['throughSeq'] >= summary['throughSeq']:
+                return False
+            atomic_write_json(path, summary)
+            return True
+
+    def import_log(self, student_id, notes, summary=None):
+        """Replace a student's notes and summary with copies that keep their seq numbers."""
+        path = self._path(student_id)
+        data = b''.join(json.dumps(note).encode('utf-8') + b'\n' for note in notes)
+        with file_lock(path):
+            # Rewritten in place: appenders lock this file, so it must not be swapped for another
+            with open(path, 'r+b') as f:
+                f.write(data)
+                f.truncate()
+            if summary is not None:
+                atomic_write_json(self._summary_path(student_id), summary)
+            else:
+                try:
+                    os.unlink(self._summary_path(student_id))
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, student_id):
+        """Remove a student's whole note log and its summary."""
+        for path in (self._path(student_id), self._summary_path(student_id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def legacy_notes(history, timestamp):
+    """Notes for a free-text lesson history: one per non-empty line, oldest first, numbered from 1."""
+    lines = [line.strip() for line in history.splitlines() if line.strip()]
+    return [{'seq': seq, 'timestamp': timestamp, 'text': line, 'author': None} for seq, line in enumerate(lines, 1)]
+
+
+def move_legacy_history(note_log, student_store):
+    """Move the free-text lessonNoteHistory of each student into the note log. Returns how many students changed.
+
+    Each line of the history becomes a note, numbered ahead of any notes
+    already logged, and the field is emptied. The rolling summary is dropped,
+    to be rebuilt over the renumbered notes. Safe to run again after an
+    interruption.
+    """
+    changes = {}
+    for student in student_store.values():
+        history = (student.get('lessonNoteHistory') or '').strip()
+        if not history:
+            continue
+        student_id = student['id']
+        legacy = legacy_notes(history, student.get('timestamp') or datetime.now().isoformat())
+        count = note_log.count(student_id)
+        logged = list(reversed(note_log.page(student_id, limit=count)[0])) if count else []
+        # An interrupted run has already put the history's first line in front
+        if not logged or logged[0]['text'] != legacy[0]['text']:
+            logged = legacy + [dict(note, seq=note['seq'] + len(legacy)) for note in logged]
+            note_log.import_log(student_id, logged)
+        changes[student_id] = {'lessonNoteHistory': '', 'noteCount': logged[-1]['seq'], 'lastNote': logged[-1]}
+    return student_store.update_many(changes) if changes else 0
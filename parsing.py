@@ -0,0 +1,143 @@
+"""Tolerant parsing of structured (JSON) model output.
+
+Models do not always answer with bare JSON: the array may be wrapped in a
+code fence or prose, or carry small defects such as trailing commas, smart
+quotes, single-quoted strings or a truncated end. extract_json_array finds
+the first array in the text that matches the expected item schema, trying
+progressively more invasive repairs, and records which path succeeded so
+the counters show how clean the model's output really is.
+"""
+import ast
+import json
+import re
+import threading
+
+SMART_QUOTES = str.maketrans({
+    '“': '"', '”': '"', '„': '"', '‟': '"',
+    '‘': "'", '’': "'", '‚': "'", '‛': "'",
+})
+TRAILING_COMMA_RE = re.compile(r',\s*([\]}])')
+
+_decoder = json.JSONDecoder()
+
+
+class ParseStats:
+    """Counts, per worker process, how each parsed response was resolved.
+
+    Every parse ends in exactly one of direct, extracted (found inside other
+    text), one of the repairs, or failed; reprompted counts the follow-up
+    requests sent to the model after a failure.
+    """
+
+    PATHS = ('direct', 'extracted', 'smartQuotes', 'trailingCommas', 'pythonLiteral',
+             'truncated', 'reprompted', 'failed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.PATHS, 0)
+
+    def record(self, path):
+        with self._lock:
+            self._counts[path] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+parse_stats = ParseStats()
+
+
+def validate_items(value, fields):
+    """Keep the items that are objects with every field as a non-empty string (stripped, other keys dropped).
+
+    Returns the cleaned list, or None if ``value`` is not a list or no item is valid.
+    """
+    if isinstance(value, dict):
+        # {"recommendations": [...]} and similar single-key wrappers
+        lists = [v for v in value.values() if isinstance(v, list)]
+        value = lists[0] if len(lists) == 1 else None
+    if not isinstance(value, list):
+        return None
+    items = []
+    for item in value:
+        if not isinstance(item, dict):
+            continue
+        cleaned = {field: str(item.get(field) or '').strip() for field in fields}
+        if all(cleaned.values()):
+            items.append(cleaned)
+    return items or None
+
+
+def _arrays(text):
+    """Yield (start, value) for each JSON value that decodes at a '[' or '{' in the text."""
+    for match in re.finditer(r'[\[{]', text):
+        try:
+            value, _ = _decoder.raw_decode(text, match.start())
+        except ValueError:
+            continue
+        yield match.start(), value
+
+
+def _first_valid(text, fields):
+    for start, value in _arrays(text):
+        items = validate_items(value, fields)
+        if items is not None:
+            return start, items
+    return None, None
+
+
+def _python_literal(text, fields):
+    # Single-quoted strings and the like: Python's literal syntax is a superset
+    start, end = text.find('['), text.rfind(']')
+    if start < 0 or end < start:
+        return None
+    try:
+        return validate_items(ast.literal_eval(text[start:end + 1]), fields)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def _truncated(text, fields):
+    # Output cut off mid-array: keep the complete objects and close the array
+    start, end = text.find('['), text.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        return validate_items(json.loads(TRAILING_COMMA_RE.sub(r'\1', text[start:end + 1] + ']')), fields)
+    except ValueError:
+        return None
+
+
+def extract_json_array(text, fields, stats=parse_stats):
+    """Return the first array of objects with ``fields`` found in model output.
+
+    Raises ValueError when nothing usable can be recovered.
+    """
+    text = text or ''
+    start, items = _first_valid(text, fields)
+    if items is not None:
+        stats.record('direct' if not text[:start].strip() else 'extracted')
+        return items
+
+    repaired = text.translate(SMART_QUOTES)
+    if repaired != text:
+        _, items = _first_valid(repaired, fields)
+        if items is not None:
+            stats.record('smartQuotes')
+            return items
+
+    without_commas = TRAILING_COMMA_RE.sub(r'\1', repaired)
+    if without_commas != repaired:
+        _, items = _first_valid(without_commas, fields)
+        if items is not None:
+            stats.record('trailingCommas')
+            return items
+
+    for path, repair in (('pythonLiteral', _python_literal), ('truncated', _truncated)):
+        items = repair(repaired, fields)
+        if items is not None:
+            stats.record(path)
+            return items
+
+    raise ValueError('No JSON array with the expected fields found')
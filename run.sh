@@ -62,8 +62,9 @@ echo ""
 echo -e "${GREEN}Choose how to run:${NC}"
 echo "1) Development Server (Flask) - good for testing"
 echo "2) Production Server (Gunicorn) - more stable"
+echo "3) Production Server (Gunicorn, gevent workers) - many AI requests at once"
 echo ""
-read -p "Enter choice (1 or 2): " choice
+read -p "Enter choice (1, 2 or 3): " choice
 
 case $choice in
     1)
@@ -84,6 +85,15 @@ case $choice in
         cd "$SCRIPT_DIR"
         gunicorn --workers 4 --bind 127.0.0.1:5000 app:app
         ;;
+    3)
+        echo ""
+        echo -e "${GREEN}Starting Gunicorn server with gevent workers...${NC}"
+        echo -e "${GREEN}Available at: http://localhost:5000${NC}"
+        echo -e "${YELLOW}Press Ctrl+C to stop${NC}"
+        echo ""
+        cd "$SCRIPT_DIR"
+        GUNICORN_WORKER_CLASS=gevent gunicorn --workers 2 --bind 127.0.0.1:5000 app:app
+        ;;
     *)
         echo -e "${RED}Invalid choice${NC}"
         exit 1
@@ -0,0 +1,192 @@
+"""Full-text search over student names, notes, goals, assignments and lesson plans.
+
+An in-memory inverted index: each searchable field is tokenized, and every
+term maps to the students it appears in with a field-weighted term count.
+Queries match students containing every term (the last term also matches as
+a prefix, for search-as-you-type) and are ranked with BM25.
+
+The index is updated one record at a time as the store applies changes, so
+keeping it current costs only the changed record, however long the note
+histories grow. Lesson notes live in the note log and lesson plans in the
+artifact store rather than the record; the store adds their text to the
+student's entry with add_text as it sees the note count or the plan's
+version change.
+"""
+import bisect
+import heapq
+import math
+import re
+import unicodedata
+
+# Field -> weight of a term occurrence in that field
+SEARCH_FIELDS = {
+    'name': 3.0,
+    'currentAssignments': 2.0,
+    'currentGoals': 1.5,
+    'lessonNoteHistory': 1.0,
+    # From the note log (notes.py), not the record
+    'lessonNotes': 1.0,
+    # The current plan from the artifact store, or inline in records not yet moved there
+    'lessonPlan': 0.5,
+}
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i in into is it its
+of on or she that the their them they this to was were will with
+""".split())
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """Lowercase, strip accents and split into terms, dropping stopwords."""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return [term for term in TOKEN_RE.findall(text) if term not in STOPWORDS]
+
+
+def document_terms(record, fields=SEARCH_FIELDS):
+    """Weighted term counts for one record."""
+    terms = {}
+    for field, weight in fields.items():
+        for term in tokenize(record.get(field)):
+            terms[term] = terms.get(term, 0.0) + weight
+    return terms
+
+
+class SearchIndex:
+    """Inverted index of student records. Not thread-safe: the owning store serializes access."""
+
+    def __init__(self, fields=SEARCH_FIELDS):
+        self.fields = fields
+        self._postings = {}   # term -> {student_id: weighted count}
+        self._documents = {}  # student_id -> {term: weighted count}, record and added text together
+        self._record_terms = {}  # student_id -> {term: weighted count} from the record's own fields
+        self._texts = {}      # student_id -> {field: {term: weighted count}} added with add_text
+        self._lengths = {}    # student_id -> sum of weighted counts
+        self._total_length = 0.0
+        self._vocabulary = []  # sorted terms, for prefix matches
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, student_id, record):
+        """Index a record, replacing any earlier version of it. Text added with add_text is kept."""
+        self._record_terms[student_id] = document_terms(record, self.fields)
+        self._update(student_id)
+
+    def add_text(self, student_id, field, text, replace=False):
+        """Index text kept outside the record (such as lesson notes) as part of one of its fields.
+
+        The terms are added to those the field already has, or replace them with ``replace``.
+        """
+        texts = self._texts.setdefault(student_id, {})
+        terms = {} if replace else dict(texts.get(field, {}))
+        weight = self.fields[field]
+        for term in tokenize(text):
+            terms[term] = terms.get(term, 0.0) + weight
+        texts[field] = terms
+        self._update(student_id)
+
+    def remove(self, student_id):
+        """Drop a record, and any text added for it, from the index."""
+        self._record_terms.pop(student_id, None)
+        self._texts.pop(student_id, None)
+        self._unpost(student_id)
+
+    def _update(self, student_id):
+        self._unpost(student_id)
+        if student_id not in self._record_terms:
+            # Text for a record not indexed yet is indexed along with it
+            return
+        terms = dict(self._record_terms[student_id])
+        for field_terms in self._texts.get(student_id, {}).values():
+            for term, count in field_terms.items():
+                terms[term] = terms.get(term, 0.0) + count
+        if not terms:
+            return
+        for term, count in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._vocabulary, term)
+            postings[student_id] = count
+        length = sum(terms.values())
+        self._documents[student_id] = terms
+        self._lengths[student_id] = length
+        self._total_length += length
+
+    def _unpost(self, student_id):
+        terms = self._documents.pop(student_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[student_id]
+            if not postings:
+                del self._postings[term]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, term)]
+        self._total_length -= self._lengths.pop(student_id)
+
+    def _expand_prefix(self, prefix, max_terms=50):
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:start + max_terms]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query, limit=20, accept=None):
+        """Return [(student_id, score)] best first for students matching every query term.
+
+        ``accept(student_id)`` can reject results (e.g. filters) before the limit applies.
+        """
+        terms = tokenize(query)
+        if not terms or not self._documents:
+            return []
+
+        # Each query term becomes a group of index terms; the last may be a prefix
+        groups = [[term] if term in self._postings else [] for term in terms[:-1]]
+        groups.append(self._expand_prefix(terms[-1]))
+        if not all(groups):
+            return []
+
+        count = len(self._documents)
+        average_length = self._total_length / count
+        scores = None
+        for group in sorted(groups, key=lambda g: sum(len(self._postings[t]) for t in g)):
+            group_scores = {}
+            for term in group:
+                postings = self._postings[term]
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for student_id, tf in postings.items():
+                    if scores is not None and student_id not in scores:
+                        continue
+                    norm = K1 * (1 - B + B * self._lengths[student_id] / average_length)
+                    score = idf * tf * (K1 + 1) / (tf + norm)
+                    group_scores[student_id] = max(group_scores.get(student_id, 0.0), score)
+            if scores is None:
+                scores = group_scores
+            else:
+                scores = {student_id: scores[student_id] + score for student_id, score in group_scores.items()}
+            if not scores:
+                return []
+
+        if accept is None:
+            ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        else:
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            ranked = (item for item in ranked if accept(item[0]))
+        results = []
+        for student_id, score in ranked:
+            results.append((student_id, round(score, 6)))
+            if len(results) >= limit:
+                break
+        return results
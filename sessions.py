@@ -0,0 +1,241 @@
+"""Server-side sessions with the user's role cached at login.
+
+The session cookie holds only a random session id. The session itself (user
+id, username and role) is stored in data/sessions/<id>.json, or in the
+SQLite database when SESSION_BACKEND=sqlite. Each worker also keeps the
+sessions it has seen in memory, so checking who is logged in and with which
+role costs no disk read.
+
+Sessions are changed behind other workers' backs only by logout, deleting
+a teacher, or a role change. Each of those bumps a shared epoch counter, a
+memory-mapped 8-byte file. A worker drops its in-memory copies when it sees
+the epoch move, and reads the changed sessions again from the store.
+"""
+import json
+import logging
+import mmap
+import os
+import re
+import secrets
+import struct
+import threading
+import time
+from pathlib import Path
+
+from flask.sessions import CallbackDict, SessionInterface, SessionMixin
+
+from locking import atomic_write_json, file_lock, lock_path_for
+
+logger = logging.getLogger(__name__)
+
+SESSION_LIFETIME_SECONDS = int(os.getenv('SESSION_LIFETIME_SECONDS', str(14 * 24 * 3600)))
+
+_SESSION_ID = re.compile(r'[A-Za-z0-9_-]{43}')
+_EPOCH = struct.Struct('<Q')
+# In-memory sessions kept per worker before the cache starts over
+_CACHE_LIMIT = 10000
+
+
+def new_session_id():
+    return secrets.token_urlsafe(32)
+
+
+class SessionEpoch:
+    """A counter shared by all processes, bumped whenever stored sessions change under them."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._map = None
+
+    def _counter(self):
+        if self._map is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < _EPOCH.size:
+                    os.ftruncate(fd, _EPOCH.size)
+                self._map = mmap.mmap(fd, _EPOCH.size)
+            finally:
+                os.close(fd)
+        return self._map
+
+    @property
+    def value(self):
+        return _EPOCH.unpack_from(self._counter())[0]
+
+    def bump(self):
+        with file_lock(lock_path_for(self.path)):
+            counter = self._counter()
+            _EPOCH.pack_into(counter, 0, _EPOCH.unpack_from(counter)[0] + 1)
+
+
+class FileSessionStore:
+    """One small JSON file per session."""
+
+    def __init__(self, sessions_dir):
+        self.sessions_dir = Path(sessions_dir)
+        self._last_cleanup = 0
+
+    def _path(self, sid):
+        return self.sessions_dir / f"{sid}.json"
+
+    def get(self, sid):
+        """Return {'username', 'data', 'expires'} for a session, or None."""
+        try:
+            with open(self._path(sid), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            return None
+
+    def put(self, sid, username, data, expires):
+        atomic_write_json(self._path(sid), {'username': username, 'data': data, 'expires': expires}, indent=None)
+        self._remove_expired()
+
+    def delete(self, sid):
+        try:
+            os.unlink(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def user_sessions(self, username):
+        """Return {sid: record} for every stored session of a user."""
+        sessions = {}
+        try:
+            entries = list(os.scandir(self.sessions_dir))
+        except FileNotFoundError:
+            return sessions
+        for entry in entries:
+            sid, extension = os.path.splitext(entry.name)
+            if extension != '.json':
+                continue
+            record = self.get(sid)
+            if record and record.get('username') == username:
+                sessions[sid] = record
+        return sessions
+
+    def _remove_expired(self):
+        # At most once an hour per worker
+        if time.time() - self._last_cleanup < 3600:
+            return
+        self._last_cleanup = time.time()
+        removed = 0
+        for entry in os.scandir(self.sessions_dir):
+            sid, extension = os.path.splitext(entry.name)
+            if extension != '.json':
+                continue
+            record = self.get(sid)
+            if record is not None and record.get('expires', 0) < self._last_cleanup:
+                self.delete(sid)
+                removed += 1
+        if removed:
+            logger.debug("Removed %s expired sessions", removed)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data kept on the server; ``sid`` is None until the session is first saved."""
+
+    def __init__(self, initial=None, sid=None):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the data to a new session id (at login, so an id issued before it cannot be reused)."""
+        if self.sid is not None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface over a session store, with a per-worker in-memory cache."""
+
+    def __init__(self, store, epoch, lifetime=SESSION_LIFETIME_SECONDS):
+        self.store = store
+        self.epoch = epoch
+        self.lifetime = lifetime
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._cache_epoch = None
+
+    def _cached(self, sid):
+        epoch = self.epoch.value
+        with self._lock:
+            if epoch != self._cache_epoch:
+                self._cache.clear()
+                self._cache_epoch = epoch
+            record = self._cache.get(sid)
+        if record is None:
+            record = self.store.get(sid)
+            if record is None:
+                return None
+            with self._lock:
+                if len(self._cache) >= _CACHE_LIMIT:
+                    self._cache.clear()
+                self._cache[sid] = record
+        return record
+
+    def _forget(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SESSION_ID.fullmatch(sid):
+            record = self._cached(sid)
+            if record is not None and record['expires'] > time.time():
+                return ServerSession(record['data'], sid)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+            self._forget(session.previous_sid)
+        if not session:
+            if session.sid is not None and session.modified:
+                # Logout: other workers may hold this session in memory
+                self.store.delete(session.sid)
+                self._forget(session.sid)
+                self.epoch.bump()
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified and session.sid is not None:
+            return
+        if session.sid is None:
+            session.sid = new_session_id()
+        expires = time.time() + self.lifetime
+        record = {'username': session.get('username'), 'data': dict(session), 'expires': expires}
+        self.store.put(session.sid, record['username'], record['data'], expires)
+        with self._lock:
+            self._cache[session.sid] = record
+        response.set_cookie(
+            name, session.sid, max_age=self.lifetime, domain=domain, path=path,
+            httponly=self.get_cookie_httponly(app), secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def end_user_sessions(self, username):
+        """Log a user out everywhere (e.g. their account was deleted)."""
+        sessions = self.store.user_sessions(username)
+        for sid in sessions:
+            self.store.delete(sid)
+        self.epoch.bump()
+        return len(sessions)
+
+    def update_user_sessions(self, username, **changes):
+        """Apply changes (e.g. a new role) to every session of a user."""
+        sessions = self.store.user_sessions(username)
+        for sid, record in sessions.items():
+            record['data'].update(changes)
+            self.store.put(sid, username, record['data'], record['expires'])
+        self.epoch.bump()
+        return len(sessions)
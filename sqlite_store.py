@@ -0,0 +1,747 @@
+"""SQLite storage backend for students and users.
+
+An alternative to the JSON files, selected with STORAGE_BACKEND=sqlite.
+SqliteStudentStore offers the same interface as store.StudentStore, so
+app.py does not care which one it talks to. The database runs in WAL mode,
+so readers in every gunicorn worker proceed while a writer commits, and the
+list filters and newest-first ordering are answered from indexes instead of
+a scan of every student.
+
+The fields that are filtered or sorted on get their own columns, the large
+generated documents are TEXT columns, and any other fields (age, or ones
+added later) are kept in a JSON ``extra`` column. An FTS5 table serves
+full-text search. It has one row per student (same rowid) and holds its own
+copy of the searched text, because part of it, the lesson notes, comes from
+the notes table and the current lesson plan from the artifacts table. Writes
+keep it in step.
+
+Each write stamps the rows it touches with its change number (the
+generation it commits as) in ``seq``. Deleted ids go to student_tombstones,
+so ``changes(since)`` can list both.
+
+Generated documents are kept out of the students table, compressed, in the
+artifacts table (see artifacts.py).
+"""
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from artifacts import ARTIFACT_HISTORY_LIMIT, make_ref
+from metrics import metrics
+from notes import NOTES_PAGE_SIZE, make_note
+from search import SEARCH_FIELDS, tokenize
+from store import CHANGES_TOMBSTONE_LIMIT, VersionConflict
+
+logger = logging.getLogger(__name__)
+
+# record field -> column
+STUDENT_COLUMNS = {
+    'name': 'name',
+    'instrument': 'instrument',
+    'skillLevel': 'skill_level',
+    'ownerId': 'owner_id',
+    'timestamp': 'timestamp',
+    'currentAssignments': 'current_assignments',
+    'currentGoals': 'current_goals',
+    'lessonNoteHistory': 'lesson_note_history',
+    'recommendations': 'recommendations',
+    'lessonPlan': 'lesson_plan',
+    'journeyReport': 'journey_report',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 1,
+    name TEXT,
+    instrument TEXT,
+    skill_level TEXT,
+    owner_id TEXT,
+    timestamp TEXT NOT NULL DEFAULT '',
+    current_assignments TEXT,
+    current_goals TEXT,
+    lesson_note_history TEXT,
+    recommendations TEXT,
+    lesson_plan TEXT,
+    journey_report TEXT,
+    extra TEXT NOT NULL DEFAULT '{}',
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS students_timestamp ON students (timestamp, id);
+CREATE INDEX IF NOT EXISTS students_instrument ON students (instrument COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS students_skill_level ON students (skill_level);
+CREATE INDEX IF NOT EXISTS students_owner_id ON students (owner_id, timestamp);
+CREATE INDEX IF NOT EXISTS students_seq ON students (seq);
+CREATE TABLE IF NOT EXISTS student_tombstones (
+    id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS student_tombstones_seq ON student_tombstones (seq);
+CREATE TABLE IF NOT EXISTS notes (
+    student_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    text TEXT NOT NULL,
+    author TEXT,
+    PRIMARY KEY (student_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS note_summaries (
+    student_id TEXT PRIMARY KEY,
+    through_seq INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    student_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    content BLOB NOT NULL,
+    PRIMARY KEY (student_id, field, version)
+);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    role TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    username TEXT,
+    data TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_username ON sessions (username);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+-- Deletions up to this change number may have been forgotten
+INSERT OR IGNORE INTO meta (key, value) VALUES ('change_floor', 0);
+-- Layout of students_fts (see SEARCH_INDEX_VERSION)
+INSERT OR IGNORE INTO meta (key, value) VALUES ('search_index', 0);
+"""
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE students_fts USING fts5 (
+    name, current_assignments, current_goals, lesson_note_history, lesson_plan, lesson_notes,
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+# Bumped when students_fts changes; older indexes are rebuilt on connect.
+# 2: lesson notes, 3: lesson plans from the artifacts table
+SEARCH_INDEX_VERSION = 3
+
+
+class SqliteDatabase:
+    """One SQLite file, with a connection per thread (and per process after fork)."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(students)')}
+            if columns and 'seq' not in columns:
+                # Databases created before change numbers: existing rows only show up in full listings
+                conn.execute('ALTER TABLE students ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+            conn.executescript(SCHEMA)
+            _upgrade_search_index(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run the block as one write transaction and bump the generation counter."""
+        conn = self.connect()
+        started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        # Includes waiting for other writers' locks
+        metrics.observe('store_save_seconds', time.perf_counter() - started, {'backend': 'sqlite', 'op': 'transaction'})
+
+
+def _search_index_version(conn):
+    return conn.execute("SELECT value FROM meta WHERE key = 'search_index'").fetchone()[0]
+
+
+def _upgrade_search_index(conn):
+    """Create students_fts, or rebuild one in an older layout, and fill it from the tables."""
+    if _search_index_version(conn) >= SEARCH_INDEX_VERSION:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Another process may have got here first
+        if _search_index_version(conn) < SEARCH_INDEX_VERSION:
+            # Version 1 was kept in step by triggers and covered neither notes nor moved plans
+            conn.execute('DROP TRIGGER IF EXISTS students_fts_insert')
+            conn.execute('DROP TRIGGER IF EXISTS students_fts_delete')
+            conn.execute('DROP TABLE IF EXISTS students_fts')
+            conn.execute(SEARCH_SCHEMA)
+            conn.execute(
+                'INSERT INTO students_fts (rowid, name, current_assignments, current_goals, '
+                'lesson_note_history, lesson_plan, lesson_notes) '
+                'SELECT rowid, name, current_assignments, current_goals, lesson_note_history, lesson_plan, '
+                "(SELECT group_concat(text, char(10)) FROM notes WHERE notes.student_id = students.id) "
+                'FROM students'
+            )
+            plans = conn.execute(
+                "SELECT rowid, id, json_extract(extra, '$.lessonPlanRef.version') AS plan_version FROM students "
+                'WHERE lesson_plan IS NULL AND plan_version IS NOT NULL'
+            ).fetchall()
+            for row in plans:
+                conn.execute(
+                    'UPDATE students_fts SET lesson_plan = ? WHERE rowid = ?',
+                    (_document(conn, row['id'], 'lessonPlan', row['plan_version']), row['rowid'])
+                )
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'search_index'", (SEARCH_INDEX_VERSION,))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _document(conn, student_id, field, version):
+    """One stored version of a generated document, or None."""
+    row = conn.execute(
+        'SELECT content FROM artifacts WHERE student_id = ? AND field = ? AND version = ?',
+        (student_id, field, int(version))
+    ).fetchone()
+    return gzip.decompress(row[0]).decode('utf-8') if row else None
+
+
+def _row_to_record(row):
+    record = json.loads(row['extra'])
+    record['id'] = row['id']
+    for field, column in STUDENT_COLUMNS.items():
+        if row[column] is not None:
+            record[field] = row[column]
+    record['version'] = row['version']
+    if row['seq']:
+        record['changeSeq'] = row['seq']
+    return record
+
+
+def _record_to_params(record, version, seq):
+    extra = {k: v for k, v in record.items() if k not in STUDENT_COLUMNS and k not in ('id', 'version', 'changeSeq')}
+    params = {column: record.get(field) for field, column in STUDENT_COLUMNS.items()}
+    params['timestamp'] = params['timestamp'] or ''
+    params.update(id=record['id'], version=version, extra=json.dumps(extra), seq=seq)
+    return params
+
+
+# bm25() weights, in students_fts column order
+SEARCH_WEIGHTS = ', '.join(str(SEARCH_FIELDS[field]) for field in (
+    'name', 'currentAssignments', 'currentGoals', 'lessonNoteHistory', 'lessonPlan', 'lessonNotes'
+))
+
+
+def _filter_clauses(filters, table='students'):
+    """WHERE clauses and parameters for the list filters (see store.matches_filters)."""
+    where, params = [], []
+    filters = filters or {}
+    if filters.get('instrument'):
+        where.append(f'{table}.instrument = ? COLLATE NOCASE')
+        params.append(filters['instrument'])
+    if filters.get('skillLevel'):
+        where.append(f'{table}.skill_level = ?')
+        params.append(filters['skillLevel'])
+    if filters.get('ownerId'):
+        where.append(f'{table}.owner_id = ?')
+        params.append(filters['ownerId'])
+    if filters.get('name'):
+        escaped = filters['name'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where.append(f"{table}.name LIKE ? ESCAPE '\\'")
+        params.append(escaped + '%')
+    return where, params
+
+
+def _match_query(query):
+    """FTS5 query matching every term, the last one also as a prefix."""
+    terms = tokenize(query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+
+
+_INSERT = (
+    f"INSERT INTO students (id, version, extra, seq, {', '.join(STUDENT_COLUMNS.values())}) "
+    f"VALUES (:id, :version, :extra, :seq, {', '.join(':' + c for c in STUDENT_COLUMNS.values())})"
+)
+_UPDATE = (
+    f"UPDATE students SET version = :version, extra = :extra, seq = :seq, "
+    f"{', '.join(f'{c} = :{c}' for c in STUDENT_COLUMNS.values())} WHERE rowid = :rowid"
+)
+# The record's searched columns; lesson_notes is kept by SqliteNoteLog. A NULL
+# :plan_text leaves the indexed lesson plan as it is.
+_INSERT_SEARCH = (
+    'INSERT INTO students_fts (rowid, name, current_assignments, current_goals, lesson_note_history, lesson_plan, lesson_notes) '
+    "VALUES (:rowid, :name, :current_assignments, :current_goals, :lesson_note_history, :plan_text, '')"
+)
+_UPDATE_SEARCH = (
+    'UPDATE students_fts SET name = :name, current_assignments = :current_assignments, '
+    'current_goals = :current_goals, lesson_note_history = :lesson_note_history, '
+    'lesson_plan = coalesce(:plan_text, lesson_plan) WHERE rowid = :rowid'
+)
+
+
+def _next_seq(conn):
+    # transaction() bumps the generation by one as it commits
+    return conn.execute("SELECT value + 1 FROM meta WHERE key = 'generation'").fetchone()[0]
+
+
+def _write(conn, record, version, seq):
+    params = _record_to_params(record, version, seq)
+    row = conn.execute('SELECT rowid, extra FROM students WHERE id = ?', (record['id'],)).fetchone()
+    # A plan inline in the record, else a newly stored version (written to artifacts first)
+    params['plan_text'] = params['lesson_plan']
+    plan_ref = record.get('lessonPlanRef')
+    if params['plan_text'] is None and plan_ref and (row is None or json.loads(row['extra']).get('lessonPlanRef') != plan_ref):
+        params['plan_text'] = _document(conn, record['id'], 'lessonPlan', plan_ref['version']) or ''
+    if row is None:
+        params['rowid'] = conn.execute(_INSERT, params).lastrowid
+        conn.execute(_INSERT_SEARCH, params)
+    else:
+        params['rowid'] = row[0]
+        conn.execute(_UPDATE, params)
+        conn.execute(_UPDATE_SEARCH, params)
+    conn.execute('DELETE FROM student_tombstones WHERE id = ?', (record['id'],))
+
+
+def _remove(conn, student_id, seq):
+    conn.execute('DELETE FROM students_fts WHERE rowid = (SELECT rowid FROM students WHERE id = ?)', (student_id,))
+    conn.execute('DELETE FROM students WHERE id = ?', (student_id,))
+    conn.execute('INSERT OR REPLACE INTO student_tombstones (id, seq) VALUES (?, ?)', (student_id, seq))
+    excess = conn.execute('SELECT COUNT(*) FROM student_tombstones').fetchone()[0] - CHANGES_TOMBSTONE_LIMIT
+    if excess > 0:
+        floor = conn.execute(
+            'SELECT MAX(seq) FROM (SELECT seq FROM student_tombstones ORDER BY seq LIMIT ?)', (excess,)
+        ).fetchone()[0]
+        conn.execute('DELETE FROM student_tombstones WHERE seq <= ?', (floor,))
+        conn.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'change_floor'", (floor,))
+
+
+class SqliteStudentStore:
+    """Student records in SQLite, with the same interface as store.StudentStore."""
+
+    def __init__(self, db):
+        self.db = db
+
+    # --- READS ---
+
+    def get(self, student_id):
+        """Return one student record, or None."""
+        row = self.db.connect().execute('SELECT * FROM students WHERE id = ?', (student_id,)).fetchone()
+        return _row_to_record(row) if row else None
+
+    def all(self):
+        """Return every record as a dict keyed by id."""
+        return {record['id']: record for record in self.values()}
+
+    def values(self):
+        """Return every record."""
+        return [_row_to_record(row) for row in self.db.connect().execute('SELECT * FROM students')]
+
+    def scan(self, after=None, filters=None, limit=None):
+        """Return records newest first; see StudentStore.scan.
+
+        Filters and the cursor become a WHERE clause on the indexed columns.
+        """
+        where, params = _filter_clauses(filters)
+        if after:
+            where.append('(timestamp, id) < (?, ?)')
+            params.extend(after)
+
+        sql = 'SELECT * FROM students'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY timestamp DESC, id DESC'
+        if limit is not None:
+            # One extra row tells us whether there is another page
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+
+        rows = self.db.connect().execute(sql, params).fetchall()
+        records = [_row_to_record(row) for row in rows[:limit]]
+        if limit is not None and len(rows) > limit:
+            last = records[-1]
+            return records, (last.get('timestamp') or '', last['id'])
+        return records, None
+
+    def search(self, query, limit=20, filters=None):
+        """Full-text search. Returns [(record, score)] best match first."""
+        match = _match_query(query)
+        if match is None:
+            return []
+        where, params = _filter_clauses(filters)
+        sql = (
+            f'SELECT students.*, -bm25(students_fts, {SEARCH_WEIGHTS}) AS score '
+            'FROM students_fts JOIN students ON students.rowid = students_fts.rowid '
+            'WHERE students_fts MATCH ?'
+        )
+        if where:
+            sql += ' AND ' + ' AND '.join(where)
+        sql += ' ORDER BY score DESC, students.id LIMIT ?'
+        rows = self.db.connect().execute(sql, [match] + params + [limit]).fetchall()
+        return [(_row_to_record(row), round(row['score'], 6)) for row in rows]
+
+    @property
+    def change_seq(self):
+        """Change number of the latest write."""
+        return self.generation
+
+    def changes(self, since):
+        """Records written and ids deleted after change number ``since`` (see StudentStore.changes)."""
+        conn = self.db.connect()
+        # One read transaction, so the rows match the change number returned
+        conn.execute('BEGIN')
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('generation', 'change_floor')").fetchall())
+            seq = meta['generation']
+            if since <= 0 or since < meta['change_floor'] or since > seq:
+                return None
+            records = [_row_to_record(row) for row in conn.execute(
+                'SELECT * FROM students WHERE seq > ? ORDER BY seq', (since,)
+            )]
+            deleted = [row[0] for row in conn.execute(
+                'SELECT id FROM student_tombstones WHERE seq > ? ORDER BY seq', (since,)
+            )]
+        finally:
+            conn.execute('COMMIT')
+        return seq, records, deleted
+
+    def __contains__(self, student_id):
+        row = self.db.connect().execute('SELECT 1 FROM students WHERE id = ?', (student_id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.db.connect().execute('SELECT COUNT(*) FROM students').fetchone()[0]
+
+    @property
+    def generation(self):
+        """Counter bumped by every committed write, in any process."""
+        row = self.db.connect().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0]
+
+    @property
+    def state_token(self):
+        """A string that changes with every committed write (see StudentStore.state_token)."""
+        generation = self.generation
+        # The inode tells a recreated database apart from the old one at the same generation
+        return f"{os.stat(self.db.path).st_ino}.{generation}"
+
+    def refresh(self):
+        """Nothing to do: every read goes to the database."""
+
+    # --- WRITES ---
+
+    def _current(self, conn, student_id):
+        row = conn.execute('SELECT * FROM students WHERE id = ?', (student_id,)).fetchone()
+        return _row_to_record(row) if row else None
+
+    def _check_version(self, student_id, current, expected_version):
+        actual = current['version'] if current else 0
+        if expected_version is not None and actual != int(expected_version):
+            raise VersionConflict(student_id, expected_version, actual)
+
+    def put(self, record, expected_version=None):
+        """Insert or replace a single student record (compare-and-swap if expected_version is given)."""
+        with self.db.transaction() as conn:
+            current = self._current(conn, record['id'])
+            self._check_version(record['id'], current, expected_version)
+            record = dict(record)
+            record['version'] = (current['version'] if current else 0) + 1
+            record['changeSeq'] = _next_seq(conn)
+            _write(conn, record, record['version'], record['changeSeq'])
+        return record
+
+    def update(self, student_id, changes, expected_version=None):
+        """Apply field changes to the stored record. Returns it, or None if missing."""
+        with self.db.transaction() as conn:
+            current = self._current(conn, student_id)
+            if current is None:
+                return None
+            self._check_version(student_id, current, expected_version)
+            record = dict(current)
+            record.update(changes)
+            record['version'] = current['version'] + 1
+            record['changeSeq'] = _next_seq(conn)
+            _write(conn, record, record['version'], record['changeSeq'])
+        return record
+
+    def update_many(self, changes_by_id):
+        """Apply field changes to several records in one transaction."""
+        updated = 0
+        with self.db.transaction() as conn:
+            seq = _next_seq(conn)
+            for student_id, changes in changes_by_id.items():
+                current = self._current(conn, student_id)
+                if current is None:
+                    continue
+                record = dict(current)
+                record.update(changes)
+                _write(conn, record, current['version'] + 1, seq)
+                updated += 1
+        return updated
+
+    def put_many(self, records):
+        """Insert or replace several records in one transaction."""
+        count = 0
+        with self.db.transaction() as conn:
+            seq = _next_seq(conn)
+            for record in records:
+                row = conn.execute('SELECT version FROM students WHERE id = ?', (record['id'],)).fetchone()
+                _write(conn, record, (row[0] if row else 0) + 1, seq)
+                count += 1
+        return count
+
+    def delete(self, student_id, expected_version=None):
+        """Remove a student record. Returns the removed record, or None."""
+        with self.db.transaction() as conn:
+            current = self._current(conn, student_id)
+            if current is None:
+                return None
+            self._check_version(student_id, current, expected_version)
+            _remove(conn, student_id, _next_seq(conn))
+        return current
+
+    def replace_all(self, students):
+        """Bring the table in line with a full students dict, writing only the differences."""
+        changed = 0
+        with self.db.transaction() as conn:
+            seq = _next_seq(conn)
+            existing = {row['id']: _row_to_record(row) for row in conn.execute('SELECT * FROM students')}
+            for student_id in existing.keys() - students.keys():
+                _remove(conn, student_id, seq)
+                changed += 1
+            for student_id, record in students.items():
+                current = existing.get(student_id)
+                if current != record:
+                    version = (current['version'] if current else 0) + 1
+                    _write(conn, dict(record, id=student_id), version, seq)
+                    changed += 1
+        return changed
+
+    def compact(self):
+        """Fold the WAL back into the main database file."""
+        self.db.connect().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+class SqliteNoteLog:
+    """Lesson notes in SQLite, with the same interface as notes.NoteLog."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def append(self, student_id, text, author=None):
+        """Add a note and return it."""
+        with self.db.transaction() as conn:
+            seq = self._count(conn, student_id) + 1
+            note = make_note(seq, text, author)
+            conn.execute(
+                'INSERT INTO notes (student_id, seq, timestamp, text, author) VALUES (?, ?, ?, ?, ?)',
+                (student_id, seq, note['timestamp'], text, author)
+            )
+            conn.execute(
+                "UPDATE students_fts SET lesson_notes = coalesce(lesson_notes || char(10), '') || ? "
+                'WHERE rowid = (SELECT rowid FROM students WHERE id = ?)',
+                (text, student_id)
+            )
+        return note
+
+    def _count(self, conn, student_id):
+        row = conn.execute('SELECT MAX(seq) FROM notes WHERE student_id = ?', (student_id,)).fetchone()
+        return row[0] or 0
+
+    def count(self, student_id):
+        """Number of notes logged for a student."""
+        return self._count(self.db.connect(), student_id)
+
+    def page(self, student_id, before=None, limit=NOTES_PAGE_SIZE):
+        """Return (notes newest first, next_before) for notes with seq below ``before``."""
+        rows = self.db.connect().execute(
+            'SELECT seq, timestamp, text, author FROM notes WHERE student_id = ? AND seq < ? '
+            'ORDER BY seq DESC LIMIT ?',
+            (student_id, before if before is not None else 2 ** 62, limit)
+        ).fetchall()
+        notes = [dict(row) for row in rows]
+        next_before = notes[-1]['seq'] if len(notes) == limit and notes[-1]['seq'] > 1 else None
+        return notes, next_before
+
+    def recent(self, student_id, limit):
+        """The most recent ``limit`` notes, oldest first."""
+        notes, _ = self.page(student_id, limit=limit)
+        return list(reversed(notes))
+
+    def summary(self, student_id):
+        """The rolling summary of older notes, or None."""
+        row = self.db.connect().execute(
+            'SELECT data FROM note_summaries WHERE student_id = ?', (student_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_summary(self, student_id, summary):
+        """Store a summary unless one covering the same or later notes is already saved."""
+        cursor = self.db.connect().execute(
+            'INSERT INTO note_summaries (student_id, through_seq, data) VALUES (?, ?, ?) '
+            'ON CONFLICT (student_id) DO UPDATE SET through_seq = excluded.through_seq, data = excluded.data '
+            'WHERE excluded.through_seq > note_summaries.through_seq',
+            (student_id, summary['throughSeq'], json.dumps(summary))
+        )
+        return cursor.rowcount > 0
+
+    def import_log(self, student_id, notes, summary=None):
+        """Replace a student's notes and summary with copies that keep their seq numbers (see migrate_to_sqlite.py)."""
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM notes WHERE student_id = ?', (student_id,))
+            conn.execute('DELETE FROM note_summaries WHERE student_id = ?', (student_id,))
+            conn.executemany(
+                'INSERT INTO notes (student_id, seq, timestamp, text, author) VALUES (?, ?, ?, ?, ?)',
+                [(student_id, note['seq'], note['timestamp'], note['text'], note.get('author')) for note in notes]
+            )
+            conn.execute(
+                'UPDATE students_fts SET lesson_notes = '
+                '(SELECT group_concat(text, char(10)) FROM notes WHERE student_id = ?) '
+                'WHERE rowid = (SELECT rowid FROM students WHERE id = ?)',
+                (student_id, student_id)
+            )
+        if summary is not None:
+            self.save_summary(student_id, summary)
+
+    def delete(self, student_id):
+        """Remove a student's whole note log and its summary."""
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM notes WHERE student_id = ?', (student_id,))
+            conn.execute('DELETE FROM note_summaries WHERE student_id = ?', (student_id,))
+
+
+class SqliteArtifactStore:
+    """Generated documents in SQLite, gzip-compressed, with the same interface as artifacts.ArtifactStore."""
+
+    def __init__(self, db, history_limit=ARTIFACT_HISTORY_LIMIT):
+        self.db = db
+        self.history_limit = history_limit
+
+    def put(self, student_id, field, content):
+        """Store a new version of a document. Returns its reference for the student record."""
+        data = gzip.compress(content.encode('utf-8'), mtime=0)
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                'SELECT MAX(version) FROM artifacts WHERE student_id = ? AND field = ?', (student_id, field)
+            ).fetchone()
+            ref = make_ref(field, (row[0] or 0) + 1, content)
+            conn.execute(
+                'INSERT INTO artifacts (student_id, field, version, created_at, content) VALUES (?, ?, ?, ?, ?)',
+                (student_id, field, ref['version'], ref['createdAt'], data)
+            )
+            if self.history_limit > 0:
+                conn.execute(
+                    'DELETE FROM artifacts WHERE student_id = ? AND field = ? AND version <= ?',
+                    (student_id, field, ref['version'] - self.history_limit)
+                )
+        return ref
+
+    def get(self, student_id, field, version):
+        """Return one version of a document, or None if it is not stored."""
+        return _document(self.db.connect(), student_id, field, version)
+
+    def versions(self, student_id, field):
+        """Stored versions of a document, newest first: [{'version', 'createdAt'}]."""
+        rows = self.db.connect().execute(
+            'SELECT version, created_at FROM artifacts WHERE student_id = ? AND field = ? ORDER BY version DESC',
+            (student_id, field)
+        )
+        return [{'version': row['version'], 'createdAt': row['created_at']} for row in rows]
+
+    def delete(self, student_id):
+        """Remove every document of a student."""
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM artifacts WHERE student_id = ?', (student_id,))
+
+
+class SqliteUserStore:
+    """User accounts in SQLite, loaded and saved as the same dict as users.json."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def load(self):
+        """Return all users keyed by username."""
+        rows = self.db.connect().execute('SELECT username, data FROM users')
+        return {row['username']: json.loads(row['data']) for row in rows}
+
+    def save(self, users):
+        """Replace the stored users with the given dict."""
+        with self.db.transaction() as conn:
+            existing = {row[0] for row in conn.execute('SELECT username FROM users')}
+            for username in existing - users.keys():
+                conn.execute('DELETE FROM users WHERE username = ?', (username,))
+            for username, user in users.items():
+                conn.execute(
+                    'INSERT OR REPLACE INTO users (username, role, data) VALUES (?, ?, ?)',
+                    (username, user.get('role'), json.dumps(user))
+                )
+
+
+class SqliteSessionStore:
+    """Server-side sessions in SQLite (see sessions.py).
+
+    Each write is a single autocommit statement, outside ``transaction()``,
+    so logging in does not bump the student data generation.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._last_cleanup = 0
+
+    def get(self, sid):
+        """Return {'username', 'data', 'expires'} for a session, or None."""
+        row = self.db.connect().execute(
+            'SELECT username, data, expires FROM sessions WHERE id = ?', (sid,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'username': row['username'], 'data': json.loads(row['data']), 'expires': row['expires']}
+
+    def put(self, sid, username, data, expires):
+        conn = self.db.connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO sessions (id, username, data, expires) VALUES (?, ?, ?, ?)',
+            (sid, username, json.dumps(data), expires)
+        )
+        # At most once an hour per worker
+        if time.time() - self._last_cleanup >= 3600:
+            self._last_cleanup = time.time()
+            conn.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),))
+
+    def delete(self, sid):
+        self.db.connect().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def user_sessions(self, username):
+        """Return {sid: record} for every stored session of a user."""
+        rows = self.db.connect().execute(
+            'SELECT id, data, expires FROM sessions WHERE username = ?', (username,)
+        )
+        return {
+            row['id']: {'username': username, 'data': json.loads(row['data']), 'expires': row['expires']}
+            for row in rows
+        }
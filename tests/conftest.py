@@ -0,0 +1,33 @@
+import importlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The app's modules live at the top of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('AI_BACKEND', 'fake')
+# Cheap hashes, so logging in and creating the default admin stay fast
+os.environ.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """A freshly imported app.py whose data lives under tmp_path."""
+    monkeypatch.setenv('DATA_DIR', str(tmp_path / 'data'))
+    monkeypatch.setenv('STORAGE_BACKEND', 'json')
+    sys.modules.pop('app', None)
+    module = importlib.import_module('app')
+    yield module
+    sys.modules.pop('app', None)
+
+
+@pytest.fixture
+def client(app_module):
+    """A test client logged in as the default admin."""
+    flask_app = app_module.create_app({'TESTING': True})
+    client = flask_app.test_client()
+    response = client.post('/api/login', json={'username': 'admin', 'password': 'admin'})
+    assert response.status_code == 200
+    return client
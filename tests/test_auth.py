@@ -0,0 +1,80 @@
+import time
+
+from auth import TokenBuckets, login_limits
+
+
+def test_take_until_empty_then_wait(tmp_path):
+    buckets = TokenBuckets(tmp_path / 'throttle.bin', slots=64)
+    limits = [('user:ada', 3, 60)]
+    assert [buckets.take(limits) for _ in range(3)] == [0, 0, 0]
+    wait = buckets.take(limits)
+    # One token a second at 60 a minute
+    assert 0 < wait <= 1
+
+
+def test_give_back_refunds_the_token(tmp_path):
+    buckets = TokenBuckets(tmp_path / 'throttle.bin', slots=64)
+    limits = [('user:ada', 2, 1)]
+    for _ in range(10):
+        assert buckets.take(limits) == 0
+        buckets.give_back(limits)
+    assert buckets.take(limits) == buckets.take(limits) == 0
+    assert buckets.take(limits) > 0
+
+
+def test_nothing_taken_when_any_bucket_is_empty(tmp_path):
+    buckets = TokenBuckets(tmp_path / 'throttle.bin', slots=64)
+    assert buckets.take([('ip:10.0.0.1', 1, 1)]) == 0
+    assert buckets.take([('user:ada', 5, 1), ('ip:10.0.0.1', 1, 1)]) > 0
+    # The user's bucket was left alone: five more attempts from elsewhere
+    assert all(buckets.take([('user:ada', 5, 1)]) == 0 for _ in range(5))
+
+
+def test_buckets_are_shared_between_instances(tmp_path):
+    first = TokenBuckets(tmp_path / 'throttle.bin', slots=64)
+    second = TokenBuckets(tmp_path / 'throttle.bin', slots=64)
+    assert first.take([('user:ada', 1, 1)]) == 0
+    assert second.take([('user:ada', 1, 1)]) > 0
+
+
+def test_bucket_refills_over_time(tmp_path, monkeypatch):
+    buckets = TokenBuckets(tmp_path / 'throttle.bin', slots=64)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    assert buckets.take([('user:ada', 1, 6)]) == 0
+    assert buckets.take([('user:ada', 1, 6)]) == 10
+    monkeypatch.setattr(time, 'time', lambda: now + 10)
+    assert buckets.take([('user:ada', 1, 6)]) == 0
+
+
+def test_login_limits_keys():
+    assert [key for key, _, _ in login_limits('Ada', '10.0.0.1')] == ['user:ada', 'ip:10.0.0.1']
+
+
+def failed_login(client, username, address):
+    return client.post('/api/login', json={'username': username, 'password': 'wrong'},
+                       headers={'X-Forwarded-For': address})
+
+
+def test_login_throttled_per_client_address(app_module, client, monkeypatch):
+    burst = 20
+    monkeypatch.setattr(app_module, 'login_limits', lambda username, address: [(f'ip:{address}', burst, 1)])
+    for attempt in range(burst):
+        assert failed_login(client, f'user{attempt}', '203.0.113.5').status_code == 401
+
+    response = failed_login(client, 'someone', '203.0.113.5')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert 'Too many login attempts' in response.get_json()['error']
+
+    # Another client behind the same proxy is not locked out
+    response = client.post('/api/login', json={'username': 'admin', 'password': 'admin'},
+                           headers={'X-Forwarded-For': '198.51.100.7'})
+    assert response.status_code == 200
+
+
+def test_successful_login_does_not_count(app_module, client):
+    for _ in range(10):
+        response = client.post('/api/login', json={'username': 'admin', 'password': 'admin'},
+                               headers={'X-Forwarded-For': '203.0.113.9'})
+        assert response.status_code == 200
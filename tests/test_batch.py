@@ -0,0 +1,83 @@
+import json
+import time
+
+import pytest
+
+import batch
+from batch import RateLimiter, run_batch
+from generation import FakeBackend
+
+STUDENT = {'instrument': 'Piano', 'skillLevel': 'Beginner', 'currentAssignments': 'Scales', 'currentGoals': 'Recital'}
+
+
+def test_identical_prompts_share_one_generation():
+    students = [
+        dict(STUDENT, id='s1', name='Ada'),
+        dict(STUDENT, id='s2', name='Grace'),
+        dict(STUDENT, id='s3', name='Alan', instrument='Violin'),
+    ]
+    backend = FakeBackend()
+    results = list(run_batch('recommendations', students, backend, limiter=RateLimiter(0)))
+    # Recommendation prompts leave out the name: Ada and Grace get the same one
+    assert backend.calls == 2
+    assert sorted(result['studentId'] for result in results) == ['s1', 's2', 's3']
+    assert all(result['ok'] for result in results)
+    by_id = {result['studentId']: result for result in results}
+    assert by_id['s1']['changes'] == by_id['s2']['changes']
+
+
+@pytest.fixture
+def batch_client(app_module, client, monkeypatch):
+    monkeypatch.setattr(batch, 'rate_limiter', RateLimiter(0))
+    writes = []
+    update_many = app_module.student_store.update_many
+    monkeypatch.setattr(app_module.student_store, 'update_many', lambda changes: writes.append(changes) or update_many(changes))
+    client.writes = writes
+    return client
+
+
+def add_students(client, *names):
+    return [client.post('/api/students', json=dict(STUDENT, name=name)).get_json()['id'] for name in names]
+
+
+def test_streamed_batch(app_module, batch_client):
+    ids = add_students(batch_client, 'Ada', 'Grace')
+    calls = app_module.model_client.backend.calls
+    response = batch_client.post('/api/ai-batch', json={'kind': 'recommendations', 'studentIds': ids + ['missing']})
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0] == {'studentId': 'missing', 'ok': False, 'error': 'Student not found'}
+    assert sorted(line['studentId'] for line in lines[1:3]) == sorted(ids)
+    assert lines[-1] == {'done': True, 'succeeded': 2, 'failed': 1}
+    assert app_module.model_client.backend.calls == calls + 1
+    # Every result saved with one store write
+    assert len(batch_client.writes) == 1 and sorted(batch_client.writes[0]) == sorted(ids)
+    for student_id in ids:
+        assert batch_client.get(f'/api/students/{student_id}').get_json()['recommendations']
+
+
+def test_large_batch_runs_as_a_job(app_module, batch_client, monkeypatch):
+    monkeypatch.setattr(app_module, 'AI_BATCH_STREAM_MAX_STUDENTS', 2)
+    ids = add_students(batch_client, 'Ada', 'Grace', 'Alan')
+    body = {'kind': 'lessonPlan', 'studentIds': ids}
+    response = batch_client.post('/api/ai-batch', json=body)
+    assert response.status_code == 400
+    assert 'async=true' in response.get_json()['error']
+
+    response = batch_client.post('/api/ai-batch?async=true', json=body)
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['kind'] == 'batch' and job['document'] == 'lessonPlan' and job['studentCount'] == 3
+    deadline = time.monotonic() + 5
+    while job['status'] in ('queued', 'running') and time.monotonic() < deadline:
+        time.sleep(0.02)
+        job = batch_client.get(f"/api/jobs/{job['id']}").get_json()
+    assert job['status'] == 'succeeded'
+    assert job['result'] == {'succeeded': 3, 'failed': 0, 'errors': []}
+    assert job['progress'] == 'Done'
+    assert len(batch_client.writes) == 1
+    rows = batch_client.get('/api/students?fields=summary').get_json()
+    assert all(row['hasLessonPlan'] for row in rows)
@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip('google.generativeai')
+
+from google.ai import generativelanguage as glm
+
+from generation import GeminiBackend
+
+
+def _response(text):
+    return glm.GenerateContentResponse(candidates=[{'content': {'parts': [{'text': text}], 'role': 'model'}}])
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replace the SDK's transport: record each call's keyword arguments and answer with canned text."""
+    calls = []
+
+    def generate_content(self, request, **kwargs):
+        calls.append(kwargs)
+        return _response('### Week 1-2')
+
+    def stream_generate_content(self, request, **kwargs):
+        calls.append(kwargs)
+        return iter([_response('### Week'), _response(' 1-2')])
+
+    monkeypatch.setattr(glm.GenerativeServiceClient, 'generate_content', generate_content)
+    monkeypatch.setattr(glm.GenerativeServiceClient, 'stream_generate_content', stream_generate_content)
+    return calls
+
+
+def test_generate_passes_timeout(calls):
+    backend = GeminiBackend(api_key='test-key', transport='rest')
+    assert backend.generate('Create an 8-week plan', timeout=12) == '### Week 1-2'
+    assert calls == [{'timeout': 12}]
+
+
+def test_generate_stream_passes_timeout(calls):
+    backend = GeminiBackend(api_key='test-key', transport='rest')
+    assert ''.join(backend.generate_stream('Create an 8-week plan', timeout=5)) == '### Week 1-2'
+    assert calls == [{'timeout': 5}]
+
+
+def test_generate_without_timeout(calls):
+    backend = GeminiBackend(api_key='test-key', transport='rest')
+    backend.generate('Create an 8-week plan')
+    assert calls == [{}]
@@ -0,0 +1,27 @@
+import io
+import itertools
+
+import pytest
+
+from importer import ImportFormatError, read_roster
+
+HEADER = 'First Name,Last Name,Age,Instrument,Skill Level,Book,Current book page,Current Pieces,Goals\n'
+
+
+def new_id(counter=itertools.count(1)):
+    return str(next(counter))
+
+
+def test_reads_utf8_csv():
+    data = (HEADER + 'Zoë,Brontë,12,Piano,2,Alfred,45,Für Elise,Sight reading\n').encode('utf-8-sig')
+    result = read_roster(io.BytesIO(data), 'roster.csv', new_id)
+    assert [s['name'] for s in result['students']] == ['Zoë Brontë']
+
+
+@pytest.mark.parametrize('rows_before', [0, 5000])
+def test_rejects_csv_that_is_not_utf8(rows_before):
+    # The bad bytes may sit in the first block read with the header, or far down the file
+    data = (HEADER + 'Ada,Lovelace,30,Piano,1,Alfred,1,Minuet,Scales\n' * rows_before).encode('utf-8')
+    data += 'Zoë,Brontë,12,Piano,2,Alfred,45,Für Elise,Sight reading\n'.encode('latin-1')
+    with pytest.raises(ImportFormatError, match='UTF-8'):
+        read_roster(io.BytesIO(data), 'roster.csv', new_id)
@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from generation import FakeBackend, generate_artifact
+from jobs import JobQueue, QueueFull
+from model_client import ModelClient
+
+STUDENT = {
+    'id': 's1', 'name': 'Ada', 'age': 12, 'instrument': 'Piano', 'skillLevel': 'Beginner',
+    'currentAssignments': 'Scales', 'currentGoals': 'Recital',
+}
+
+
+def wait_for(queue, job_id, *statuses):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is still {job['status']}")
+
+
+def wait_until_idle(queue):
+    deadline = time.monotonic() + 5
+    while queue.in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.in_flight == 0
+
+
+def held_job(progress_message='Calling the AI model'):
+    """A job that reports progress, then waits for ``release`` before finishing."""
+    started, release = threading.Event(), threading.Event()
+
+    def run(progress):
+        progress(progress_message)
+        started.set()
+        release.wait(5)
+        return {'done': True}
+
+    return run, started, release
+
+
+def test_job_runs_to_success(tmp_path):
+    queue = JobQueue(tmp_path / 'jobs', max_workers=1)
+    run, started, release = held_job()
+    job = queue.submit('lessonPlan', run, studentId='s1')
+    assert job['status'] == 'queued' and job['studentId'] == 's1'
+
+    assert started.wait(5)
+    running = wait_for(queue, job['id'], 'running')
+    assert running['progress'] == 'Calling the AI model'
+    assert queue.in_flight == 1
+
+    release.set()
+    done = wait_for(queue, job['id'], 'succeeded')
+    assert done['result'] == {'done': True}
+    assert done['progress'] == 'Done'
+    wait_until_idle(queue)
+
+
+def test_job_with_the_fake_model(tmp_path):
+    queue = JobQueue(tmp_path / 'jobs')
+    client = ModelClient(FakeBackend())
+    job = queue.submit('lessonPlan', lambda progress: generate_artifact('lessonPlan', STUDENT, client)[0])
+    assert wait_for(queue, job['id'], 'succeeded')['result'] == FakeBackend().responses['lessonPlan']
+
+
+def test_failed_job_records_the_error(tmp_path):
+    queue = JobQueue(tmp_path / 'jobs')
+
+    def run(progress):
+        raise ValueError('Student not found')
+
+    job = queue.submit('lessonPlan', run)
+    failed = wait_for(queue, job['id'], 'failed')
+    assert failed['error'] == 'Student not found'
+    assert failed['result'] is None
+    wait_until_idle(queue)
+
+
+def test_queue_full(tmp_path):
+    queue = JobQueue(tmp_path / 'jobs', max_workers=1, max_pending=2)
+    run, started, release = held_job()
+    first = queue.submit('lessonPlan', run)
+    second = queue.submit('lessonPlan', lambda progress: 'second')
+    with pytest.raises(QueueFull):
+        queue.submit('lessonPlan', lambda progress: 'third')
+
+    release.set()
+    wait_for(queue, first['id'], 'succeeded')
+    wait_for(queue, second['id'], 'succeeded')
+    wait_until_idle(queue)
+    third = queue.submit('lessonPlan', lambda progress: 'third')
+    assert wait_for(queue, third['id'], 'succeeded')['result'] == 'third'
+
+
+def test_failed_save_does_not_hold_a_slot(tmp_path, monkeypatch):
+    queue = JobQueue(tmp_path / 'jobs', max_pending=1)
+    real = jobs.atomic_write_json
+
+    def disk_full(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(jobs, 'atomic_write_json', disk_full)
+    for _ in range(3):
+        with pytest.raises(OSError):
+            queue.submit('lessonPlan', lambda progress: 'never run')
+    assert queue.in_flight == 0
+
+    monkeypatch.setattr(jobs, 'atomic_write_json', real)
+    job = queue.submit('lessonPlan', lambda progress: 'ran')
+    assert wait_for(queue, job['id'], 'succeeded')['result'] == 'ran'
+
+
+def test_status_updates_failing_still_release_the_slot(tmp_path, monkeypatch):
+    queue = JobQueue(tmp_path / 'jobs', max_pending=1)
+    real = jobs.atomic_write_json
+    writes = []
+
+    def fail_after_submit(*args, **kwargs):
+        writes.append(args)
+        if len(writes) > 1:
+            raise OSError(28, 'No space left on device')
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(jobs, 'atomic_write_json', fail_after_submit)
+    queue.submit('lessonPlan', lambda progress: 'lost')
+    wait_until_idle(queue)
+
+
+def test_get_from_another_queue(tmp_path):
+    queue, other = JobQueue(tmp_path / 'jobs'), JobQueue(tmp_path / 'jobs')
+    run, started, release = held_job('Saving')
+    job = queue.submit('journeyReport', run, submittedBy='teacher')
+    assert started.wait(5)
+    # Another gunicorn worker answers status requests from the same files
+    running = wait_for(other, job['id'], 'running')
+    assert running['progress'] == 'Saving'
+    assert running['submittedBy'] == 'teacher'
+
+    release.set()
+    assert wait_for(other, job['id'], 'succeeded')['result'] == {'done': True}
+    assert other.get('0' * 32) is None
+    assert other.get('../users') is None
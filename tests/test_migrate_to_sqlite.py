@@ -0,0 +1,53 @@
+from artifacts import ArtifactStore, store_documents
+from migrate_to_sqlite import migrate
+from notes import NoteLog
+from sqlite_store import SqliteArtifactStore, SqliteDatabase, SqliteNoteLog, SqliteStudentStore
+from store import StudentStore
+
+
+def make_student(student_id, name='Ada'):
+    return {
+        'id': student_id, 'name': name, 'instrument': 'Piano', 'skillLevel': 'Beginner',
+        'currentAssignments': 'Scales', 'timestamp': '2026-01-01T00:00:00',
+    }
+
+
+def test_migrate_copies_notes_and_summary(tmp_path):
+    data_dir = tmp_path / 'data'
+    students = StudentStore(data_dir / 'students.json')
+    students.put(make_student('s1'))
+    students.put(make_student('s2', 'Grace'))
+    notes = NoteLog(data_dir / 'notes')
+    notes.append('s1', 'Worked on a Bach minuet', author='t1')
+    notes.append('s1', 'Scales in G major')
+    notes.save_summary('s1', {'text': 'Bach minuets', 'throughSeq': 1, 'updatedAt': '2026-01-02T00:00:00'})
+
+    assert migrate(data_dir, tmp_path / 'db.sqlite') == (2, 2, 0)
+
+    sqlite_notes = SqliteNoteLog(SqliteDatabase(tmp_path / 'db.sqlite'))
+    assert [(n['seq'], n['text'], n['author']) for n in sqlite_notes.recent('s1', 10)] == [
+        (1, 'Worked on a Bach minuet', 't1'), (2, 'Scales in G major', None),
+    ]
+    assert sqlite_notes.summary('s1')['text'] == 'Bach minuets'
+    assert sqlite_notes.count('s2') == 0
+    assert [r['id'] for r, _ in SqliteStudentStore(SqliteDatabase(tmp_path / 'db.sqlite')).search('minuet')] == ['s1']
+
+    # Running it again leaves one copy of each note
+    migrate(data_dir, tmp_path / 'db.sqlite')
+    assert sqlite_notes.count('s1') == 2
+    assert len(sqlite_notes.recent('s1', 10)) == 2
+
+
+def test_migrate_copies_current_documents(tmp_path):
+    data_dir = tmp_path / 'data'
+    students = StudentStore(data_dir / 'students.json')
+    students.put(make_student('s1'))
+    documents = ArtifactStore(data_dir / 'artifacts')
+    students.update('s1', store_documents(documents, 's1', {'lessonPlan': '### Week 1-2: Minuet'}))
+
+    migrate(data_dir, tmp_path / 'db.sqlite')
+
+    database = SqliteDatabase(tmp_path / 'db.sqlite')
+    ref = SqliteStudentStore(database).get('s1')['lessonPlanRef']
+    assert SqliteArtifactStore(database).get('s1', 'lessonPlan', ref['version']) == '### Week 1-2: Minuet'
+    assert [r['id'] for r, _ in SqliteStudentStore(database).search('minuet')] == ['s1']
@@ -0,0 +1,178 @@
+import time
+
+import pytest
+
+from generation import FakeBackend
+from model_client import AI_BREAKER_FAILURES, CircuitBreaker, ModelClient, ModelUnavailable
+
+PROMPT = 'Create an 8-week plan'
+PLAN = FakeBackend().responses['lessonPlan']
+
+
+class ApiError(Exception):
+    """An error carrying an HTTP status, as the Gemini SDK raises them."""
+
+    def __init__(self, code):
+        super().__init__(f'HTTP {code}')
+        self.code = code
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff pauses, recorded instead of slept."""
+    sleeps = []
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    return sleeps
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    return clock
+
+
+def test_retries_retryable_errors_with_backoff(sleeps):
+    backend = FakeBackend(failures=[TimeoutError('slow'), ApiError(503)])
+    client = ModelClient(backend, max_retries=2)
+    assert client.generate(PROMPT) == PLAN
+    assert backend.calls == 3
+    # Full jitter: up to 1s before the first retry, up to 2s before the second
+    assert len(sleeps) == 2 and 0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2
+    assert client.breaker.state == 'closed'
+    assert client.in_flight == 0
+
+
+def test_gives_up_after_max_retries(sleeps):
+    backend = FakeBackend(failures=[ApiError(429)] * 3)
+    client = ModelClient(backend, max_retries=2)
+    with pytest.raises(ModelUnavailable, match='ApiError'):
+        client.generate(PROMPT)
+    assert backend.calls == 3
+    assert len(sleeps) == 2
+
+
+@pytest.mark.parametrize('error', [ValueError('Invalid prompt'), ApiError(400)])
+def test_does_not_retry_other_errors(sleeps, error):
+    backend = FakeBackend(failures=[error, error])
+    client = ModelClient(backend, max_retries=2, breaker=CircuitBreaker(failure_threshold=1))
+    with pytest.raises(type(error)):
+        client.generate(PROMPT)
+    assert backend.calls == 1
+    assert sleeps == []
+    # The provider answered; a bad request does not count towards opening the circuit
+    assert client.breaker.state == 'closed'
+
+
+def test_breaker_opens_after_consecutive_failures(sleeps, clock):
+    backend = FakeBackend(failures=[TimeoutError()] * AI_BREAKER_FAILURES)
+    client = ModelClient(backend, max_retries=0)
+    for _ in range(AI_BREAKER_FAILURES):
+        assert client.breaker.state == 'closed'
+        with pytest.raises(ModelUnavailable):
+            client.generate(PROMPT)
+    assert client.breaker.state == 'open'
+
+    # Open: fails at once without calling the provider
+    with pytest.raises(ModelUnavailable, match='temporarily unavailable'):
+        client.generate(PROMPT)
+    assert backend.calls == AI_BREAKER_FAILURES
+
+
+def test_retries_stop_once_the_breaker_opens(sleeps, clock):
+    backend = FakeBackend(failures=[TimeoutError()] * 10)
+    client = ModelClient(backend, max_retries=5, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=30))
+    with pytest.raises(ModelUnavailable):
+        client.generate(PROMPT)
+    assert backend.calls == 2
+    assert client.breaker.state == 'open'
+
+
+def open_breaker(client, clock):
+    client.backend.failures = [TimeoutError()] * client.breaker.failure_threshold
+    for _ in range(client.breaker.failure_threshold):
+        with pytest.raises(ModelUnavailable):
+            client.generate(PROMPT)
+    assert client.breaker.state == 'open'
+    clock.now += client.breaker.reset_seconds
+    assert client.breaker.state == 'half-open'
+
+
+class TrialBackend(FakeBackend):
+    """Checks, during the trial call, that no other call is let through."""
+
+    def generate(self, prompt, timeout=None):
+        self.others_allowed = self.breaker.allow()
+        return super().generate(prompt, timeout)
+
+
+def test_half_open_trial_call_closes_the_breaker(sleeps, clock):
+    backend = TrialBackend()
+    client = ModelClient(backend, max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=30))
+    backend.breaker = client.breaker
+    open_breaker(client, clock)
+
+    assert client.generate(PROMPT) == PLAN
+    assert backend.others_allowed is False
+    assert client.breaker.state == 'closed'
+    assert client.generate(PROMPT) == PLAN
+
+
+def test_failed_trial_call_reopens_the_breaker(sleeps, clock):
+    backend = FakeBackend()
+    client = ModelClient(backend, max_retries=3, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=30))
+    open_breaker(client, clock)
+    calls = backend.calls
+
+    backend.failures = [TimeoutError()]
+    with pytest.raises(ModelUnavailable):
+        client.generate(PROMPT)
+    # One failure is enough in half-open, and it is not retried
+    assert backend.calls == calls + 1
+    assert client.breaker.state == 'open'
+
+
+def test_stream_retries_before_the_first_chunk(sleeps):
+    backend = FakeBackend(failures=[TimeoutError()])
+    client = ModelClient(backend, max_retries=2)
+    assert ''.join(client.generate_stream(PROMPT)) == PLAN
+    assert backend.calls == 2
+    assert len(sleeps) == 1
+
+
+class BrokenStreamBackend(FakeBackend):
+    """Sends one chunk, then the connection drops."""
+
+    def generate_stream(self, prompt, timeout=None):
+        self.calls += 1
+        yield PLAN[:10]
+        raise ConnectionError('stream reset')
+
+
+def test_stream_does_not_retry_after_the_first_chunk(sleeps):
+    backend = BrokenStreamBackend()
+    client = ModelClient(backend, max_retries=2)
+    chunks = []
+    with pytest.raises(ModelUnavailable, match='ConnectionError'):
+        for chunk in client.generate_stream(PROMPT):
+            chunks.append(chunk)
+    # A retry would send the client the start of the document twice
+    assert chunks == [PLAN[:10]]
+    assert backend.calls == 1
+    assert sleeps == []
+    assert client.in_flight == 0
+
+
+def test_deadline_is_passed_to_the_backend(sleeps):
+    backend = FakeBackend(delay=0.2)
+    client = ModelClient(backend, timeout=0.01, max_retries=0)
+    with pytest.raises(ModelUnavailable, match='TimeoutError'):
+        client.generate(PROMPT)
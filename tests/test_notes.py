@@ -0,0 +1,116 @@
+import pytest
+
+from notes import NoteLog, move_legacy_history
+from sqlite_store import SqliteDatabase, SqliteNoteLog, SqliteStudentStore
+from store import StudentStore
+
+HISTORY = """2025-09-02: Started Minuet in G
+
+2025-09-09: Hands together, slow tempo
+"""
+
+
+def make_student(student_id, **fields):
+    record = {
+        'id': student_id, 'name': 'Ada', 'instrument': 'Piano', 'skillLevel': 'Beginner',
+        'currentAssignments': 'Scales', 'lessonNoteHistory': '', 'timestamp': '2025-09-01T10:00:00',
+    }
+    record.update(fields)
+    return record
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def stores(request, tmp_path):
+    """(student store, note log) for each backend."""
+    if request.param == 'sqlite':
+        database = SqliteDatabase(tmp_path / 'db.sqlite')
+        return SqliteStudentStore(database), SqliteNoteLog(database)
+    note_log = NoteLog(tmp_path / 'notes')
+    return StudentStore(tmp_path / 'students.json', note_log=note_log), note_log
+
+
+def texts(note_log, student_id):
+    notes, _ = note_log.page(student_id, limit=100)
+    return [(note['seq'], note['text']) for note in reversed(notes)]
+
+
+def test_history_becomes_notes(stores):
+    student_store, note_log = stores
+    student_store.put_many([make_student('s1', lessonNoteHistory=HISTORY), make_student('s2')])
+
+    assert move_legacy_history(note_log, student_store) == 1
+    assert texts(note_log, 's1') == [(1, '2025-09-02: Started Minuet in G'), (2, '2025-09-09: Hands together, slow tempo')]
+    student = student_store.get('s1')
+    assert student['lessonNoteHistory'] == ''
+    assert student['noteCount'] == 2
+    assert student['lastNote']['text'] == '2025-09-09: Hands together, slow tempo'
+    assert [record['id'] for record, _ in student_store.search('minuet')] == ['s1']
+    # Students without a history are left alone
+    assert student_store.get('s2')['version'] == 1
+    assert texts(note_log, 's2') == []
+
+    # Once moved, there is nothing left to do
+    assert move_legacy_history(note_log, student_store) == 0
+
+
+def test_history_goes_before_notes_already_logged(stores):
+    student_store, note_log = stores
+    student_store.put(make_student('s1', lessonNoteHistory=HISTORY))
+    note_log.append('s1', 'Recital piece chosen', author='grace')
+    note_log.save_summary('s1', {'text': 'Chose a recital piece.', 'throughSeq': 1, 'updatedAt': '2025-10-01T00:00:00'})
+
+    assert move_legacy_history(note_log, student_store) == 1
+    assert texts(note_log, 's1') == [
+        (1, '2025-09-02: Started Minuet in G'),
+        (2, '2025-09-09: Hands together, slow tempo'),
+        (3, 'Recital piece chosen'),
+    ]
+    assert note_log.page('s1', limit=1)[0][0]['author'] == 'grace'
+    assert student_store.get('s1')['noteCount'] == 3
+    # The summary covered the old numbering; it is rebuilt over the new one
+    assert note_log.summary('s1') is None
+    # New notes continue the numbering
+    assert note_log.append('s1', 'Memorised')['seq'] == 4
+
+
+class InterruptedStore:
+    """The notes get written, then the process stops before the records are updated."""
+
+    def __init__(self, student_store):
+        self.values = student_store.values
+
+    def update_many(self, changes_by_id):
+        return 0
+
+
+def test_interrupted_move_is_not_repeated(stores):
+    student_store, note_log = stores
+    student_store.put(make_student('s1', lessonNoteHistory=HISTORY))
+    note_log.append('s1', 'Recital piece chosen')
+    move_legacy_history(note_log, InterruptedStore(student_store))
+
+    assert move_legacy_history(note_log, student_store) == 1
+    assert [seq for seq, _ in texts(note_log, 's1')] == [1, 2, 3]
+    assert student_store.get('s1')['noteCount'] == 3
+
+
+def test_put_leaves_the_history_alone(client):
+    student = client.post('/api/students', json={
+        'name': 'Ada', 'instrument': 'Piano', 'skillLevel': 'Beginner', 'currentAssignments': 'Scales',
+    }).get_json()
+    client.post(f"/api/students/{student['id']}/notes", json={'text': 'Started Minuet in G'})
+
+    response = client.put(f"/api/students/{student['id']}", json={
+        'name': 'Ada', 'instrument': 'Piano', 'skillLevel': 'Beginner', 'currentAssignments': 'Scales',
+        'lessonNoteHistory': 'Overwritten',
+    })
+    assert response.status_code == 200
+    assert response.get_json()['lessonNoteHistory'] == ''
+    assert response.get_json()['noteCount'] == 1
+
+
+def test_startup_moves_the_history(app_module):
+    app_module.student_store.put(make_student('s1', lessonNoteHistory=HISTORY))
+    app_module.create_app({'TESTING': True})
+    assert app_module.student_store.get('s1')['noteCount'] == 2
+    assert app_module.note_log.count('s1') == 2
@@ -0,0 +1,103 @@
+from pathlib import Path
+
+import pytest
+
+from generation import FakeBackend, GenerationError, generate_artifact
+from parsing import ParseStats, extract_json_array, parse_stats
+
+# Recorded model responses, one per kind of defect seen in real generations
+FIXTURES = Path(__file__).parent / 'fixtures' / 'recommendations'
+FIELDS = ('title', 'composer', 'focus')
+
+MINUET = {'title': 'Minuet in G', 'composer': 'J. S. Bach', 'focus': 'Even articulation'}
+FUR_ELISE = {'title': 'Für Elise', 'composer': 'L. van Beethoven', 'focus': 'Voicing the melody'}
+
+STUDENT = {
+    'id': 's1', 'name': 'Ada', 'age': 12, 'instrument': 'Piano', 'skillLevel': 'Beginner',
+    'currentAssignments': 'Scales', 'currentGoals': 'Recital',
+}
+
+
+def fixture(name):
+    return (FIXTURES / f'{name}.txt').read_text(encoding='utf-8')
+
+
+@pytest.mark.parametrize('name, path', [
+    ('direct', 'direct'),
+    ('wrapped', 'direct'),
+    ('fenced', 'extracted'),
+    ('prose', 'extracted'),
+    ('smart_quotes', 'smartQuotes'),
+    ('trailing_commas', 'trailingCommas'),
+    ('single_quotes', 'pythonLiteral'),
+    ('truncated', 'truncated'),
+])
+def test_recorded_responses(name, path):
+    stats = ParseStats()
+    assert extract_json_array(fixture(name), FIELDS, stats=stats) == [MINUET, FUR_ELISE]
+    assert stats.snapshot() == dict(dict.fromkeys(ParseStats.PATHS, 0), **{path: 1})
+
+
+def test_items_without_every_field_are_dropped():
+    stats = ParseStats()
+    assert extract_json_array(fixture('missing_fields'), FIELDS, stats=stats) == [MINUET]
+    assert stats.snapshot()['direct'] == 1
+
+
+@pytest.mark.parametrize('text', [fixture('unusable'), '', None, '[]', '[{"title": "Minuet in G"}]'])
+def test_unusable_responses(text):
+    stats = ParseStats()
+    with pytest.raises(ValueError):
+        extract_json_array(text, FIELDS, stats=stats)
+    assert not any(stats.snapshot().values())
+
+
+class ScriptedBackend(FakeBackend):
+    """Answers each call with the next recorded response."""
+
+    def __init__(self, *texts):
+        super().__init__()
+        self.texts = list(texts)
+
+    def generate(self, prompt, timeout=None):
+        super().generate(prompt, timeout)
+        return self.texts.pop(0)
+
+
+def counts_during(action):
+    before = parse_stats.snapshot()
+    result = action()
+    after = parse_stats.snapshot()
+    return result, {path: after[path] - before[path] for path in after if after[path] != before[path]}
+
+
+def test_unusable_response_is_reformatted_by_the_model():
+    backend = ScriptedBackend(fixture('unusable'), fixture('fenced'))
+    (value, changes), counts = counts_during(lambda: generate_artifact('recommendations', STUDENT, backend))
+    assert value == [MINUET, FUR_ELISE]
+    assert counts == {'failed': 1, 'reprompted': 1, 'extracted': 1}
+    assert backend.calls == 2
+    # The re-prompt carries the unusable answer for the model to restate
+    assert fixture('unusable') in backend.prompts[-1]
+
+
+def test_reformatted_response_still_unusable():
+    backend = ScriptedBackend(fixture('unusable'), fixture('unusable'))
+    with pytest.raises(GenerationError):
+        counts_during(lambda: generate_artifact('recommendations', STUDENT, backend))
+    assert backend.calls == 2
+
+
+def test_repaired_response_needs_no_reprompt():
+    backend = ScriptedBackend(fixture('trailing_commas'))
+    (value, _), counts = counts_during(lambda: generate_artifact('recommendations', STUDENT, backend))
+    assert value == [MINUET, FUR_ELISE]
+    assert counts == {'trailingCommas': 1}
+    assert backend.calls == 1
+
+
+def test_text_documents_are_not_reprompted():
+    backend = ScriptedBackend('not json, and that is fine')
+    value, changes = generate_artifact('lessonPlan', STUDENT, backend)
+    assert value == changes['lessonPlan'] == 'not json, and that is fine'
+    assert backend.calls == 1
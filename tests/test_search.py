@@ -0,0 +1,125 @@
+import pytest
+
+from artifacts import ArtifactStore, move_inline_documents, store_documents
+from notes import NoteLog
+from search import SearchIndex
+from sqlite_store import SqliteArtifactStore, SqliteDatabase, SqliteNoteLog, SqliteStudentStore
+from store import StudentStore
+
+
+def make_student(student_id, name='Ada', **fields):
+    record = {
+        'id': student_id, 'name': name, 'instrument': 'Piano', 'skillLevel': 'Beginner',
+        'currentAssignments': 'Scales', 'timestamp': '2026-01-01T00:00:00',
+    }
+    record.update(fields)
+    return record
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def stores(request, tmp_path):
+    """(student store, note log, artifact store) for each backend."""
+    if request.param == 'sqlite':
+        database = SqliteDatabase(tmp_path / 'db.sqlite')
+        return SqliteStudentStore(database), SqliteNoteLog(database), SqliteArtifactStore(database)
+    note_log = NoteLog(tmp_path / 'notes')
+    artifact_store = ArtifactStore(tmp_path / 'artifacts')
+    student_store = StudentStore(tmp_path / 'students.json', note_log=note_log, artifact_store=artifact_store)
+    return student_store, note_log, artifact_store
+
+
+def add_note(student_store, note_log, student_id, text):
+    """Append a note and copy the count onto the record, as app.add_note does."""
+    note = note_log.append(student_id, text)
+    student_store.update(student_id, {'noteCount': note['seq'], 'lastNote': note})
+
+
+def ids(results):
+    return [record['id'] for record, _ in results]
+
+
+def test_search_finds_lesson_notes(stores):
+    student_store, note_log, _ = stores
+    student_store.put(make_student('s1'))
+    student_store.put(make_student('s2', 'Grace'))
+    assert student_store.search('bach') == []
+
+    add_note(student_store, note_log, 's1', 'Started a Bach minuet')
+    add_note(student_store, note_log, 's1', 'Hands together at last')
+    assert ids(student_store.search('bach')) == ['s1']
+    assert ids(student_store.search('minuet hands')) == ['s1']
+
+    # Later record edits keep the notes indexed
+    student_store.update('s1', {'currentGoals': 'Recital'})
+    assert ids(student_store.search('bach recital')) == ['s1']
+
+    student_store.delete('s1')
+    assert student_store.search('bach') == []
+
+
+def test_search_finds_current_lesson_plan(stores):
+    student_store, _, artifact_store = stores
+    student_store.put(make_student('s1'))
+    student_store.put(make_student('s2', 'Grace'))
+    assert student_store.search('minuet') == []
+
+    student_store.update('s1', store_documents(artifact_store, 's1', {'lessonPlan': '### Week 1-2: Bach minuet'}))
+    assert ids(student_store.search('minuet')) == ['s1']
+    student_store.update('s1', {'currentGoals': 'Recital'})
+    assert ids(student_store.search('minuet recital')) == ['s1']
+
+    # A regenerated plan replaces the old one in the index
+    student_store.update('s1', store_documents(artifact_store, 's1', {'lessonPlan': '### Week 1-2: Clementi'}))
+    assert student_store.search('minuet') == []
+    assert ids(student_store.search('clementi')) == ['s1']
+
+
+def test_inline_plans_stay_searchable_when_moved(stores):
+    student_store, _, artifact_store = stores
+    student_store.put(make_student('s1', lessonPlan='### Week 1-2: Bach minuet'))
+    assert ids(student_store.search('minuet')) == ['s1']
+
+    assert move_inline_documents(artifact_store, student_store) == 1
+    assert 'lessonPlan' not in student_store.get('s1')
+    assert ids(student_store.search('minuet')) == ['s1']
+
+
+def test_notes_logged_before_the_index_is_built(tmp_path):
+    note_log = NoteLog(tmp_path / 'notes')
+    writer = StudentStore(tmp_path / 'students.json', note_log=note_log)
+    writer.put(make_student('s1'))
+    add_note(writer, note_log, 's1', 'Bach minuet')
+
+    # Another worker builds its index from the files, then follows the journal
+    reader = StudentStore(tmp_path / 'students.json', note_log=note_log)
+    assert ids(reader.search('bach')) == ['s1']
+    add_note(writer, note_log, 's1', 'Clementi sonatina')
+    assert ids(reader.search('clementi')) == ['s1']
+
+
+def test_sqlite_search_index_upgrade(tmp_path):
+    database = SqliteDatabase(tmp_path / 'db.sqlite')
+    SqliteStudentStore(database).put(make_student('s1'))
+    SqliteNoteLog(database).append('s1', 'Bach minuet')
+    plan = store_documents(SqliteArtifactStore(database), 's1', {'lessonPlan': 'Clementi sonatina'})
+    SqliteStudentStore(database).update('s1', plan)
+    conn = database.connect()
+    conn.execute("UPDATE meta SET value = 0 WHERE key = 'search_index'")
+    conn.execute('DELETE FROM students_fts')
+
+    reopened = SqliteDatabase(tmp_path / 'db.sqlite')
+    assert ids(SqliteStudentStore(reopened).search('minuet')) == ['s1']
+    assert ids(SqliteStudentStore(reopened).search('clementi')) == ['s1']
+
+
+def test_index_add_text():
+    index = SearchIndex()
+    index.add_text('s1', 'lessonNotes', 'Bach')
+    assert index.search('bach') == []
+    index.add('s1', make_student('s1'))
+    index.add_text('s1', 'lessonNotes', 'minuet')
+    assert [i for i, _ in index.search('bach minuet')] == ['s1']
+    index.add_text('s1', 'lessonNotes', 'Clementi', replace=True)
+    assert index.search('bach') == []
+    index.remove('s1')
+    assert index.search('clementi') == []
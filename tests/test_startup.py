@@ -0,0 +1,14 @@
+def test_startup_tasks_run_once_per_process(app_module, monkeypatch):
+    runs = []
+    init_default_admin = app_module.init_default_admin
+    monkeypatch.setattr(app_module, 'init_default_admin', lambda: runs.append(1) or init_default_admin())
+    # Left in the environment by an earlier master (e.g. before a USR2 upgrade): ignored
+    monkeypatch.setenv('STUDMGMT_STARTUP_DONE', '1')
+
+    app_module.run_startup_tasks()
+    assert runs == [1]
+    assert 'admin' in app_module.load_users()
+
+    app_module.run_startup_tasks()
+    app_module.create_app({'TESTING': True})
+    assert runs == [1]
@@ -0,0 +1,147 @@
+import json
+
+import pytest
+
+import store
+from store import StudentStore
+
+
+def make_student(student_id, name='Ada', **fields):
+    record = {
+        'id': student_id, 'name': name, 'instrument': 'Piano', 'skillLevel': 'Beginner',
+        'currentAssignments': 'Scales', 'timestamp': f'2026-01-01T00:00:{student_id[1:]:0>2}',
+    }
+    record.update(fields)
+    return record
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    """Open another StudentStore over the same files, as another gunicorn worker would."""
+    def open_store():
+        return StudentStore(tmp_path / 'students.json', compact_threshold=10_000)
+    return open_store
+
+
+def journal_lines(student_store):
+    return student_store.journal_path.read_bytes().splitlines()
+
+
+def test_replays_the_journal_across_instances(open_store):
+    first, second = open_store(), open_store()
+    first.put(make_student('s1'))
+    first.put(make_student('s2', 'Grace'))
+    assert second.get('s1')['name'] == 'Ada'
+
+    second.update('s1', {'currentGoals': 'Recital'})
+    second.delete('s2')
+    assert first.get('s1')['currentGoals'] == 'Recital'
+    assert first.get('s1')['version'] == 2
+    assert 's2' not in first
+    assert [r['id'] for r in first.scan()[0]] == ['s1']
+    # Three puts and a delete, each one journal line; no snapshot written yet
+    assert len(journal_lines(first)) == 4
+    assert not first.snapshot_path.exists()
+
+    # A fresh instance starts from the journal alone
+    assert open_store().all() == first.all()
+
+
+def test_skips_a_partial_trailing_line_until_it_is_complete(open_store):
+    writer, reader = open_store(), open_store()
+    writer.put(make_student('s1'))
+    line = json.dumps({'op': 'put', 'id': 's2', 'record': dict(make_student('s2', 'Grace'), version=1, changeSeq=2)}).encode()
+    with open(writer.journal_path, 'ab') as f:
+        f.write(line[:20])
+    # Another process is part way through appending
+    assert reader.get('s1') is not None
+    assert reader.get('s2') is None
+
+    with open(writer.journal_path, 'ab') as f:
+        f.write(line[20:] + b'\n')
+    assert reader.get('s2')['name'] == 'Grace'
+    assert reader.change_seq == 2
+
+
+def interrupt_snapshot(monkeypatch, action):
+    """Run ``action`` once compaction has started writing its snapshot, outside the store lock."""
+    real = store.temp_file_beside
+
+    def temp_file_beside(path):
+        monkeypatch.setattr(store, 'temp_file_beside', real)
+        action()
+        return real(path)
+
+    monkeypatch.setattr(store, 'temp_file_beside', temp_file_beside)
+
+
+def test_compaction_keeps_entries_appended_meanwhile(open_store, monkeypatch):
+    compacting, other = open_store(), open_store()
+    for number in range(1, 4):
+        compacting.put(make_student(f's{number}'))
+    compacting.delete('s3')
+
+    def write_meanwhile():
+        other.put(make_student('s4', 'Grace'))
+        other.update('s1', {'currentGoals': 'Recital'})
+
+    interrupt_snapshot(monkeypatch, write_meanwhile)
+    compacting.compact()
+
+    snapshot = json.loads(compacting.snapshot_path.read_text())
+    assert sorted(snapshot) == ['s1', 's2']
+    # The new journal: the deletion history, then what was written during compaction
+    entries = [json.loads(line) for line in journal_lines(compacting)]
+    assert [entry['op'] for entry in entries] == ['history', 'put', 'put']
+    assert entries[0]['tombstones'] == [[4, 's3']]
+
+    for reader in (compacting, other, open_store()):
+        assert sorted(reader.all()) == ['s1', 's2', 's4']
+        assert reader.get('s1')['currentGoals'] == 'Recital'
+        assert reader.changes(3) == (6, [reader.get('s4'), reader.get('s1')], ['s3'])
+
+
+def test_concurrent_compaction_loses_the_race(open_store, monkeypatch, tmp_path):
+    loser, winner = open_store(), open_store()
+    for number in range(1, 4):
+        loser.put(make_student(f's{number}'))
+
+    def compact_elsewhere():
+        winner.put(make_student('s4', 'Grace'))
+        winner.compact()
+
+    interrupt_snapshot(monkeypatch, compact_elsewhere)
+    loser.compact()
+
+    # The winner's snapshot stays, with the record written just before it compacted
+    assert sorted(json.loads(loser.snapshot_path.read_text())) == ['s1', 's2', 's3', 's4']
+    assert [json.loads(line)['op'] for line in journal_lines(loser)] == ['history']
+    assert sorted(loser.all()) == ['s1', 's2', 's3', 's4']
+    # The loser's half-finished snapshot is cleaned up
+    assert sorted(path.name for path in tmp_path.iterdir() if path.name.endswith('.tmp')) == []
+
+    loser.put(make_student('s5'))
+    assert sorted(winner.all()) == ['s1', 's2', 's3', 's4', 's5']
+
+
+def test_replace_all_writes_only_the_differences(open_store):
+    student_store = open_store()
+    student_store.put_many([make_student('s1'), make_student('s2', 'Grace'), make_student('s3', 'Alan')])
+    lines = len(journal_lines(student_store))
+
+    students = student_store.all()
+    students['s1']['currentGoals'] = 'Recital'
+    del students['s2']
+    students['s4'] = make_student('s4', 'Edsger')
+    assert student_store.replace_all(students) == 3
+
+    new_entries = [json.loads(line) for line in journal_lines(student_store)[lines:]]
+    assert sorted((entry['op'], entry['id']) for entry in new_entries) == [('delete', 's2'), ('put', 's1'), ('put', 's4')]
+    assert student_store.get('s1')['version'] == 2
+    assert student_store.get('s3')['version'] == 1
+    assert student_store.get('s4')['version'] == 1
+    assert sorted(open_store().all()) == ['s1', 's3', 's4']
+
+    # Nothing changed: nothing written
+    assert student_store.replace_all(student_store.all()) == 0
+    assert len(journal_lines(student_store)) == lines + 3
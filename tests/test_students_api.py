@@ -0,0 +1,20 @@
+STUDENT = {'name': 'Ada', 'instrument': 'Piano', 'skillLevel': 'Beginner', 'currentAssignments': 'Scales'}
+
+
+def test_summary_rows_leave_out_large_fields(app_module, client):
+    student = client.post('/api/students', json=STUDENT).get_json()
+    app_module.student_store.update(student['id'], {'lessonNoteHistory': 'A long history ' * 1000})
+    client.post(f"/api/students/{student['id']}/notes", json={'text': 'Started Minuet in G'})
+    client.post(f"/api/students/{student['id']}/lesson-plan")
+
+    rows = client.get('/api/students?fields=summary&limit=10').get_json()['students']
+    assert len(rows) == 1
+    row = rows[0]
+    assert 'lessonNoteHistory' not in row and 'lessonPlan' not in row and 'lessonPlanRef' not in row
+    assert row['lastNote']['text'] == 'Started Minuet in G'
+    assert row['hasLessonPlan'] is True
+
+    # The full student, loaded on demand, has them
+    full = client.get(f"/api/students/{student['id']}").get_json()
+    assert full['lessonNoteHistory'].startswith('A long history')
+    assert full['lessonPlan']
@@ -0,0 +1,89 @@
+import pytest
+
+from sqlite_store import SqliteDatabase, SqliteStudentStore
+from store import StudentStore, VersionConflict
+
+STUDENT = {
+    'name': 'Ada', 'instrument': 'Piano', 'skillLevel': 'Beginner', 'currentAssignments': 'Scales',
+}
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def two_stores(request, tmp_path):
+    """Two store instances over the same data, as two gunicorn workers would have."""
+    if request.param == 'sqlite':
+        return (SqliteStudentStore(SqliteDatabase(tmp_path / 'db.sqlite')),
+                SqliteStudentStore(SqliteDatabase(tmp_path / 'db.sqlite')))
+    return StudentStore(tmp_path / 'students.json'), StudentStore(tmp_path / 'students.json')
+
+
+def test_compare_and_swap_between_store_instances(two_stores):
+    first, second = two_stores
+    first.put(dict(STUDENT, id='s1'))
+    # Both workers read version 1; the first to save wins
+    assert second.get('s1')['version'] == 1
+    assert first.update('s1', {'currentGoals': 'Recital'}, expected_version=1)['version'] == 2
+    with pytest.raises(VersionConflict) as conflict:
+        second.update('s1', {'currentGoals': 'Exam'}, expected_version=1)
+    assert conflict.value.actual == 2
+    assert second.get('s1')['currentGoals'] == 'Recital'
+
+    assert second.update('s1', {'currentGoals': 'Exam'}, expected_version=2)['version'] == 3
+    assert first.get('s1')['currentGoals'] == 'Exam'
+
+
+def test_put_and_delete_check_the_version(two_stores):
+    first, second = two_stores
+    first.put(dict(STUDENT, id='s1'))
+    with pytest.raises(VersionConflict):
+        second.put(dict(STUDENT, id='s1', name='Grace'), expected_version=0)
+    with pytest.raises(VersionConflict):
+        second.delete('s1', expected_version=2)
+    assert second.delete('s1', expected_version=1)['name'] == 'Ada'
+    assert first.get('s1') is None
+
+
+@pytest.fixture
+def student(client):
+    response = client.post('/api/students', json=STUDENT)
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def put(client, student, headers=None, **fields):
+    return client.put(f"/api/students/{student['id']}", json=dict(STUDENT, **fields), headers=headers)
+
+
+@pytest.mark.parametrize('header', ['"1"', 'W/"1"', '1', '*'])
+def test_put_with_matching_if_match(client, student, header):
+    response = put(client, student, {'If-Match': header}, currentGoals='Recital')
+    assert response.status_code == 200
+    assert response.get_json()['version'] == 2
+
+
+def test_put_with_stale_if_match_is_412(client, student):
+    assert put(client, student, currentGoals='Recital').status_code == 200
+    response = put(client, student, {'If-Match': '"1"'}, currentGoals='Exam')
+    assert response.status_code == 412
+    assert response.get_json()['version'] == 2
+
+
+def test_put_with_stale_body_version_is_409(client, student):
+    assert put(client, student, version=1).status_code == 200
+    response = put(client, student, version=1)
+    assert response.status_code == 409
+    assert response.get_json()['version'] == 2
+
+
+@pytest.mark.parametrize('headers, fields', [
+    ({'If-Match': '"abc"'}, {}),
+    ({'If-Match': '"-1"'}, {}),
+    ({}, {'version': 'abc'}),
+    ({}, {'version': 1.5}),
+    ({}, {'version': True}),
+])
+def test_put_with_malformed_version_is_400(client, student, headers, fields):
+    response = put(client, student, headers, **fields)
+    assert response.status_code == 400
+    assert 'Invalid version' in response.get_json()['error']
+    assert client.get(f"/api/students/{student['id']}").get_json()['version'] == 1